@@ -6,13 +6,16 @@ import logging
 import flask
 from authlib.integrations.flask_client import OAuth
 
+import changelog
 import collection
+import compression
 import config
 import dataset
 import db_management
 import developer
 import order
 import schema
+import search
 import user
 import utils
 
@@ -23,6 +26,10 @@ app = flask.Flask(__name__)  # pylint: disable=invalid-name
 appconf = config.init()
 db_management.check_db(appconf)
 app.config.update(appconf)
+utils.API_KEY_CACHE.configure(**app.config.get("api_key_cache", {}))
+user.USER_CACHE.configure(**app.config.get("user_cache", {}))
+changelog.LOG_WRITER.configure(**app.config.get("log_writer", {}))
+COMPRESSION = compression.ResponseCompression(**app.config.get("compression", {}))
 
 if app.config["dev_mode"]["api"]:
     app.register_blueprint(developer.blueprint, url_prefix="/api/v1/developer")
@@ -32,8 +39,12 @@ app.register_blueprint(order.blueprint, url_prefix="/api/v1/order")
 app.register_blueprint(collection.blueprint, url_prefix="/api/v1/collection")
 app.register_blueprint(user.blueprint, url_prefix="/api/v1/user")
 app.register_blueprint(schema.blueprint, url_prefix="/api/v1/schema")
+app.register_blueprint(search.blueprint, url_prefix="/api/v1/search")
 
 
+# Endpoints authenticated by credentials in the request itself, not by the session
+CSRF_EXEMPT = ("key_token",)
+
 oauth = OAuth(app)
 for oidc_name in app.config.get("oidc_names"):
     oauth.register(oidc_name, client_kwargs={"scope": "openid profile email"})
@@ -41,37 +52,41 @@ for oidc_name in app.config.get("oidc_names"):
 
 @app.before_request
 def prepare():
-    """Open the database connection and get the current user."""
-    flask.g.dbclient = utils.get_dbclient(flask.current_app.config)
+    """Get the database connection and the current user."""
+    flask.g.dbclient = utils.get_shared_dbclient(flask.current_app.config)
     flask.g.db = utils.get_db(flask.g.dbclient, flask.current_app.config)
-    if apikey := flask.request.headers.get("X-API-Key"):
+    authorization = flask.request.headers.get("Authorization", "")
+    flask.g.token_auth = authorization.startswith("Bearer ")
+    if flask.g.token_auth:
+        token_data = utils.verify_api_token(authorization.removeprefix("Bearer "))
+        flask.g.user_context = user.make_user_context(
+            {"_id": token_data["user"]}, frozenset(token_data["permissions"])
+        )
+    elif apikey := flask.request.headers.get("X-API-Key"):
         if not (
             apiuser := flask.request.headers.get("X-API-User")
         ):  # pylint: disable=superfluous-parens
             flask.abort(status=400)
-        utils.verify_api_key(apiuser, apikey)
-        flask.g.current_user = flask.g.db["users"].find_one({"auth_ids": apiuser})
-        flask.g.permissions = flask.g.current_user["permissions"]
+        flask.g.user_context = user.make_user_context(utils.verify_api_key(apiuser, apikey))
     else:
-        if flask.request.method != "GET":
+        if flask.request.method != "GET" and flask.request.endpoint not in CSRF_EXEMPT:
             utils.verify_csrf_token()
-        flask.g.current_user = user.get_current_user()
-        flask.g.permissions = flask.g.current_user["permissions"] if flask.g.current_user else None
+        flask.g.user_context = user.make_user_context(user.get_current_user())
+    # shortcuts used by the request handlers
+    flask.g.current_user = flask.g.user_context.user
+    flask.g.permissions = flask.g.user_context.permissions
 
 
 @app.after_request
 def finalize(response):
     """Finalize the response and clean up."""
-    # close db connection
-    if hasattr(flask.g, "dbserver"):
-        flask.g.dbserver.close()
     # set csrf cookie if not set
     if not flask.request.cookies.get("_csrf_token"):
         response.set_cookie("_csrf_token", utils.gen_csrf_token(), samesite="Lax")
     # add some headers for protection
     response.headers["X-Frame-Options"] = "SAMEORIGIN"
     response.headers["X-XSS-Protection"] = "1; mode=block"
-    return response
+    return COMPRESSION.apply(flask.request, response)
 
 
 @app.route("/api/v1")
@@ -152,6 +167,33 @@ def key_login():
     return response
 
 
+@app.route("/api/v1/login/apikey/token", methods=["POST"])
+def key_token():
+    """
+    Get a short-lived token using an apikey.
+
+    The token is used as ``Authorization: Bearer <token>`` instead of a session,
+    and requests using it do not require a CSRF token. Getting the token does not
+    require a CSRF token either, since it is authenticated by the API key.
+    """
+    try:
+        indata = flask.json.loads(flask.request.data)
+    except json.decoder.JSONDecodeError:
+        flask.abort(status=400)
+
+    if "api-user" not in indata or "api-key" not in indata:
+        app.logger.debug("API token - bad keys: %s", indata)
+        return flask.Response(status=400)
+    user_info = utils.verify_api_key(indata["api-user"], indata["api-key"])
+    return flask.jsonify(
+        {
+            "token": utils.gen_api_token(user_info),
+            "token_type": "Bearer",
+            "expires_in": utils.api_token_ttl(),
+        }
+    )
+
+
 @app.route("/api/v1/logout")
 def logout():
     """Log out the current user."""
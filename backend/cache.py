@@ -0,0 +1,146 @@
+"""
+Small in-process caches.
+
+Caches are local to each worker process. Entries expire after a fixed time,
+so changes made by other processes are picked up within ``ttl`` seconds.
+"""
+import collections
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Thread-safe cache with a maximum size where entries expire after ``ttl`` seconds.
+
+    The least recently used entry is evicted when the cache is full.
+    Hits and misses are counted for ``stats``.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0, timer: Callable = time.monotonic):
+        """
+        Create the cache.
+
+        Args:
+            max_size (int): Maximum number of entries. ``0`` disables the cache.
+            ttl (float): Seconds until an entry expires.
+            timer (Callable): Function returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_size: int = None, ttl: float = None):
+        """
+        Change the size and/or expiry time of the cache.
+
+        All current entries are removed.
+
+        Args:
+            max_size (int): Maximum number of entries. ``0`` disables the cache.
+            ttl (float): Seconds until an entry expires.
+        """
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get the value for ``key`` if it is in the cache and has not expired.
+
+        Args:
+            key (Hashable): The key to look up.
+            default (Any): Value to return on a miss.
+
+        Returns:
+            Any: The cached value or ``default``.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self.timer():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Add or replace the value for ``key``.
+
+        Args:
+            key (Hashable): The key to use.
+            value (Any): The value to cache.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self.timer() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """
+        Remove ``key`` from the cache if it is there.
+
+        Args:
+            key (Hashable): The key to remove.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_matching(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """
+        Remove all entries where ``predicate(key, value)`` is true.
+
+        Args:
+            predicate (Callable): Function that gets the key and value of each entry.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        with self._lock:
+            to_remove = [key for key, entry in self._data.items() if predicate(key, entry[1])]
+            for key in to_remove:
+                del self._data[key]
+        return len(to_remove)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Get usage statistics for the cache.
+
+        Returns:
+            dict: Number of hits and misses, the hit rate and the current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
+
+    def __len__(self) -> int:
+        """Get the number of entries in the cache (including expired entries)."""
+        return len(self._data)
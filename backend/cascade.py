@@ -0,0 +1,167 @@
+"""
+Deletion of entries together with the references to them.
+
+Deleting datasets also removes them from the orders and collections that list
+them, and deleting an order deletes its datasets. The affected entries are found
+with the indexes on ``datasets``, the changes are done with bulk writes and all
+logs are written with one ``insert_many``, so the number of operations does not
+depend on the number of datasets.
+
+The changes are done in a transaction if the deployment supports it
+(see ``changelog.run_transaction``). The revisions (``changelog.bump_revisions``) and
+facet counts are updated after the transaction.
+"""
+import pymongo
+
+import facets
+import changelog
+
+# Collections that reference datasets in the field ``datasets``
+DATASET_PARENTS = ("collections", "orders")
+
+
+def _delete_datasets(db, identifiers: list, user_id, comment: str, dbsession=None) -> tuple:
+    """
+    Delete datasets and remove them from orders and collections.
+
+    Args:
+        db: Connection to the database.
+        identifiers (list): The datasets to delete.
+        user_id: The ``_id`` of the user performing the operation.
+        comment (str): The comment for the logs of the changed orders and collections.
+        dbsession: The MongoDB session used.
+
+    Returns:
+        tuple: (``list``: the logs, ``dict``: the changed entries per collection,
+            ``list``: the deleted datasets (``tags`` and ``properties``))
+    """
+    datasets = list(
+        db["datasets"].find(
+            {"_id": {"$in": identifiers}}, {"tags": 1, "properties": 1}, session=dbsession
+        )
+    )
+    identifiers = [dataset["_id"] for dataset in datasets]
+    if not identifiers:
+        return [], {}, []
+    db["datasets"].delete_many({"_id": {"$in": identifiers}}, session=dbsession)
+    logs = changelog.new_logs(
+        db,
+        "dataset",
+        "delete",
+        "Delete in datasets",
+        user_id,
+        [{"_id": identifier} for identifier in identifiers],
+        dbsession=dbsession,
+    )
+    changed = {"datasets": identifiers}
+
+    removed = set(identifiers)
+    for dbcollection in DATASET_PARENTS:
+        parents = list(
+            db[dbcollection].find({"datasets": {"$in": identifiers}}, session=dbsession)
+        )
+        if not parents:
+            continue
+        db[dbcollection].bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": parent["_id"]}, {"$pull": {"datasets": {"$in": identifiers}}}
+                )
+                for parent in parents
+            ],
+            ordered=False,
+            session=dbsession,
+        )
+        updated = [
+            {**parent, "datasets": [ds for ds in parent["datasets"] if ds not in removed]}
+            for parent in parents
+        ]
+        logs += changelog.new_logs(
+            db,
+            dbcollection[:-1],
+            "edit",
+            comment,
+            user_id,
+            updated,
+            previous=parents,
+            dbsession=dbsession,
+        )
+        changed[dbcollection] = [parent["_id"] for parent in parents]
+    return logs, changed, datasets
+
+
+def _finish(db, changed: dict, datasets: list):
+    """Update the revisions and facet counts after the changes."""
+    for dbcollection, identifiers in changed.items():
+        changelog.bump_revisions(db, dbcollection, identifiers)
+    facets.update_facets_many(db, "datasets", [(dataset, None) for dataset in datasets])
+
+
+def delete_datasets(db, identifiers: list, user_id, comment: str = "Dataset deleted") -> list:
+    """
+    Delete datasets and remove them from the orders and collections that list them.
+
+    Args:
+        db: Connection to the database.
+        identifiers (list): The datasets to delete.
+        user_id: The ``_id`` of the user performing the operation.
+        comment (str): The comment for the logs of the changed orders and collections.
+
+    Returns:
+        list: The ``_id`` of the deleted datasets.
+    """
+
+    def run(dbsession):
+        logs, changed, datasets = _delete_datasets(db, identifiers, user_id, comment, dbsession)
+        if logs:
+            changelog.insert_logs(db, logs, dbsession)
+        return changed, datasets
+
+    changed, datasets = changelog.run_transaction(db, run)
+    _finish(db, changed, datasets)
+    return changed.get("datasets", [])
+
+
+def delete_order(db, identifier: str, user_id) -> bool:
+    """
+    Delete an order and its datasets, and remove the datasets from all collections.
+
+    Args:
+        db: Connection to the database.
+        identifier (str): The order to delete.
+        user_id: The ``_id`` of the user performing the operation.
+
+    Returns:
+        bool: Whether the order was found and deleted.
+    """
+
+    def run(dbsession):
+        order = db["orders"].find_one_and_delete(
+            {"_id": identifier},
+            projection={"datasets": 1, "tags": 1, "properties": 1},
+            session=dbsession,
+        )
+        if not order:
+            return None, {}, []
+        logs = changelog.new_logs(
+            db,
+            "order",
+            "delete",
+            "Delete in orders",
+            user_id,
+            [{"_id": identifier}],
+            dbsession=dbsession,
+        )
+        ds_logs, changed, datasets = _delete_datasets(
+            db, order["datasets"], user_id, "Order deleted", dbsession
+        )
+        changelog.insert_logs(db, logs + ds_logs, dbsession)
+        changed.setdefault("orders", []).append(identifier)
+        return order, changed, datasets
+
+    order, changed, datasets = changelog.run_transaction(db, run)
+    if not order:
+        return False
+    _finish(db, changed, datasets)
+    facets.update_facets(db, "orders", order, None)
+    return True
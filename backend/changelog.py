@@ -0,0 +1,445 @@
+"""
+Change logs, revision counters and transactions for the writes of entries.
+
+Used by ``utils``, ``unit_of_work`` and ``cascade`` when entries are changed,
+so it must not import them.
+"""
+import datetime
+import uuid
+from typing import Any, Optional
+
+import pymongo
+
+import logwriter
+
+
+def empty_log() -> dict:
+    """
+    Provide a basic data structure for a log document.
+
+    Returns:
+        dict: The data structure for a log.
+    """
+    return {
+        "_id": "l-" + str(uuid.uuid4()),
+        "action": "",
+        "comment": "",
+        "data_type": "",
+        "data": "",
+        "revision": 0,
+        "checkpoint": False,
+        "timestamp": datetime.datetime.now(),
+        "user": "",
+    }
+
+
+def insert_logs(db, logs: list, dbsession=None) -> bool:
+    """
+    Insert logs.
+
+    Logs written in a transaction are inserted in the session. Other logs are
+    written with ``LOG_WRITER``, in the background if enabled.
+
+    Each revision of an entry can only be used once. Logs conflicting with logs
+    written at the same time are made again (see ``rebase_logs``); for logs in a
+    transaction the whole transaction is run again (see ``run_transaction``).
+
+    Args:
+        db: Connection to the database.
+        logs (list): The logs to insert.
+        dbsession: The MongoDB session used.
+
+    Returns:
+        bool: Whether the logs were inserted (or queued).
+    """
+    if dbsession is not None:
+        return db["logs"].insert_many(logs, session=dbsession).acknowledged
+    return LOG_WRITER.write(db, logs)
+
+
+# Fields of the logs that are only used to rebuild entries (see ``log_state``)
+LOG_PROJECTION = {"data_type": 0, "checkpoint": 0, "snapshot": 0}
+# Every LOG_CHECKPOINT_INTERVAL:th log of an entry includes the complete entry
+LOG_CHECKPOINT_INTERVAL = 20
+
+
+def log_delta(previous: Optional[dict], current: Optional[dict]) -> tuple:
+    """
+    Get the changes between two versions of an entry.
+
+    Args:
+        previous (dict): The entry before the change, ``None`` if it did not exist.
+        current (dict): The entry after the change, ``None`` if it was deleted.
+
+    Returns:
+        tuple: (``dict``: the changed fields, ``list``: the removed fields)
+    """
+    if current is None:
+        return {}, []
+    if previous is None:
+        return dict(current), []
+    changed = {
+        key: value
+        for key, value in current.items()
+        if key not in previous or previous[key] != value
+    }
+    return changed, [key for key in previous if key not in current]
+
+
+def apply_log(state: Optional[dict], log: dict) -> Optional[dict]:
+    """
+    Apply the changes in a log to an entry.
+
+    Args:
+        state (dict): The entry before the change, ``None`` if it did not exist.
+        log (dict): The log of the change.
+
+    Returns:
+        dict: The entry after the change, ``None`` if it was deleted.
+    """
+    if log["action"] == "delete":
+        return None
+    if "snapshot" in log:
+        return dict(log["snapshot"])
+    state = dict(state or {})
+    state.update(log["data"])
+    for key in log.get("removed", []):
+        state.pop(key, None)
+    return state
+
+
+def log_state(
+    db, data_type: str, identifier: Any, timestamp: datetime.datetime = None, dbsession=None
+) -> tuple:
+    """
+    Get the latest revision of an entry (at ``timestamp``) according to the logs.
+
+    The entry is rebuilt from the latest checkpoint, reading at most
+    ``LOG_CHECKPOINT_INTERVAL`` logs, so the time does not depend on the
+    length of the history.
+
+    Args:
+        db: Connection to the database.
+        data_type (str): The type of the entry (e.g. ``dataset``).
+        identifier: The ``_id`` of the entry.
+        timestamp (datetime.datetime): Only use the logs up to this time.
+        dbsession: The MongoDB session used.
+
+    Returns:
+        tuple: (``int``: the revision (``0`` if there are no logs),
+            ``dict``: the entry (``None`` if not found or deleted))
+    """
+    LOG_WRITER.wait_for([(data_type, identifier)])
+    query = {"data_type": data_type, "data._id": identifier}
+    if timestamp is None:
+        latest_first = [("revision", pymongo.DESCENDING)]
+    else:
+        query["timestamp"] = {"$lte": timestamp}
+        # use the index on timestamp to avoid scanning later logs
+        latest_first = [("timestamp", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+    return _rebuild_state(db, query, latest_first, dbsession)
+
+
+def _rebuild_state(db, query: dict, latest_first: list, dbsession=None) -> tuple:
+    """Rebuild an entry from the latest checkpoint in the logs matching ``query``."""
+    checkpoint = db["logs"].find_one(
+        {**query, "checkpoint": True},
+        {"revision": 1},
+        sort=latest_first,
+        session=dbsession,
+    )
+    if not checkpoint:
+        return 0, None
+    revision, state = 0, None
+    revisions = {
+        "$gte": checkpoint["revision"],
+        "$lt": checkpoint["revision"] + LOG_CHECKPOINT_INTERVAL,
+    }
+    logs = db["logs"].find(
+        {**query, "revision": {**query.get("revision", {}), **revisions}},
+        sort=[("revision", pymongo.ASCENDING)],
+        session=dbsession,
+    )
+    for log in logs:
+        state = apply_log(state, log)
+        revision = log["revision"]
+    return revision, state
+
+
+def log_changes(
+    log: dict, identifier: Any, previous: Optional[dict], current: Optional[dict], revision: int
+) -> dict:
+    """
+    Set the changes, revision and checkpoint of a log.
+
+    ``data`` will contain ``_id`` and the changed fields, with the removed fields
+    listed in ``removed``. Adding and deleting an entry, as well as every
+    ``LOG_CHECKPOINT_INTERVAL``:th change, are checkpoints. Edit checkpoints also
+    include the complete entry in ``snapshot``.
+
+    Changes are done in-place.
+
+    Args:
+        log (dict): The log, see ``structure.log``.
+        identifier: The ``_id`` of the entry.
+        previous (dict): The entry before the change, ``None`` if it did not exist.
+        current (dict): The entry after the change, ``None`` if it was deleted.
+        revision (int): The revision of the entry after the change.
+
+    Returns:
+        dict: The log.
+    """
+    changed, removed = log_delta(previous, current)
+    log["data"] = {"_id": identifier, **changed}
+    if removed:
+        log["removed"] = removed
+    log["revision"] = revision
+    log["checkpoint"] = log["action"] != "edit" or (revision - 1) % LOG_CHECKPOINT_INTERVAL == 0
+    if log["checkpoint"] and previous is not None and current is not None:
+        log["snapshot"] = current
+    return log
+
+
+# pylint: disable=too-many-arguments
+def new_log(
+    db, data_type: str, action: str, comment: str, user_id, data: dict, dbsession=None
+) -> dict:
+    """
+    Make a log for a change of an entry.
+
+    Args:
+        db: Connection to the database.
+        data_type (str): The type of the entry (e.g. ``dataset``).
+        action (str): Type of action (add, edit, delete).
+        comment (str): Note about why the change was done.
+        user_id: The ``_id`` for the user performing the operation.
+        data (dict): The new data for the entry (only ``_id`` for delete).
+        dbsession: The MongoDB session used.
+
+    Returns:
+        dict: The log, ready to be inserted.
+    """
+    log = empty_log()
+    log.update({"action": action, "comment": comment, "data_type": data_type, "user": user_id})
+    revision, previous = log_state(db, data_type, data["_id"], dbsession=dbsession)
+    current = None if action == "delete" else data
+    return log_changes(log, data["_id"], previous, current, revision + 1)
+
+
+def log_revisions(db, data_type: str, identifiers: list, dbsession=None) -> dict:
+    """
+    Get the latest log revision of multiple entries with one query.
+
+    Args:
+        db: Connection to the database.
+        data_type (str): The type of the entries (e.g. ``dataset``).
+        identifiers (list): The ``_id`` of the entries.
+        dbsession: The MongoDB session used.
+
+    Returns:
+        dict: The revision for each entry with logs.
+    """
+    identifiers = list(identifiers)
+    LOG_WRITER.wait_for((data_type, identifier) for identifier in identifiers)
+    pipeline = [
+        {"$match": {"data_type": data_type, "data._id": {"$in": identifiers}}},
+        {"$sort": {"data_type": 1, "data._id": 1, "revision": -1}},
+        {"$group": {"_id": "$data._id", "revision": {"$first": "$revision"}}},
+    ]
+    return {
+        entry["_id"]: entry["revision"]
+        for entry in db["logs"].aggregate(pipeline, session=dbsession)
+    }
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def new_logs(
+    db,
+    data_type: str,
+    action: str,
+    comment: str,
+    user_id,
+    data: list,
+    previous: list = None,
+    dbsession=None,
+) -> list:
+    """
+    Make logs for changes of multiple entries, e.g. for bulk requests.
+
+    The revisions of all entries are fetched with one query. Added entries have no
+    earlier logs and deleted entries only need the revision. For edits, the entries
+    before the change are rebuilt from the logs (see ``log_state``) unless they are
+    provided in ``previous``.
+
+    Args:
+        db: Connection to the database.
+        data_type (str): The type of the entries (e.g. ``dataset``).
+        action (str): Type of action (add, edit, delete).
+        comment (str): Note about why the change was done.
+        user_id: The ``_id`` for the user performing the operation.
+        data (list): The new data for each entry (only ``_id`` for delete).
+        previous (list): The entries before the change, in the same order as ``data``.
+        dbsession: The MongoDB session used.
+
+    Returns:
+        list: The logs, ready to be inserted with ``insert_many``.
+    """
+    if action == "edit" and previous is None:
+        return [
+            new_log(db, data_type, action, comment, user_id, entry, dbsession) for entry in data
+        ]
+    revisions = {}
+    if action != "add":
+        revisions = log_revisions(db, data_type, [entry["_id"] for entry in data], dbsession)
+    logs = []
+    for i, entry in enumerate(data):
+        log = empty_log()
+        log.update({"action": action, "comment": comment, "data_type": data_type, "user": user_id})
+        before = previous[i] if previous else None
+        current = None if action == "delete" else entry
+        revision = revisions.get(entry["_id"], 0) + 1
+        logs.append(log_changes(log, entry["_id"], before, current, revision))
+    return logs
+
+
+def rebase_logs(db, logs: list) -> list:
+    """
+    Make logs again after they conflicted with logs written at the same time.
+
+    A conflict (a revision that is already used for the entry) means that the changes
+    were compared to an outdated version of the entry. The entry after each change
+    is rebuilt from the log and compared to the latest version instead.
+
+    Args:
+        db: Connection to the database.
+        logs (list): The conflicting logs.
+
+    Returns:
+        list: The logs with new revisions and changes (same ``_id``).
+    """
+    rebased = []
+    latest_first = [("revision", pymongo.DESCENDING)]
+    for log in logs:
+        query = {"data_type": log["data_type"], "data._id": log["data"]["_id"]}
+        if log["action"] == "delete":
+            current = None
+        elif "snapshot" in log:
+            current = log["snapshot"]
+        else:
+            _, base = _rebuild_state(
+                db, {**query, "revision": {"$lte": log["revision"] - 1}}, latest_first
+            )
+            current = apply_log(base, log)
+        revision, previous = _rebuild_state(db, query, latest_first)
+        log = {key: value for key, value in log.items() if key not in ("removed", "snapshot")}
+        rebased.append(log_changes(log, log["data"]["_id"], previous, current, revision + 1))
+    return rebased
+
+
+# Writes the logs, in the background if enabled in the config (``log_writer``)
+LOG_WRITER = logwriter.LogWriter(rebase=rebase_logs)
+
+
+def supports_transactions(db) -> bool:
+    """
+    Check whether the database deployment supports transactions (replica set or sharded).
+
+    Args:
+        db: Connection to the database.
+
+    Returns:
+        bool: Whether transactions can be used.
+    """
+    topology = db.client.topology_description.topology_type_name
+    return topology in ("ReplicaSetWithPrimary", "Sharded")
+
+
+def run_transaction(db, callback):
+    """
+    Run ``callback(dbsession)`` in a transaction if the deployment supports them.
+
+    Otherwise ``callback(None)`` is run, i.e. without a session.
+
+    If the logs written by ``callback`` conflict with logs written at the same time
+    (see ``rebase_logs``), the transaction is run again, so ``callback`` must read
+    everything it depends on in the session.
+
+    Args:
+        db: Connection to the database.
+        callback: Function doing the changes; all operations must use the session.
+
+    Returns:
+        The value returned by ``callback``.
+    """
+    if not supports_transactions(db):
+        return callback(None)
+    retries = logwriter.CONFLICT_RETRIES
+    with db.client.start_session() as dbsession:
+        while True:
+            try:
+                return dbsession.with_transaction(callback)
+            except pymongo.errors.BulkWriteError as err:
+                errors = err.details["writeErrors"]
+                if not retries or not any(map(logwriter.is_revision_conflict, errors)):
+                    raise
+                retries -= 1
+
+
+REVISIONS = "revisions"
+# Revision included in all ETags, bumped when e.g. migrations change all entries
+REVISION_ALL = "*"
+
+
+def revision_key(dbcollection: str, identifier: Any = None) -> str:
+    """
+    Get the ``_id`` of the revision counter for a collection or an entry.
+
+    Args:
+        dbcollection (str): Name of the collection.
+        identifier (Any): The ``_id`` of the entry, ``None`` for the whole collection.
+
+    Returns:
+        str: The key for the ``revisions`` collection.
+    """
+    if identifier is None:
+        return dbcollection
+    return f"{dbcollection}:{identifier}"
+
+
+def bump_revisions(db, dbcollection: str, identifiers: list = ()):
+    """
+    Increase the revision counters after a change.
+
+    The counter of the collection is always increased, together with the counters
+    of the entries in ``identifiers``. Must be called after the change is written,
+    so that an ETag is never combined with older content.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): Name of the changed collection (or ``REVISION_ALL``).
+        identifiers (list): ``_id`` of the changed entries.
+    """
+    keys = [revision_key(dbcollection)] + [
+        revision_key(dbcollection, identifier) for identifier in identifiers
+    ]
+    db[REVISIONS].bulk_write(
+        [pymongo.UpdateOne({"_id": key}, {"$inc": {"revision": 1}}, upsert=True) for key in keys],
+        ordered=False,
+    )
+
+
+def get_revisions(db, keys: list) -> list:
+    """
+    Get the revision counters for ``keys`` with a single query.
+
+    Args:
+        db: Connection to the database.
+        keys (list): Keys from ``revision_key``.
+
+    Returns:
+        list: The revisions in the order of ``keys``, ``0`` if never changed.
+    """
+    found = {
+        entry["_id"]: entry["revision"] for entry in db[REVISIONS].find({"_id": {"$in": keys}})
+    }
+    return [found.get(key, 0) for key in keys]
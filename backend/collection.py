@@ -10,13 +10,36 @@ blueprint = flask.Blueprint("collection", __name__)  # pylint: disable=invalid-n
 
 @blueprint.route("", methods=["GET"])
 def list_collection():
-    """Provide a simplified list of all available collections."""
-    results = list(
-        flask.g.db["collections"].find(
-            projection={"title": 1, "_id": 1, "tags": 1, "properties": 1}
-        )
+    """
+    Provide a simplified list of all available collections.
+
+    Supports pagination, sorting and field selection (see ``utils.parse_list_query``).
+    """
+    etag = utils.req_etag("collections")
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
+
+    result = utils.req_list_entries(
+        "collections",
+        "collections",
+        {},
+        {"title": 1, "_id": 1, "tags": 1, "properties": 1},
+        allowed_fields=("title", "description", "tags", "properties"),
     )
-    return utils.response_json({"collections": results})
+    response = utils.response_json_stream(result, "collections")
+    response.set_etag(etag)
+    return response
+
+
+@blueprint.route("/facets", methods=["GET"])
+def get_collection_facets():
+    """
+    Get the number of collections with each tag and property.
+
+    Returns:
+        flask.Response: JSON structure with the counts.
+    """
+    return utils.req_facets_response("collections")
 
 
 @blueprint.route("/<identifier>", methods=["GET"])
@@ -24,6 +47,9 @@ def get_collection(identifier):
     """
     Retrieve the collection with uuid <identifier>.
 
+    ``collection['datasets']`` is returned as ``[{_id, title}, ...]``. Datasets that
+    are referenced but do not exist are listed in ``collection['missing_datasets']``.
+
     Args:
         identifier (str): uuid for the wanted collection
 
@@ -34,6 +60,9 @@ def get_collection(identifier):
     entry = utils.req_get_entry("collections", identifier)
     if not entry:
         flask.abort(status=404)
+    etag = utils.req_etag("collections", entry["_id"], ("datasets", "users"))
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
 
     # only show editors if owner/admin
     if not flask.g.current_user or (
@@ -48,12 +77,16 @@ def get_collection(identifier):
         entry["editors"] = utils.user_uuid_data(entry["editors"], flask.g.db)
 
     # return {_id, _title} for datasets
-    entry["datasets"] = [
-        flask.g.db.datasets.find_one({"_id": dataset}, {"title": 1})
-        for dataset in entry["datasets"]
-    ]
+    entry["datasets"], missing = utils.get_titles(flask.g.db, "datasets", entry["datasets"])
+    if missing:
+        flask.current_app.logger.warning(
+            "Collection %s references non-existing datasets: %s", entry["_id"], missing
+        )
+        entry["missing_datasets"] = missing
 
-    return utils.response_json({"collection": entry})
+    response = utils.response_json({"collection": entry})
+    response.set_etag(etag)
+    return response
 
 
 @blueprint.route("", methods=["POST"])
@@ -211,6 +244,8 @@ def get_collection_log(identifier: str = None):
 
     Deleted entries cannot be accessed.
 
+    Supports time ranges and pagination (see ``utils.req_list_logs``).
+
     Args:
         identifier (str): The uuid of the collection.
 
@@ -230,19 +265,41 @@ def get_collection_log(identifier: str = None):
     ):
         flask.abort(403)
 
-    collection_logs = list(
-        flask.g.db["logs"].find({"data_type": "collection", "data._id": collection["_id"]})
+    collection_logs = utils.req_list_logs(
+        {"data_type": "collection", "data._id": collection["_id"]}
     )
 
-    for log in collection_logs:
-        del log["data_type"]
+    return utils.response_json_stream(
+        {"entry_id": collection["_id"], "data_type": "collection", **collection_logs}, "logs"
+    )
 
-    utils.incremental_logs(collection_logs)
 
-    return utils.response_json(
-        {
-            "entry_id": collection["_id"],
-            "data_type": "collection",
-            "logs": collection_logs,
-        }
-    )
+@blueprint.route("/<identifier>/at", methods=["GET"])
+@user.login_required
+def get_collection_at(identifier: str):
+    """
+    Get the collection matching ``identifier`` as it was at the time in ``timestamp``.
+
+    The collection is rebuilt from the logs (see ``utils.req_log_state_response``).
+
+    Can be accessed by editors (with DATA_EDIT) and admin (DATA_MANAGEMENT).
+    Deleted collections can only be accessed by admin.
+
+    Args:
+        identifier (str): The uuid of the collection.
+
+    Returns:
+        flask.Response: The collection as json.
+    """
+    perm_status = utils.req_check_permissions(["DATA_EDIT"])
+    if perm_status != 200:
+        flask.abort(status=perm_status)
+
+    if not utils.req_has_permission("DATA_MANAGEMENT"):
+        collection = utils.req_get_entry("collections", identifier)
+        if not collection:
+            flask.abort(status=404)
+        if flask.g.current_user["_id"] not in collection["editors"]:
+            flask.abort(status=403)
+
+    return utils.req_log_state_response("collection", identifier)
@@ -0,0 +1,182 @@
+"""
+Compression of responses.
+
+Responses with a compressible type are compressed with brotli (if the ``brotli``
+module is installed) or gzip, depending on ``Accept-Encoding``. Streamed responses
+are compressed chunk by chunk, so they are still not kept in memory.
+
+Strong ETags are made weak when the response is compressed, as the body
+differs from the uncompressed one.
+"""
+import itertools
+import zlib
+from typing import Iterable, Iterator
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# 16 + the max window size gives gzip headers
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ResponseCompression:
+    """Compress responses based on the request, size and type of the response."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        """
+        Set up the compression.
+
+        Args:
+            enabled (bool): Whether responses should be compressed.
+            min_size (int): Smaller responses (in bytes) are not compressed.
+            gzip_level (int): Compression level for gzip (1-9).
+            brotli_quality (int): Compression quality for brotli (0-11).
+        """
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def encodings(self) -> list:
+        """
+        Get the supported encodings, in order of preference.
+
+        Returns:
+            list: The encodings.
+        """
+        if brotli:
+            return ["br", "gzip"]
+        return ["gzip"]
+
+    def compressor(self, encoding: str):
+        """
+        Make a compressor with ``compress`` and ``flush`` for the encoding.
+
+        Args:
+            encoding (str): ``br`` or ``gzip``.
+
+        Returns:
+            The compressor.
+        """
+        if encoding == "br":
+            return _BrotliCompressor(self.brotli_quality)
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, GZIP_WBITS)
+
+    def should_compress(self, response: flask.Response) -> bool:
+        """
+        Check whether the response is of a kind that should be compressed.
+
+        Args:
+            response (flask.Response): The response.
+
+        Returns:
+            bool: Whether to compress the response.
+        """
+        return (
+            self.enabled
+            and 200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and response.mimetype.startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def apply(self, request: flask.Request, response: flask.Response) -> flask.Response:
+        """
+        Compress the response if the client accepts it and it is large enough.
+
+        Args:
+            request (flask.Request): The request.
+            response (flask.Response): The response to compress.
+
+        Returns:
+            flask.Response: The (possibly) compressed response.
+        """
+        if not self.should_compress(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(self.encodings())
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            original = response.response
+            if hasattr(original, "close"):
+                response.call_on_close(original.close)
+            head, parts = _peek(original, self.min_size)
+            if parts is None:
+                response.response = [head]
+                return response
+            body = self._compress_stream(itertools.chain((head,), parts), encoding)
+            response.response = body
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            compressor = self.compressor(encoding)
+            response.set_data(compressor.compress(data) + compressor.flush())
+
+        response.headers["Content-Encoding"] = encoding
+        etag, is_weak = response.get_etag()
+        if etag and not is_weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress_stream(self, parts: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        """Compress the parts of a streamed response."""
+        compressor = self.compressor(encoding)
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode()
+            compressed = compressor.compress(part)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+class _BrotliCompressor:
+    """Brotli compressor with the same interface as ``zlib.compressobj``."""
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress a part of the data."""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Get the remaining compressed data."""
+        return self._compressor.finish()
+
+
+def _peek(parts: Iterable, min_size: int) -> tuple:
+    """
+    Read parts of a streamed body until there are at least ``min_size`` bytes.
+
+    Returns:
+        tuple: (``bytes``: the read data, ``Iterator``: the remaining parts,
+            ``None`` if the body was shorter than ``min_size``)
+    """
+    parts = iter(parts)
+    head = []
+    size = 0
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        head.append(part)
+        size += len(part)
+        if size >= min_size:
+            return b"".join(head), parts
+    return b"".join(head), None
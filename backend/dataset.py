@@ -1,19 +1,145 @@
 """Dataset requests."""
 import flask
 
+import cascade
+import unit_of_work
 import user
 import utils
+import validate
 
 blueprint = flask.Blueprint("dataset", __name__)  # pylint: disable=invalid-name
 
+# Collections with entries included in the dataset view (see ``build_dataset_info``)
+DATASET_DEPENDS = ("orders", "collections", "users", "datasets")
+
 
 @blueprint.route("", methods=["GET"])
 def list_datasets():
-    """Provide a simplified list of all available datasets."""
-    results = list(
-        flask.g.db["datasets"].find(projection={"title": 1, "_id": 1, "tags": 1, "properties": 1})
+    """
+    Provide a simplified list of all available datasets.
+
+    Supports pagination, sorting and field selection (see ``utils.parse_list_query``).
+    """
+    etag = utils.req_etag("datasets")
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
+
+    result = utils.req_list_entries(
+        "datasets",
+        "datasets",
+        {},
+        {"title": 1, "_id": 1, "tags": 1, "properties": 1},
+        allowed_fields=("title", "description", "tags", "properties"),
     )
-    return utils.response_json({"datasets": results})
+    response = utils.response_json_stream(result, "datasets")
+    response.set_etag(etag)
+    return response
+
+
+@blueprint.route("", methods=["PATCH"])
+@user.login_required
+def update_datasets():
+    """
+    Update multiple datasets.
+
+    Each entry in ``{"datasets": [...]}`` (at most ``utils.MAX_BULK_SIZE``) must include
+    ``_id``. The datasets are fetched and validated together and the changes are committed
+    in one unit of work (see ``unit_of_work``). Datasets that fail validation are not changed.
+
+    Returns:
+        flask.Response: Json structure with ``status`` for each dataset,
+            in the same order as in the request.
+    """
+    perm_status = utils.req_check_permissions(["DATA_EDIT"])
+    if perm_status != 200:
+        flask.abort(status=perm_status)
+
+    indata = utils.req_bulk_indata("datasets")
+    identifiers = [entry.get("_id") if isinstance(entry, dict) else None for entry in indata]
+    statuses = bulk_statuses(identifiers)
+    datasets = {
+        entry["_id"]: entry
+        for entry in flask.g.db["datasets"].find(
+            {"_id": {"$in": [identifiers[i] for i, status in enumerate(statuses) if not status]}}
+        )
+    }
+    editable = editable_datasets(list(datasets))
+    validate.prefetch_references(*[entry for entry in indata if isinstance(entry, dict)])
+
+    changes = {}
+    for i, identifier in enumerate(identifiers):
+        if statuses[i]:
+            continue
+        if identifier not in datasets:
+            statuses[i] = 404
+        elif identifier not in editable:
+            statuses[i] = 403
+        else:
+            dataset = datasets[identifier]
+            statuses[i] = utils.basic_check_indata(indata[i], dataset, ("_id",)).status
+            if statuses[i] == 200:
+                prepared = utils.prepare_for_db(indata[i])
+                if any(prepared[field] != dataset[field] for field in prepared):
+                    changes[i] = prepared
+
+    if changes:
+        work = unit_of_work.UnitOfWork(
+            flask.g.db, flask.g.current_user["_id"], logger=flask.current_app.logger
+        )
+        for i, prepared in changes.items():
+            dataset = datasets[identifiers[i]]
+            work.update(
+                "datasets",
+                dataset["_id"],
+                {"$set": prepared},
+                {**dataset, **prepared},
+                previous=dataset,
+            )
+        if not work.commit():
+            for i in changes:
+                statuses[i] = 500
+
+    return utils.response_json({"datasets": [{"status": status} for status in statuses]})
+
+
+@blueprint.route("", methods=["DELETE"])
+@user.login_required
+def delete_datasets():  # pylint: disable=too-many-locals
+    """
+    Delete multiple datasets.
+
+    The identifiers are given as ``{"datasets": [...]}`` (at most ``utils.MAX_BULK_SIZE``).
+    The datasets are removed from their orders and collections (see ``cascade``).
+
+    Returns:
+        flask.Response: Json structure with ``status`` for each dataset,
+            in the same order as in the request.
+    """
+    perm_status = utils.req_check_permissions(["DATA_EDIT"])
+    if perm_status != 200:
+        flask.abort(status=perm_status)
+
+    identifiers = utils.req_bulk_indata("datasets")
+    statuses = bulk_statuses(identifiers)
+    datasets = validate.known_identifiers(
+        "datasets", [identifiers[i] for i, status in enumerate(statuses) if not status]
+    )
+    editable = editable_datasets(list(datasets))
+    for i, identifier in enumerate(identifiers):
+        if not statuses[i]:
+            if identifier not in datasets:
+                statuses[i] = 404
+            elif identifier not in editable:
+                statuses[i] = 403
+            else:
+                statuses[i] = 200
+    deleted = [identifiers[i] for i, status in enumerate(statuses) if status == 200]
+    if deleted:
+        cascade.delete_datasets(
+            flask.g.db, deleted, flask.g.current_user["_id"], "Datasets deleted"
+        )
+
+    return utils.response_json({"datasets": [{"status": status} for status in statuses]})
 
 
 @blueprint.route("/user", methods=["GET"])
@@ -29,6 +155,17 @@ def list_user_data():
     return utils.response_json({"datasets": user_datasets})
 
 
+@blueprint.route("/facets", methods=["GET"])
+def get_dataset_facets():
+    """
+    Get the number of datasets with each tag and property.
+
+    Returns:
+        flask.Response: JSON structure with the counts.
+    """
+    return utils.req_facets_response("datasets")
+
+
 @blueprint.route("/<identifier>", methods=["GET"])
 def get_dataset(identifier):
     """
@@ -40,10 +177,18 @@ def get_dataset(identifier):
     Returns:
         flask.Response: json structure for the dataset
     """
+    if not flask.g.db["datasets"].find_one({"_id": identifier}, {"_id": 1}):
+        return flask.Response(status=404)
+    etag = utils.req_etag("datasets", identifier, DATASET_DEPENDS)
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
+
     result = build_dataset_info(identifier)
     if not result:
         return flask.Response(status=404)
-    return utils.response_json({"dataset": result})
+    response = utils.response_json({"dataset": result})
+    response.set_etag(etag)
+    return response
 
 
 @blueprint.route("/<identifier>", methods=["DELETE"])
@@ -77,30 +222,9 @@ def delete_dataset(identifier: str):
     ):
         flask.abort(status=403)
 
-    result = utils.req_commit_to_db("datasets", "delete", {"_id": ds["_id"]})
-    if not result.log or not result.data:
+    if not cascade.delete_datasets(flask.g.db, [ds["_id"]], flask.g.current_user["_id"]):
         flask.abort(status=500)
 
-    collections = list(flask.g.db["collections"].find({"datasets": ds["_id"]}))
-    flask.g.db["collections"].update_many({}, {"$pull": {"datasets": ds["_id"]}})
-    for collection in collections:
-        collection["datasets"] = [collection["datasets"].remove(ds["_id"])]
-        utils.req_make_log_new(
-            data_type="collection",
-            action="edit",
-            comment="Dataset deleted",
-            data=collection,
-        )
-
-    flask.g.db["orders"].update_many({}, {"$pull": {"datasets": ds["_id"]}})
-    order["datasets"].remove(ds["_id"])
-    utils.req_make_log_new(
-        data_type="order",
-        action="edit",
-        comment="Dataset deleted",
-        data=order,
-    )
-
     return flask.Response(status=200)
 
 
@@ -168,6 +292,8 @@ def get_dataset_log(identifier: str = None):
 
     Logs for deleted datasets cannot be accessed.
 
+    Supports time ranges and pagination (see ``utils.req_list_logs``).
+
     Args:
         identifier (str): The uuid of the dataset.
 
@@ -193,17 +319,42 @@ def get_dataset_log(identifier: str = None):
     ):
         flask.abort(403)
 
-    dataset_logs = list(
-        flask.g.db["logs"].find({"data_type": "dataset", "data._id": dataset["_id"]})
+    dataset_logs = utils.req_list_logs({"data_type": "dataset", "data._id": dataset["_id"]})
+
+    return utils.response_json_stream(
+        {"entry_id": dataset["_id"], "data_type": "dataset", **dataset_logs}, "logs"
     )
-    for log in dataset_logs:
-        del log["data_type"]
 
-    utils.incremental_logs(dataset_logs)
 
-    return utils.response_json(
-        {"entry_id": dataset["_id"], "data_type": "dataset", "logs": dataset_logs}
-    )
+@blueprint.route("/<identifier>/at", methods=["GET"])
+@user.login_required
+def get_dataset_at(identifier: str):
+    """
+    Get the dataset with uuid ``identifier`` as it was at the time in ``timestamp``.
+
+    The dataset is rebuilt from the logs (see ``utils.req_log_state_response``).
+
+    Can be accessed by editors with DATA_EDIT and admin (DATA_MANAGEMENT).
+    Deleted datasets can only be accessed by admin.
+
+    Args:
+        identifier (str): The uuid of the dataset.
+
+    Returns:
+        flask.Response: The dataset as json.
+    """
+    perm_status = utils.req_check_permissions(["DATA_EDIT"])
+    if perm_status != 200:
+        flask.abort(status=perm_status)
+
+    if not utils.req_has_permission("DATA_MANAGEMENT"):
+        order_data = flask.g.db["orders"].find_one({"datasets": identifier}, {"editors": 1})
+        if not order_data:
+            flask.abort(status=404)
+        if flask.g.current_user["_id"] not in order_data["editors"]:
+            flask.abort(status=403)
+
+    return utils.req_log_state_response("dataset", identifier)
 
 
 @blueprint.route("", methods=["POST"])
@@ -217,20 +368,136 @@ def info_add_dataset():
 
 
 # helper functions
+def dataset_info_pipeline(identifier: str) -> list:
+    """
+    Build the aggregation pipeline used by ``build_dataset_info``.
+
+    The pipeline adds to the dataset:
+
+    * ``order``: the parent order
+    * ``collections``: ``{_id, title}`` for the collections containing the dataset
+    * ``people``: the public fields (``utils.USER_FIELDS``) of all users referenced by the order
+
+    Args:
+        identifier (str): The uuid of the dataset.
+
+    Returns:
+        list: The aggregation pipeline.
+    """
+    order_users = [
+        {"$ifNull": [f"$order.{field}", []]} for field in ("authors", "generators", "editors")
+    ]
+    order_users.append(["$order.organisation"])
+    return [
+        {"$match": {"_id": identifier}},
+        {
+            "$lookup": {
+                "from": "orders",
+                "localField": "_id",
+                "foreignField": "datasets",
+                "as": "order",
+            }
+        },
+        {"$addFields": {"order": {"$arrayElemAt": ["$order", 0]}}},
+        {
+            "$lookup": {
+                "from": "collections",
+                "localField": "_id",
+                "foreignField": "datasets",
+                "as": "collections",
+            }
+        },
+        {"$addFields": {"people": {"$concatArrays": order_users}}},
+        {
+            "$lookup": {
+                "from": "users",
+                "localField": "people",
+                "foreignField": "_id",
+                "as": "people",
+            }
+        },
+        {
+            "$addFields": {
+                "collections": {
+                    "$map": {
+                        "input": "$collections",
+                        "in": {"_id": "$$this._id", "title": "$$this.title"},
+                    }
+                },
+                "people": {
+                    "$map": {
+                        "input": "$people",
+                        "in": {field: f"$$this.{field}" for field in utils.USER_FIELDS},
+                    }
+                },
+            }
+        },
+    ]
+
+
+def bulk_statuses(identifiers: list) -> list:
+    """
+    Check the identifiers in a bulk request.
+
+    Args:
+        identifiers (list): The identifiers from the request.
+
+    Returns:
+        list: 400 for identifiers that are not strings or are repeated, otherwise ``None``.
+    """
+    statuses = []
+    seen = set()
+    for identifier in identifiers:
+        if not isinstance(identifier, str) or identifier in seen:
+            statuses.append(400)
+        else:
+            statuses.append(None)
+            seen.add(identifier)
+    return statuses
+
+
+def editable_datasets(identifiers: list) -> set:
+    """
+    Get the datasets the current user may edit, with one query.
+
+    Args:
+        identifiers (list): The datasets to check.
+
+    Returns:
+        set: The identifiers of the datasets that may be edited.
+    """
+    if utils.req_has_permission("DATA_MANAGEMENT"):
+        return set(identifiers)
+    orders = flask.g.db["orders"].find(
+        {"datasets": {"$in": identifiers}, "editors": flask.g.current_user["_id"]},
+        {"datasets": 1},
+    )
+    return {identifier for entry in orders for identifier in entry["datasets"]} & set(identifiers)
+
+
 def build_dataset_info(identifier: str):
     """
     Query for a dataset from the database.
 
+    The dataset, its order, collections and the referenced users are fetched with
+    one aggregation; the titles of the related datasets with a second query.
+
     Args:
         identifier (str): The uuid of the dataset.
 
     Returns:
         dict: The prepared dataset entry.
     """
-    dataset = utils.req_get_entry("datasets", identifier)
+    dataset = next(flask.g.db["datasets"].aggregate(dataset_info_pipeline(identifier)), None)
     if not dataset:
         return None
-    order = flask.g.db["orders"].find_one({"datasets": dataset["_id"]})
+    order = dataset.pop("order", None)
+    people = {entry["_id"]: entry for entry in dataset.pop("people")}
+    if not order:
+        flask.current_app.logger.error("Dataset without parent order: %s", dataset["_id"])
+        dataset["related"] = []
+        return dataset
+
     if flask.g.current_user:
         curr_user = flask.g.current_user["_id"]
     else:
@@ -238,20 +505,19 @@ def build_dataset_info(identifier: str):
 
     if utils.req_has_permission("DATA_MANAGEMENT") or curr_user in order["editors"]:
         dataset["order"] = {"_id": order["_id"], "title": order["title"]}
-    dataset["related"] = list(
-        flask.g.db["datasets"].find({"_id": {"$in": order["datasets"]}}, {"title": 1})
-    )
-    dataset["related"].remove({"_id": dataset["_id"], "title": dataset["title"]})
-    dataset["collections"] = list(
-        flask.g.db["collections"].find({"datasets": dataset["_id"]}, {"title": 1})
-    )
+    dataset["related"] = utils.get_titles(
+        flask.g.db, "datasets", [entry for entry in order["datasets"] if entry != dataset["_id"]]
+    )[0]
     for field in ("editors", "generators", "authors"):
         if field == "editors" and (
             not utils.req_has_permission("DATA_MANAGEMENT") and curr_user not in order[field]
         ):
             continue
-        dataset[field] = utils.user_uuid_data(order[field], flask.g.db)
+        dataset[field] = [people[entry] for entry in order[field] if entry in people]
 
-    dataset["organisation"] = utils.user_uuid_data(order["organisation"], flask.g.db)
-    dataset["organisation"] = dataset["organisation"][0] if dataset["organisation"] else ""
+    organisation = order["organisation"]
+    if isinstance(organisation, str) and organisation in people:
+        dataset["organisation"] = people[organisation]
+    else:
+        dataset["organisation"] = ""
     return dataset
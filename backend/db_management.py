@@ -1,30 +1,56 @@
-"""DB initialisation and migration check."""
+"""
+DB initialisation and migration check.
+
+Can also be run as a script for maintenance tasks, see ``--help``.
+Migrations are run with ``--migrate`` (``--migrate --dry-run`` to only estimate
+their cost); the app refuses to start while migrations are pending.
+"""
+import argparse
+import json
 import logging
 import sys
 
+import changelog
+import config
+import facets
+import indexes
 import structure
 import utils
-from migrations import MIGRATIONS
+import migrations
 
-DB_VERSION = 4
+DB_VERSION = 5
 
 
-def check_db(config: dict):
+def check_db(conf: dict):
     """
     Perform database checks.
 
     - check if first-time setup has been performed
-    - check that the data structure is up to date (migrations)
+    - check that the data structure is up to date (exits if migrations are pending)
+    - create any missing indexes
+    - warn if the facets have never been counted (``--facets rebuild``)
+
+    The facets are not counted here, since every worker process runs the check.
 
     Args:
-        config (dict): Configuration for the data tracker
+        conf (dict): Configuration for the data tracker
     """
-    db = utils.get_db(utils.get_dbclient(config), config)
-    db_initialised = db["db_status"].find_one({"_id": "init_db"})
-    if not db_initialised:
-        init_db(db)
-    else:
-        check_migrations(db)
+    dbclient = utils.get_dbclient(conf)
+    try:
+        db = utils.get_db(dbclient, conf)
+        db_initialised = db["db_status"].find_one({"_id": "init_db"})
+        if not db_initialised:
+            init_db(db)
+        else:
+            check_migrations(db)
+        indexes.ensure_indexes(db)
+        if not db["db_status"].find_one({"_id": "facets_counted"}):
+            logging.warning(
+                "The facets have not been counted, run db_management.py --facets rebuild"
+            )
+    finally:
+        # Requests use the shared client, created after the workers are forked
+        dbclient.close()
 
 
 def init_db(db):
@@ -33,6 +59,7 @@ def init_db(db):
 
     - create a default user
     - set current db_version
+    - mark the (empty) facet counts as counted
     """
     db["db_status"].insert_one(
         {"_id": "init_db", "started": True, "user_added": False, "finished": False}
@@ -41,6 +68,7 @@ def init_db(db):
 
     # Set DB version
     db["db_status"].insert_one({"_id": "db_version", "version": DB_VERSION})
+    db["db_status"].replace_one({"_id": "facets_counted"}, {}, upsert=True)
     db["db_status"].update_one({"_id": "init_db"}, {"$set": {"finished": True}})
 
 
@@ -81,21 +109,138 @@ def add_default_user(db):
         logging.error("Failed to add default user")
 
 
-def check_migrations(db):
+def rebuild_facets(db) -> dict:
+    """
+    Recount the facets and mark them as counted.
+
+    Args:
+        db: Connection to the database.
+
+    Returns:
+        dict: The number of facets per collection, see ``facets.rebuild_facets``.
+    """
+    result = facets.rebuild_facets(db)
+    db["db_status"].replace_one({"_id": "facets_counted"}, {}, upsert=True)
+    return result
+
+
+def pending_migrations(db) -> list:
     """
-    Check if any migrations need to be performed on the db.
+    Get the versions the database must be migrated from to match the software.
+
+    Exits if the database is newer than the software.
 
     Args:
-        config (dict): Configuration for the data tracker
+        db: Connection to the database.
+
+    Returns:
+        list: The versions to migrate from, in order.
     """
     db_version = db["db_status"].find_one({"_id": "db_version"})
+    if not db_version:
+        # not initialised, the current version is set by init_db
+        return []
     if db_version["version"] > DB_VERSION:
         logging.critical("The database is newer than the software")
         sys.exit(1)
-    elif db_version["version"] == DB_VERSION:
-        logging.info("The database is up-to-date")
+    return list(range(db_version["version"], DB_VERSION))
+
+
+def check_migrations(db):
+    """
+    Check that no migrations need to be performed on the db.
 
-    for i in range(db_version["version"], DB_VERSION):
+    Migrations are not run here, since every worker process runs the check.
+    Exits if migrations are pending.
+
+    Args:
+        db: Connection to the database.
+    """
+    pending = pending_migrations(db)
+    if pending:
+        logging.critical(
+            "The database must be migrated from version %d to %d, "
+            "run db_management.py --migrate (--dry-run for an estimate)",
+            pending[0],
+            DB_VERSION,
+        )
+        sys.exit(1)
+    logging.info("The database is up-to-date")
+
+
+def migrate(db, dry_run: bool = False) -> list:
+    """
+    Run the pending migrations, or estimate their cost.
+
+    Args:
+        db: Connection to the database.
+        dry_run (bool): Only estimate the cost (see ``migrations.estimate_migration``).
+
+    Returns:
+        list: The estimates, or the migrated versions, in order.
+    """
+    pending = pending_migrations(db)
+    if dry_run:
+        return [migrations.estimate_migration(db, version) for version in pending]
+    for i in pending:
         logging.info("Database migration for version %d to %d starting", i, i + 1)
-        MIGRATIONS[i](db)
-    db["db_status"].update_one({"_id": "db_version"}, {"$set": {"version": DB_VERSION}})
+        migrations.MIGRATIONS[i](db)
+        db["db_status"].update_one({"_id": "db_version"}, {"$set": {"version": i + 1}})
+    if pending:
+        # the migrations may have changed any entry
+        changelog.bump_revisions(db, changelog.REVISION_ALL)
+        rebuild_facets(db)
+        indexes.ensure_indexes(db)
+    return pending
+
+
+def main():
+    """Run maintenance tasks from the command line."""
+    parser = argparse.ArgumentParser(description="Database maintenance for the Data Tracker.")
+    parser.add_argument("--config_file", help="The config file to use (see config.init)")
+    parser.add_argument(
+        "--indexes",
+        choices=("report", "apply"),
+        help="report: list missing, unregistered and unused indexes; apply: create missing indexes",
+    )
+    parser.add_argument(
+        "--migrate", action="store_true", help="run the pending database migrations"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help=(
+            "with --migrate: estimate the affected documents, bytes and time without migrating; "
+            "writes a sample to temporary <collection>_dry_run collections"
+        ),
+    )
+    parser.add_argument(
+        "--facets",
+        choices=("rebuild",),
+        help="rebuild: recount the tags and properties used by the facets endpoints",
+    )
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+
+    conf = config.init()
+    dbclient = utils.get_dbclient(conf)
+    db = utils.get_db(dbclient, conf)
+    try:
+        if args.indexes == "report":
+            print(json.dumps(indexes.index_report(db), indent=2))
+        elif args.indexes == "apply":
+            print(json.dumps({"created": indexes.ensure_indexes(db)}, indent=2))
+        elif args.migrate:
+            result = migrate(db, dry_run=args.dry_run)
+            key = "estimates" if args.dry_run else "migrated_from"
+            print(json.dumps({key: result}, indent=2))
+        elif args.facets == "rebuild":
+            print(json.dumps({"facets": rebuild_facets(db)}, indent=2))
+        else:
+            parser.print_help()
+    finally:
+        dbclient.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import copy
 
 import flask
 
+import changelog
 import user
 import utils
 
@@ -91,6 +92,20 @@ def list_config():
     return flask.jsonify(config)
 
 
+@blueprint.route("/cache")
+def list_cache_stats():
+    """List the hit/miss statistics for the caches."""
+    return flask.jsonify(
+        {"api_key": utils.API_KEY_CACHE.stats(), "user": user.USER_CACHE.stats()}
+    )
+
+
+@blueprint.route("/logwriter")
+def list_log_writer_stats():
+    """List the queue depth and flush statistics for the log writer."""
+    return flask.jsonify(changelog.LOG_WRITER.stats())
+
+
 @blueprint.route("/quit")
 def stop_server():
     """Shutdown the flask server."""
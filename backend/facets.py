@@ -0,0 +1,226 @@
+"""
+Counts of the tags and properties of datasets, orders and collections.
+
+The counts are kept in the ``facets`` collection, with one entry per tag or
+property (key and value) of each collection. They are updated in
+``utils.commit_to_db`` and ``unit_of_work.UnitOfWork`` for every change, so
+reading them does not need to scan the entries. ``rebuild_facets`` recounts
+everything if the counts drift, e.g. after changes made directly in the database.
+"""
+import collections
+
+import pymongo
+
+FACETS = "facets"
+FACET_COLLECTIONS = ("datasets", "orders", "collections")
+
+
+def entry_facets(entry: dict) -> collections.Counter:
+    """
+    Get the facets of an entry.
+
+    Args:
+        entry (dict): The entry (may be ``None``).
+
+    Returns:
+        collections.Counter: ``(type, key, value)`` for each tag and property.
+    """
+    counts = collections.Counter()
+    if not entry:
+        return counts
+    for tag in entry.get("tags") or []:
+        counts[("tag", None, tag)] += 1
+    for key, value in (entry.get("properties") or {}).items():
+        counts[("property", key, value)] += 1
+    return counts
+
+
+def facet_changes(before: dict, after: dict) -> dict:
+    """
+    Get the changes of the facet counts when an entry is changed.
+
+    Args:
+        before (dict): The entry before the change, ``None`` if it was added.
+        after (dict): The entry after the change, ``None`` if it was deleted.
+
+    Returns:
+        dict: The change for each ``(type, key, value)``, without unchanged facets.
+    """
+    changes = entry_facets(after)
+    changes.subtract(entry_facets(before))
+    return {facet: change for facet, change in changes.items() if change}
+
+
+def facet_id(dbcollection: str, facet: tuple) -> dict:
+    """
+    Get the ``_id`` of a facet entry.
+
+    Args:
+        dbcollection (str): The collection of the counted entries.
+        facet (tuple): ``(type, key, value)``.
+
+    Returns:
+        dict: The ``_id``.
+    """
+    ftype, key, value = facet
+    return {"collection": dbcollection, "type": ftype, "key": key, "value": value}
+
+
+def update_facets(db, dbcollection: str, before: dict, after: dict):
+    """
+    Update the facet counts after a change of an entry.
+
+    Facets with a count of zero are removed.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): The collection of the changed entry.
+        before (dict): The entry (at least ``tags`` and ``properties``) before the change,
+            ``None`` if it was added.
+        after (dict): The entry after the change, ``None`` if it was deleted.
+    """
+    update_facets_many(db, dbcollection, [(before, after)])
+
+
+def update_facets_many(db, dbcollection: str, changes: list):
+    """
+    Update the facet counts after changes of multiple entries, using one bulk write.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): The collection of the changed entries.
+        changes (list): ``(before, after)`` for each entry, see ``update_facets``.
+    """
+    if dbcollection not in FACET_COLLECTIONS:
+        return
+    total = collections.Counter()
+    for before, after in changes:
+        total.update(facet_changes(before, after))
+    changes = {facet: change for facet, change in total.items() if change}
+    if not changes:
+        return
+    operations = [
+        pymongo.UpdateOne(
+            {"_id": facet_id(dbcollection, facet)},
+            {"$inc": {"count": change}, "$set": {"collection": dbcollection}},
+            upsert=True,
+        )
+        for facet, change in changes.items()
+    ]
+    removed = [facet_id(dbcollection, facet) for facet, change in changes.items() if change < 0]
+    if removed:
+        operations.append(pymongo.DeleteMany({"_id": {"$in": removed}, "count": {"$lte": 0}}))
+    db[FACETS].bulk_write(operations, ordered=True)
+
+
+def count_facets(db, dbcollection: str, query: dict = None) -> collections.Counter:
+    """
+    Count the facets by scanning the entries.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): The collection to count.
+        query (dict): Filter for the entries to count.
+
+    Returns:
+        collections.Counter: The count for each ``(type, key, value)``.
+    """
+    pipeline = [
+        {"$match": query or {}},
+        {
+            "$project": {
+                "facet": {
+                    "$concatArrays": [
+                        {
+                            "$map": {
+                                "input": {"$ifNull": ["$tags", []]},
+                                "in": {"type": "tag", "key": None, "value": "$$this"},
+                            }
+                        },
+                        {
+                            "$map": {
+                                "input": {"$objectToArray": {"$ifNull": ["$properties", {}]}},
+                                "in": {"type": "property", "key": "$$this.k", "value": "$$this.v"},
+                            }
+                        },
+                    ]
+                }
+            }
+        },
+        {"$unwind": "$facet"},
+        {"$group": {"_id": "$facet", "count": {"$sum": 1}}},
+    ]
+    return collections.Counter(
+        {
+            (entry["_id"]["type"], entry["_id"].get("key"), entry["_id"]["value"]): entry["count"]
+            for entry in db[dbcollection].aggregate(pipeline)
+        }
+    )
+
+
+def rebuild_facets(db, dbcollections: tuple = FACET_COLLECTIONS) -> dict:
+    """
+    Recount the facets and replace the stored counts.
+
+    Args:
+        db: Connection to the database.
+        dbcollections (tuple): The collections to recount.
+
+    Returns:
+        dict: The number of facets per collection.
+    """
+    result = {}
+    for dbcollection in dbcollections:
+        counts = count_facets(db, dbcollection)
+        ids = [facet_id(dbcollection, facet) for facet in counts]
+        operations = [
+            pymongo.ReplaceOne(
+                {"_id": fid}, {"collection": dbcollection, "count": counts[facet]}, upsert=True
+            )
+            for fid, facet in zip(ids, counts)
+        ]
+        operations.append(
+            pymongo.DeleteMany({"collection": dbcollection, "_id": {"$nin": ids}})
+        )
+        db[FACETS].bulk_write(operations, ordered=True)
+        result[dbcollection] = len(counts)
+    return result
+
+
+def format_facets(counts) -> dict:
+    """
+    Format facet counts for a response, sorted by count.
+
+    Args:
+        counts: ``((type, key, value), count)`` pairs.
+
+    Returns:
+        dict: ``{"tags": [{value, count}], "properties": [{key, value, count}]}``
+    """
+    result = {"tags": [], "properties": []}
+    for (ftype, key, value), count in sorted(
+        counts, key=lambda facet: (-facet[1], facet[0][0], facet[0][1] or "", facet[0][2])
+    ):
+        if ftype == "tag":
+            result["tags"].append({"value": value, "count": count})
+        else:
+            result["properties"].append({"key": key, "value": value, "count": count})
+    return result
+
+
+def get_facets(db, dbcollection: str) -> dict:
+    """
+    Get the stored facet counts for a collection.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): The collection.
+
+    Returns:
+        dict: The formatted counts, see ``format_facets``.
+    """
+    entries = db[FACETS].find({"collection": dbcollection, "count": {"$gt": 0}})
+    return format_facets(
+        ((entry["_id"]["type"], entry["_id"]["key"], entry["_id"]["value"]), entry["count"])
+        for entry in entries
+    )
@@ -0,0 +1,152 @@
+"""
+Registry of the database indexes.
+
+``INDEXES`` lists all indexes the queries rely on. ``ensure_indexes`` creates
+any missing ones and is run at startup (``db_management.check_db``). Indexes
+required by new queries or by migrations are added with ``register``.
+"""
+import logging
+from collections import namedtuple
+
+import pymongo
+
+IndexSpec = namedtuple("IndexSpec", ["collection", "keys", "options"])
+
+ASC = pymongo.ASCENDING
+
+INDEXES = [
+    IndexSpec("orders", [("editors", ASC)], {}),
+    IndexSpec("orders", [("datasets", ASC)], {}),
+    IndexSpec("collections", [("datasets", ASC)], {}),
+    IndexSpec("users", [("auth_ids", ASC)], {}),
+    IndexSpec("users", [("email", ASC)], {}),
+    # unique: logs made from outdated revisions fail and are made again
+    IndexSpec(
+        "logs", [("data_type", ASC), ("data._id", ASC), ("revision", ASC)], {"unique": True}
+    ),
+    IndexSpec(
+        "logs", [("data_type", ASC), ("data._id", ASC), ("timestamp", ASC), ("_id", ASC)], {}
+    ),
+    IndexSpec("logs", [("user", ASC), ("timestamp", ASC), ("_id", ASC)], {}),
+    IndexSpec("facets", [("collection", ASC)], {}),
+]
+
+
+def _search_indexes(collection: str) -> list:
+    """Get the indexes used by ``search.py`` for a collection."""
+    return [
+        IndexSpec(
+            collection,
+            [("title", pymongo.TEXT), ("description", pymongo.TEXT)],
+            {"weights": {"title": 10, "description": 1}},
+        ),
+        IndexSpec(collection, [("tags", ASC)], {}),
+        IndexSpec(collection, [("properties.$**", ASC)], {}),
+    ]
+
+
+INDEXES += _search_indexes("datasets") + _search_indexes("orders") + _search_indexes("collections")
+
+
+def register(collection: str, keys: list, **options):
+    """
+    Add an index to the registry.
+
+    Registering the same index twice has no effect.
+
+    Args:
+        collection (str): The database collection.
+        keys (list): The index keys as ``[(field, direction), ...]``.
+        **options: Options for ``create_index``, e.g. ``unique``.
+    """
+    spec = IndexSpec(collection, list(keys), options)
+    if spec not in INDEXES:
+        INDEXES.append(spec)
+
+
+def index_name(keys: list) -> str:
+    """
+    Get the default MongoDB name for an index.
+
+    Args:
+        keys (list): The index keys as ``[(field, direction), ...]``.
+
+    Returns:
+        str: The index name, e.g. ``data_type_1_data._id_1``.
+    """
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def ensure_indexes(db, specs: list = None) -> list:
+    """
+    Create the registered indexes that are missing.
+
+    Existing indexes are left untouched, so it is safe to run at every startup.
+
+    Args:
+        db: The database to use.
+        specs (list): The indexes to ensure. Defaults to ``INDEXES``.
+
+    Returns:
+        list: Names (``collection.index``) of the created indexes.
+    """
+    if specs is None:
+        specs = INDEXES
+    created = []
+    for collection in sorted({spec.collection for spec in specs}):
+        existing = set(db[collection].index_information())
+        models = [
+            pymongo.IndexModel(spec.keys, **spec.options)
+            for spec in specs
+            if spec.collection == collection
+            and spec.options.get("name", index_name(spec.keys)) not in existing
+        ]
+        if not models:
+            continue
+        try:
+            names = db[collection].create_indexes(models)
+        except pymongo.errors.OperationFailure as err:
+            logging.error("Failed to create indexes for %s: %s", collection, err)
+            continue
+        for name in names:
+            logging.info("Created index %s.%s", collection, name)
+            created.append(f"{collection}.{name}")
+    return created
+
+
+def index_report(db, specs: list = None) -> dict:
+    """
+    Compare the indexes in the database with the registry.
+
+    Usage numbers are counted by MongoDB since the server was started.
+
+    Args:
+        db: The database to use.
+        specs (list): The registered indexes. Defaults to ``INDEXES``.
+
+    Returns:
+        dict: Lists of ``collection.index`` names:
+
+        * ``missing``: registered, but not in the database
+        * ``unregistered``: in the database, but not registered
+        * ``unused``: in the database, but never used
+    """
+    if specs is None:
+        specs = INDEXES
+    report = {"missing": [], "unregistered": [], "unused": []}
+    registered = {
+        (spec.collection, spec.options.get("name", index_name(spec.keys))) for spec in specs
+    }
+    collections = {spec.collection for spec in specs} | set(db.list_collection_names())
+    for collection in sorted(collections):
+        existing = set(db[collection].index_information()) - {"_id_"}
+        expected = {name for coll, name in registered if coll == collection}
+        report["missing"] += [f"{collection}.{name}" for name in sorted(expected - existing)]
+        report["unregistered"] += [f"{collection}.{name}" for name in sorted(existing - expected)]
+        if existing:
+            report["unused"] += sorted(
+                f"{collection}.{stats['name']}"
+                for stats in db[collection].aggregate([{"$indexStats": {}}])
+                if stats["name"] != "_id_" and not stats["accesses"]["ops"]
+            )
+    return report
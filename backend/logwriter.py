@@ -0,0 +1,428 @@
+"""
+Writing of change logs in the background.
+
+By default logs are inserted when they are made. If ``log_writer.enabled`` is set
+in the config, logs are instead put in a bounded queue and inserted by a worker
+thread with ``insert_many``, in batches of at most ``batch_size`` logs or after
+``flush_interval`` seconds.
+
+If the queue stays full for ``put_timeout`` seconds, or an insert fails, the logs
+are appended to a spool file (``spool_path``, one log per line as extended JSON).
+The spool is inserted when the next batch succeeds, and when the writer starts
+(e.g. after a crash). Logs have unique ``_id``, so logs that were already inserted
+are skipped. Logs still in the queue when the process is killed are lost; the
+queue is flushed on a normal exit.
+
+The revision and changes of a new log depend on the earlier logs of the entry,
+so ``wait_for`` is called before they are read (see ``changelog.log_state``).
+It raises ``TimeoutError`` if the logs cannot be inserted in time, instead of
+letting the revision be read from outdated logs. Only the queue of the current
+process is known, so background writing requires a single process: the process
+writing in the background locks ``<spool_path>.lock`` and the writer fails to
+start (``RuntimeError``) in any other process.
+"""
+import atexit
+import collections
+import fcntl
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+import bson
+import pymongo
+from bson import json_util
+
+# Options for the spool file; keeps the uuid representation used for the database
+SPOOL_JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS.with_options(
+    uuid_representation=bson.binary.STANDARD, tz_aware=False
+)
+# Error code for an already inserted ``_id`` or an already used revision of an entry
+DUPLICATE_KEY = 11000
+# Number of times conflicting logs are made again (see ``changelog.rebase_logs``)
+CONFLICT_RETRIES = 3
+# The unique index on the revisions of each entry
+REVISION_INDEX = "data_type_1_data._id_1_revision_1"
+
+
+def log_key(log: dict) -> tuple:
+    """
+    Get the key for the entry of a log.
+
+    Args:
+        log (dict): The log.
+
+    Returns:
+        tuple: ``(data_type, data._id)``.
+    """
+    return (log["data_type"], log["data"]["_id"])
+
+
+def is_revision_conflict(error: dict) -> bool:
+    """
+    Check whether a write error is a log with a revision that is already used for the entry.
+
+    Args:
+        error (dict): An entry in ``writeErrors`` of a ``BulkWriteError``.
+
+    Returns:
+        bool: Whether the log conflicts with another log of the entry.
+    """
+    if error["code"] != DUPLICATE_KEY:
+        return False
+    if "keyPattern" in error:
+        return list(error["keyPattern"]) == ["data_type", "data._id", "revision"]
+    return f"index: {REVISION_INDEX} " in error["errmsg"]
+
+
+# pylint: disable=too-many-instance-attributes
+class LogWriter:
+    """
+    Insert logs directly, or in batches from a queue in a worker thread.
+
+    Queue depth, spooled logs and flush times are counted for ``stats``.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        put_timeout: float = 0.5,
+        spool_path: str = "log_spool.jsonl",
+        timer: Callable = time.monotonic,
+        rebase: Callable = None,
+    ):
+        """
+        Create the writer.
+
+        Args:
+            enabled (bool): Whether logs are written in the background.
+            max_queue (int): Maximum number of logs in the queue.
+            batch_size (int): Maximum number of logs per ``insert_many``.
+            flush_interval (float): Maximum seconds before a queued log is inserted.
+            put_timeout (float): Seconds to wait for space in a full queue before spooling.
+            spool_path (str): File for logs that could not be queued or inserted.
+            timer (Callable): Function returning the current time in seconds.
+            rebase (Callable): Function taking ``db`` and conflicting logs and returning
+                them made again (see ``changelog.rebase_logs``).
+        """
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spool_path = spool_path
+        self.timer = timer
+        self.rebase = rebase
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._db = None
+        self._worker = None
+        self._pid = None
+        self._process_lock = None
+        self._process_lock_pid = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._spool_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._pending = collections.Counter()
+        self._counts = collections.Counter()
+        self._flush_times = {"last": 0.0, "max": 0.0, "total": 0.0}
+
+    def configure(self, **options):
+        """
+        Change the settings (see ``__init__``).
+
+        Must be done before any logs are written, e.g. when the app is created.
+        If background writing is enabled, the process lock is taken immediately,
+        so that a second worker process fails to start.
+
+        Args:
+            **options: The settings to change.
+
+        Raises:
+            RuntimeError: Another process is writing logs in the background.
+        """
+        self.stop()
+        for key, value in options.items():
+            if not hasattr(self, key) or key.startswith("_") or key in ("timer", "rebase"):
+                raise ValueError(f"Unknown option in log_writer ({key})")
+            setattr(self, key, value)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        if self.enabled:
+            self._acquire_process_lock()
+
+    def write(self, db, logs: list) -> bool:
+        """
+        Write logs, or queue them if background writing is enabled.
+
+        Args:
+            db: Connection to the database.
+            logs (list): The logs to write.
+
+        Returns:
+            bool: Whether the logs were inserted or queued (or spooled).
+        """
+        if not logs:
+            return True
+        if not self.enabled:
+            self._insert_many(db, logs)
+            return True
+        self._db = db
+        self._start()
+        with self._lock:
+            self._pending.update(log_key(log) for log in logs)
+        queued = 0
+        for log in logs:
+            try:
+                self._queue.put(log, timeout=self.put_timeout)
+            except queue.Full:
+                self._spool(logs[queued:])
+                break
+            queued += 1
+        with self._lock:
+            self._counts["queued"] += queued
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def wait_for(self, keys: Iterable[tuple]):
+        """
+        Make sure that the queued logs of the given entries are inserted.
+
+        Waits at most ``flush_interval`` seconds for a batch being inserted by the worker.
+
+        Args:
+            keys (Iterable[tuple]): ``(data_type, _id)`` of the entries.
+
+        Raises:
+            TimeoutError: The logs were not inserted in time, e.g. because the database
+                cannot be reached and they were spooled.
+        """
+        if not self.enabled:
+            return
+        keys = list(keys)
+        with self._lock:
+            if not any(self._pending[key] for key in keys):
+                return
+        self.flush()
+        with self._flushed:
+            inserted = self._flushed.wait_for(
+                lambda: not any(self._pending[key] for key in keys), timeout=self.flush_interval
+            )
+        if not inserted:
+            raise TimeoutError(f"Queued logs not inserted within {self.flush_interval} s")
+
+    def flush(self):
+        """Insert all queued logs, and the spool, in the calling thread."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                break
+            self._insert(batch)
+        if self._db is not None:
+            self._replay_spool()
+
+    def stop(self):
+        """Stop the worker thread after inserting the queued logs, and release the process lock."""
+        if self._worker is not None and self._pid == os.getpid():
+            self._stop.set()
+            self._wake.set()
+            self._worker.join()
+            self._worker = None
+            self.flush()
+        self._worker = None
+        self._release_process_lock()
+
+    def stats(self) -> dict:
+        """
+        Get statistics for the writer.
+
+        Returns:
+            dict: Queue depth, number of queued and inserted logs, logs in the spool,
+                and the time used for the inserts (seconds).
+        """
+        with self._lock:
+            flushes = self._counts["flushes"]
+            return {
+                "enabled": self.enabled,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "queued": self._counts["queued"],
+                "written": self._counts["written"],
+                "spooled": self._counts["spooled"],
+                "failed_flushes": self._counts["failed_flushes"],
+                "flushes": flushes,
+                "last_flush_seconds": self._flush_times["last"],
+                "max_flush_seconds": self._flush_times["max"],
+                "mean_flush_seconds": self._flush_times["total"] / flushes if flushes else 0.0,
+            }
+
+    def _start(self):
+        """Start the worker thread if it is not running in this process."""
+        pid = os.getpid()
+        if self._worker is not None and self._pid == pid:
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == pid:
+                return
+            if self._pid != pid:
+                atexit.register(self.stop)
+            self._acquire_process_lock()
+            self._stop.clear()
+            self._pid = pid
+            self._worker = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._worker.start()
+
+    def _acquire_process_lock(self):
+        """
+        Lock ``<spool_path>.lock`` for the current process.
+
+        Raises:
+            RuntimeError: Another process holds the lock.
+        """
+        pid = os.getpid()
+        if self._process_lock is not None:
+            if self._process_lock_pid == pid:
+                return
+            # inherited from the parent process, which shares the lock until it is released
+            self._release_process_lock(force=True)
+        # pylint: disable=consider-using-with
+        lock_file = open(f"{self.spool_path}.lock", "a", encoding="utf-8")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as err:
+            lock_file.close()
+            raise RuntimeError(
+                f"Another process is writing logs in the background ({self.spool_path}); "
+                "log_writer.enabled requires a single worker process"
+            ) from err
+        self._process_lock = lock_file
+        self._process_lock_pid = pid
+
+    def _release_process_lock(self, force: bool = False):
+        """Release the process lock if it was taken by the current process (or ``force``)."""
+        if self._process_lock is None or not (force or self._process_lock_pid == os.getpid()):
+            return
+        fcntl.flock(self._process_lock, fcntl.LOCK_UN)
+        self._process_lock.close()
+        self._process_lock = None
+
+    def _run(self):
+        """Insert the queued logs every ``flush_interval`` or when a batch is full."""
+        self._replay_spool()
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def _insert(self, logs: list) -> bool:
+        """
+        Insert logs, appending them to the spool if the insert fails.
+
+        Returns:
+            bool: Whether the logs were inserted.
+        """
+        start = self.timer()
+        try:
+            self._insert_many(self._db, logs)
+        except pymongo.errors.PyMongoError:
+            with self._lock:
+                self._counts["failed_flushes"] += 1
+            self._spool(logs)
+            return False
+        elapsed = self.timer() - start
+        with self._flushed:
+            self._counts["flushes"] += 1
+            self._counts["written"] += len(logs)
+            self._flush_times["last"] = elapsed
+            self._flush_times["max"] = max(self._flush_times["max"], elapsed)
+            self._flush_times["total"] += elapsed
+            self._pending.subtract(log_key(log) for log in logs)
+            self._pending += collections.Counter()  # drop keys without pending logs
+            self._flushed.notify_all()
+        return True
+
+    def _insert_many(self, db, logs: list):
+        """
+        Insert logs, skipping logs that are already inserted.
+
+        Logs conflicting with other logs of the entry are made again with ``rebase``
+        and inserted, at most ``CONFLICT_RETRIES`` times.
+        """
+        retries = CONFLICT_RETRIES if self.rebase else 0
+        while True:
+            try:
+                db["logs"].insert_many(logs, ordered=False)
+                return
+            except pymongo.errors.BulkWriteError as err:
+                errors = err.details["writeErrors"]
+                if any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                conflicts = [
+                    logs[error["index"]] for error in errors if is_revision_conflict(error)
+                ]
+                if not conflicts:
+                    return
+                if not retries:
+                    raise
+                logs = self.rebase(db, conflicts)
+                retries -= 1
+
+    def _spool(self, logs: list):
+        """Append logs to the spool file."""
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as spool:
+                for log in logs:
+                    spool.write(json_util.dumps(log, json_options=SPOOL_JSON_OPTIONS) + "\n")
+                spool.flush()
+                os.fsync(spool.fileno())
+        with self._lock:
+            self._counts["spooled"] += len(logs)
+
+    def _replay_spool(self):
+        """
+        Insert the logs in the spool file and remove it.
+
+        The spool is renamed to ``<spool_path>.replay`` before it is read, so logs spooled
+        meanwhile go to a new spool file. If the insert fails, the renamed file is kept
+        and inserted before the new spool file the next time.
+        """
+        replay_path = f"{self.spool_path}.replay"
+        with self._replay_lock:
+            with self._spool_lock:
+                if not os.path.exists(replay_path):
+                    if not os.path.exists(self.spool_path):
+                        return
+                    os.replace(self.spool_path, replay_path)
+            with open(replay_path, encoding="utf-8") as spool:
+                logs = [
+                    json_util.loads(line, json_options=SPOOL_JSON_OPTIONS)
+                    for line in spool
+                    if line.strip()
+                ]
+            try:
+                for start in range(0, len(logs), self.batch_size):
+                    end = start + self.batch_size
+                    self._insert_many(self._db, logs[start:end])
+            except pymongo.errors.PyMongoError:
+                with self._lock:
+                    self._counts["failed_flushes"] += 1
+                return
+            os.remove(replay_path)
+        with self._flushed:
+            self._counts["written"] += len(logs)
+            self._counts["spooled"] = max(self._counts["spooled"] - len(logs), 0)
+            self._pending.subtract(log_key(log) for log in logs)
+            self._pending += collections.Counter()
+            self._flushed.notify_all()
@@ -8,9 +8,143 @@ To migrate the database from version ``X`` to version ``Y`,
 run all migrations in ``MIGRATIONS[current_version: software_version]``.
 Version 1 to 2 should run ``MIGRATIONS[1:2]``, i.e. the function at
 ``MIGRATIONS[1]`` should be run.
+
+Indexes needed by a new data structure should be added to ``indexes.INDEXES``;
+they are created by ``db_management.migrate`` after the migrations.
+
+Migrations that rewrite every document of a collection should use
+``migrate_collection``, which streams the documents in batches to a shadow
+collection and then replaces the original collection with it.
+
+``MIGRATION_SCOPES`` describe the documents changed by each migration, in the same
+positions as in ``MIGRATIONS``. They are used by ``estimate_migration`` for dry runs
+(``db_management.py --migrate --dry-run``).
 """
 
+import copy
 import logging
+import time
+from collections import namedtuple
+from typing import Callable
+
+import bson
+import pymongo
+
+import changelog
+
+# Number of logs written per bulk write in migrate_v4_to_v5
+LOG_BATCH_SIZE = 1000
+# Number of documents read and written per batch in migrate_collection
+MIGRATION_BATCH_SIZE = 1000
+# Number of documents per collection used to estimate a migration
+DRY_RUN_SAMPLE_SIZE = 100
+
+# Documents in ``dbcollection`` matching ``query`` may be changed by a migration.
+# ``transform`` gives the changed document; with ``rewrite`` all matching documents
+# are written, also if they are not changed (see ``migrate_collection``).
+MigrationScope = namedtuple("MigrationScope", ["dbcollection", "query", "transform", "rewrite"])
+
+
+def migrate_collection(
+    db, migration: str, dbcollection: str, transform: Callable, batch_size: int = None
+) -> int:
+    """
+    Rewrite all documents in a collection without keeping them in memory.
+
+    The documents are read in ``_id`` order, changed with ``transform`` and written
+    to a shadow collection in batches. When all documents are written, the shadow
+    collection replaces the original one with ``renameCollection``, so the original
+    documents are kept until the migration is complete. The indexes of the collection
+    are dropped and must be recreated (see ``indexes.ensure_indexes``).
+
+    The progress is saved in ``db_status`` (``migration_<dbcollection>``) after each
+    batch. If the migration is interrupted, running it again resumes after the last
+    saved batch. ``transform`` must therefore give the same result when run again.
+
+    Args:
+        db: Connection to the database.
+        migration (str): The name of the migration (e.g. ``v3_to_v4``).
+        dbcollection (str): The collection to migrate.
+        transform (Callable): Function taking a document and returning the new document.
+        batch_size (int): Number of documents per batch (``MIGRATION_BATCH_SIZE`` if unset).
+
+    Returns:
+        int: The number of migrated documents.
+    """
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    shadow = f"{dbcollection}_migration"
+    status_id = f"migration_{dbcollection}"
+    status = db["db_status"].find_one({"_id": status_id})
+    if not status or status["migration"] != migration:
+        db[shadow].drop()
+        status = {"_id": status_id, "migration": migration, "migrated": 0, "swapping": False}
+        db["db_status"].replace_one({"_id": status_id}, status, upsert=True)
+    elif "last_id" in status:
+        logging.info(
+            "%s: resuming %s after %d documents", dbcollection, migration, status["migrated"]
+        )
+
+    if not status["swapping"]:
+        find_args = {"sort": [("_id", pymongo.ASCENDING)], "batch_size": batch_size}
+        if "last_id" in status:
+            # min() follows the index order, also for _id values of different types
+            find_args.update({"min": [("_id", status["last_id"])], "hint": [("_id", 1)]})
+        started = time.monotonic()
+        migrated = 0
+        operations = []
+        last_id = None
+        for document in db[dbcollection].find({}, **find_args):
+            if "last_id" in status and document["_id"] == status["last_id"]:
+                continue
+            last_id = document["_id"]
+            new_document = transform(document)
+            operations.append(
+                pymongo.ReplaceOne({"_id": new_document["_id"]}, new_document, upsert=True)
+            )
+            if len(operations) >= batch_size:
+                migrated += _write_batch(db, shadow, status, operations, last_id)
+                operations = []
+                logging.info(
+                    "%s: %d documents migrated (%.0f/s)",
+                    dbcollection,
+                    status["migrated"],
+                    migrated / max(time.monotonic() - started, 1e-9),
+                )
+        if operations:
+            migrated += _write_batch(db, shadow, status, operations, last_id)
+        status["swapping"] = True
+        db["db_status"].update_one({"_id": status_id}, {"$set": {"swapping": True}})
+        logging.info(
+            "%s: %d documents migrated in %.1f s",
+            dbcollection,
+            status["migrated"],
+            time.monotonic() - started,
+        )
+
+    if shadow in db.list_collection_names():
+        db[shadow].rename(dbcollection, dropTarget=True)
+    elif not status["migrated"]:
+        # empty collection, nothing was written to the shadow collection
+        db[dbcollection].drop()
+    db["db_status"].delete_one({"_id": status_id})
+    return status["migrated"]
+
+
+def _write_batch(db, shadow: str, status: dict, operations: list, last_id) -> int:
+    """
+    Write a batch to the shadow collection and save the progress.
+
+    Returns:
+        int: The number of written documents.
+    """
+    db[shadow].bulk_write(operations, ordered=False)
+    status["migrated"] += len(operations)
+    status["last_id"] = last_id
+    db["db_status"].update_one(
+        {"_id": status["_id"]},
+        {"$set": {"last_id": last_id, "migrated": status["migrated"]}},
+    )
+    return len(operations)
 
 
 def migrate_v1_to_v2(db):
@@ -28,6 +162,21 @@ def migrate_v1_to_v2(db):
     db["datasets"].update_many({}, {"$unset": {"cross_references": ""}})
 
 
+def _v2_user(entry: dict) -> dict:
+    """Rename the ``ORDERS`` permission of a user (see ``migrate_v1_to_v2``)."""
+    entry["permissions"] = [
+        "DATA_EDIT" if permission == "ORDERS" else permission
+        for permission in entry["permissions"]
+    ]
+    return entry
+
+
+def _v2_without_cross_references(entry: dict) -> dict:
+    """Remove ``cross_references`` (see ``migrate_v1_to_v2``)."""
+    entry.pop("cross_references", None)
+    return entry
+
+
 def migrate_v2_to_v3(db):
     """
     Update the database fields to match the changes in the data structure.
@@ -38,6 +187,16 @@ def migrate_v2_to_v3(db):
     db["users"].update_many({}, {"$pull": {"permissions": {"$in": ["STATISTICS", "DATA_LIST"]}}})
 
 
+def _v3_user(entry: dict) -> dict:
+    """Remove the old permissions of a user (see ``migrate_v2_to_v3``)."""
+    entry["permissions"] = [
+        permission
+        for permission in entry["permissions"]
+        if permission not in ("STATISTICS", "DATA_LIST")
+    ]
+    return entry
+
+
 def migrate_v3_to_v4(db):
     """
     Add prefixes to all _id fields.
@@ -47,101 +206,265 @@ def migrate_v3_to_v4(db):
     * Add c- to collections
     * Add u- to users
     * Add l- to logs
+
+    Each collection is rewritten with ``migrate_collection``.
     """
     logging.info("Orders - update identifiers to new format")
-    entries = list(db["orders"].find({}))
-    if entries:
-        for entry in entries:
-            if str(entry["_id"]).startswith("o-"):
-                continue
-            entry["_id"] = "o-" + str(entry["_id"])
-            entry["authors"] = ["u-" + str(uentry) for uentry in entry["authors"]]
-            entry["generators"] = ["u-" + str(uentry) for uentry in entry["generators"]]
-            entry["organisation"] = "u-" + str(entry["organisation"])
-            entry["editors"] = ["u-" + str(uentry) for uentry in entry["editors"]]
-            entry["datasets"] = ["d-" + str(dentry) for dentry in entry["datasets"]]
-        db["orders"].delete_many({})
-        db["orders"].insert_many(entries)
-
+    migrate_collection(db, "v3_to_v4", "orders", _v4_order)
     logging.info("Datasets - update identifiers to new format")
-    entries = list(db["datasets"].find({}))
-    if entries:
-        for entry in entries:
-            if str(entry["_id"]).startswith("d-"):
-                continue
-            entry["_id"] = "d-" + str(entry["_id"])
-        db["datasets"].delete_many({})
-        db["datasets"].insert_many(entries)
-
+    migrate_collection(db, "v3_to_v4", "datasets", _v4_dataset)
     logging.info("Collections - update identifiers to new format")
-    entries = list(db["collections"].find({}))
-    if entries:
-        for entry in entries:
-            if str(entry["_id"]).startswith("c-"):
-                continue
-            entry["_id"] = "c-" + str(entry["_id"])
-            entry["editors"] = ["u-" + str(uentry) for uentry in entry["editors"]]
-            entry["datasets"] = ["d-" + str(dentry) for dentry in entry["datasets"]]
-        db["collections"].delete_many({})
-        db["collections"].insert_many(entries)
+    migrate_collection(db, "v3_to_v4", "collections", _v4_collection)
+    logging.info("Add prefix to users")
+    migrate_collection(db, "v3_to_v4", "users", _v4_user)
+    logging.info("Add prefix to logs")
+    migrate_collection(db, "v3_to_v4", "logs", _v4_log)
 
-    logging.info("Collections - update identifiers to new format")
-    entries = list(db["collections"].find({}))
-    if entries:
-        for entry in entries:
-            if str(entry["_id"]).startswith("c-"):
-                continue
-            entry["_id"] = "c-" + str(entry["_id"])
-        db["collections"].delete_many({})
-        db["collections"].insert_many(entries)
 
-    logging.info("Add prefix to users")
-    entries = list(db["users"].find({}))
-    if entries:
-        for entry in entries:
-            entry["_id"] = "u-" + str(entry["_id"])
-        db["users"].delete_many({})
-        db["users"].insert_many(entries)
+def _v4_order(entry: dict) -> dict:
+    """Add prefixes to the identifiers in an order."""
+    if str(entry["_id"]).startswith("o-"):
+        return entry
+    entry["_id"] = "o-" + str(entry["_id"])
+    entry["authors"] = ["u-" + str(uentry) for uentry in entry["authors"]]
+    entry["generators"] = ["u-" + str(uentry) for uentry in entry["generators"]]
+    entry["organisation"] = "u-" + str(entry["organisation"])
+    entry["editors"] = ["u-" + str(uentry) for uentry in entry["editors"]]
+    entry["datasets"] = ["d-" + str(dentry) for dentry in entry["datasets"]]
+    return entry
 
-    logging.info("Add prefix to logs")
-    entries = list(db["logs"].find({}))
-    if entries:
-        for entry in entries:
-            if str(entry["_id"]).startswith("l-"):
-                continue
-            entry["_id"] = "l-" + str(entry["_id"])
-            if entry["data_type"] == "dataset":
-                entry["data"]["_id"] = "d-" + str(entry["_id"])
-            elif entry["data_type"] == "order":
-                entry["data"]["_id"] = "o-" + str(entry["_id"])
-                if entry["action"] != "delete":
-                    entry["data"]["authors"] = [
-                        "u-" + str(uentry) for uentry in entry["data"]["authors"]
-                    ]
-                    entry["data"]["generators"] = [
-                        "u-" + str(uentry) for uentry in entry["data"]["generators"]
-                    ]
-                    entry["data"]["organisation"] = "u-" + str(entry["data"]["organisation"])
-                    entry["data"]["editors"] = [
-                        "u-" + str(uentry) for uentry in entry["data"]["editors"]
-                    ]
-                    entry["data"]["datasets"] = [
-                        "d-" + str(dentry) for dentry in entry["data"]["datasets"]
-                    ]
-            elif entry["data_type"] == "collection":
-                if entry["action"] != "delete":
-                    entry["data"]["_id"] = "o-" + str(entry["_id"])
-                    entry["data"]["editors"] = [
-                        "u-" + str(uentry) for uentry in entry["data"]["editors"]
-                    ]
-                    entry["data"]["datasets"] = [
-                        "d-" + str(dentry) for dentry in entry["data"]["datasets"]
-                    ]
-            elif entry["data_type"] == "user":
-                entry["data"]["_id"] = "u-" + str(entry["_id"])
-        db["logs"].delete_many({})
-        db["logs"].insert_many(entries)
+
+def _v4_dataset(entry: dict) -> dict:
+    """Add a prefix to the identifier of a dataset."""
+    if not str(entry["_id"]).startswith("d-"):
+        entry["_id"] = "d-" + str(entry["_id"])
+    return entry
+
+
+def _v4_collection(entry: dict) -> dict:
+    """Add prefixes to the identifiers in a collection."""
+    if str(entry["_id"]).startswith("c-"):
+        return entry
+    entry["_id"] = "c-" + str(entry["_id"])
+    entry["editors"] = ["u-" + str(uentry) for uentry in entry["editors"]]
+    entry["datasets"] = ["d-" + str(dentry) for dentry in entry["datasets"]]
+    return entry
+
+
+def _v4_user(entry: dict) -> dict:
+    """Add a prefix to the identifier of a user."""
+    if not str(entry["_id"]).startswith("u-"):
+        entry["_id"] = "u-" + str(entry["_id"])
+    return entry
+
+
+def _v4_log(entry: dict) -> dict:
+    """Add prefixes to the identifiers in a log."""
+    if str(entry["_id"]).startswith("l-"):
+        return entry
+    entry["_id"] = "l-" + str(entry["_id"])
+    if entry["data_type"] == "dataset":
+        entry["data"]["_id"] = "d-" + str(entry["_id"])
+    elif entry["data_type"] == "order":
+        entry["data"]["_id"] = "o-" + str(entry["_id"])
+        if entry["action"] != "delete":
+            entry["data"]["authors"] = ["u-" + str(uentry) for uentry in entry["data"]["authors"]]
+            entry["data"]["generators"] = [
+                "u-" + str(uentry) for uentry in entry["data"]["generators"]
+            ]
+            entry["data"]["organisation"] = "u-" + str(entry["data"]["organisation"])
+            entry["data"]["editors"] = ["u-" + str(uentry) for uentry in entry["data"]["editors"]]
+            entry["data"]["datasets"] = [
+                "d-" + str(dentry) for dentry in entry["data"]["datasets"]
+            ]
+    elif entry["data_type"] == "collection":
+        if entry["action"] != "delete":
+            entry["data"]["_id"] = "o-" + str(entry["_id"])
+            entry["data"]["editors"] = ["u-" + str(uentry) for uentry in entry["data"]["editors"]]
+            entry["data"]["datasets"] = [
+                "d-" + str(dentry) for dentry in entry["data"]["datasets"]
+            ]
+    elif entry["data_type"] == "user":
+        entry["data"]["_id"] = "u-" + str(entry["_id"])
+    return entry
+
+
+def migrate_v4_to_v5(db):
+    """
+    Store the changes instead of complete entries in the logs.
+
+    * Replace ``data`` with the changed fields (see ``changelog.log_changes``)
+    * Add ``revision``, ``checkpoint`` and, for edit checkpoints, ``snapshot``
+    * Replace the index on ``data_type`` and ``data._id`` with one including ``revision``
+
+    The logs of each entry are read in order, keeping only the previous version in memory.
+
+    The last entry with all logs written is saved in ``db_status`` (``migration_v5_logs``)
+    after each batch. If the migration is interrupted, running it again resumes after that
+    entry. Logs of the next entry that were already changed are applied
+    (``changelog.apply_log``) to get the version before the remaining logs.
+    """
+    logging.info("Logs - store changes instead of complete entries")
+    status_id = "migration_v5_logs"
+    order = [
+        ("data_type", pymongo.ASCENDING),
+        ("data._id", pymongo.ASCENDING),
+        ("timestamp", pymongo.ASCENDING),
+        ("_id", pymongo.ASCENDING),
+    ]
+    db["logs"].create_index(order)
+    find_args = {"sort": order, "hint": order, "batch_size": LOG_BATCH_SIZE}
+    status = db["db_status"].find_one({"_id": status_id})
+    if status:
+        logging.info("Logs - resuming after %s", status["last_entry"])
+        # min() is inclusive; MaxKey skips all logs of the saved entry
+        find_args["min"] = [
+            ("data_type", status["last_entry"][0]),
+            ("data._id", status["last_entry"][1]),
+            ("timestamp", bson.max_key.MaxKey()),
+            ("_id", bson.max_key.MaxKey()),
+        ]
+    current_entry = completed_entry = None
+    operations = []
+    for log in db["logs"].find({}, **find_args):
+        if not isinstance(log.get("data"), dict) or "_id" not in log["data"]:
+            continue
+        if (log["data_type"], log["data"]["_id"]) != current_entry:
+            completed_entry = current_entry
+            current_entry = (log["data_type"], log["data"]["_id"])
+            previous = None
+            revision = 0
+        if "revision" in log:
+            # changed before the migration was interrupted
+            previous = changelog.apply_log(previous, log)
+            revision = log["revision"]
+            continue
+        # the old logs contain the complete entry, except for deletions
+        current = None if log["action"] == "delete" else log["data"]
+        revision += 1
+        changelog.log_changes(log, log["data"]["_id"], previous, current, revision)
+        previous = current
+        operations.append(pymongo.ReplaceOne({"_id": log["_id"]}, log))
+        if len(operations) >= LOG_BATCH_SIZE:
+            db["logs"].bulk_write(operations, ordered=False)
+            operations = []
+            if completed_entry:
+                db["db_status"].replace_one(
+                    {"_id": status_id},
+                    {"_id": status_id, "last_entry": list(completed_entry)},
+                    upsert=True,
+                )
+    if operations:
+        db["logs"].bulk_write(operations, ordered=False)
+    db["db_status"].delete_one({"_id": status_id})
+    old_index = "data_type_1_data._id_1"
+    if old_index in db["logs"].index_information():
+        db["logs"].drop_index(old_index)
+
+
+def _v5_log(log: dict) -> dict:
+    """
+    Convert a log as if it was the first log of the entry (see ``migrate_v4_to_v5``).
+
+    Only used for estimates; the migration compares each log to the previous one.
+    """
+    if not isinstance(log.get("data"), dict) or "_id" not in log["data"]:
+        return log
+    current = None if log["action"] == "delete" else log["data"]
+    return changelog.log_changes(log, log["data"]["_id"], None, current, 1)
+
+
+def estimate_migration(  # pylint: disable=too-many-locals
+    db, version: int, sample_size: int = DRY_RUN_SAMPLE_SIZE
+) -> dict:
+    """
+    Estimate the cost of a migration without changing any entries.
+
+    For each collection in ``MIGRATION_SCOPES[version]``, a random sample of the
+    matching documents is transformed. The share of changed documents gives the
+    number of affected documents and their mean BSON size the number of bytes to
+    write. The duration is estimated by writing the transformed sample to a
+    temporary collection (``<collection>_dry_run``), which is dropped afterwards.
+
+    Args:
+        db: Connection to the database.
+        version (int): The version to migrate from.
+        sample_size (int): Number of documents to sample per collection.
+
+    Returns:
+        dict: ``documents``, ``bytes`` and ``seconds`` for each collection and in total.
+    """
+    estimate = {"from": version, "to": version + 1, "collections": []}
+    for scope in MIGRATION_SCOPES[version]:
+        matching = db[scope.dbcollection].count_documents(scope.query)
+        sample = list(
+            db[scope.dbcollection].aggregate(
+                [{"$match": scope.query}, {"$sample": {"size": sample_size}}]
+            )
+        )
+        changed = []
+        for document in sample:
+            new_document = scope.transform(copy.deepcopy(document))
+            if scope.rewrite or new_document != document:
+                changed.append(new_document)
+        affected = round(matching * len(changed) / len(sample)) if sample else 0
+        seconds_per_document = 0.0
+        if changed:
+            scratch = db[f"{scope.dbcollection}_dry_run"]
+            # left over if an earlier dry run was interrupted
+            scratch.drop()
+            try:
+                started = time.monotonic()
+                scratch.insert_many(changed, ordered=False)
+                seconds_per_document = (time.monotonic() - started) / len(changed)
+            finally:
+                scratch.drop()
+        mean_size = sum(
+            len(bson.encode(entry, codec_options=db.codec_options)) for entry in changed
+        ) / max(len(changed), 1)
+        estimate["collections"].append(
+            {
+                "collection": scope.dbcollection,
+                "matching": matching,
+                "sampled": len(sample),
+                "documents": affected,
+                "bytes": round(affected * mean_size),
+                "seconds": round(affected * seconds_per_document, 1),
+            }
+        )
+    for key in ("documents", "bytes", "seconds"):
+        estimate[key] = sum(entry[key] for entry in estimate["collections"])
+    return estimate
 
 
 # Position 0 is empty since the first release is 1
-MIGRATIONS = [None, migrate_v1_to_v2, migrate_v2_to_v3, migrate_v3_to_v4]
+MIGRATIONS = [None, migrate_v1_to_v2, migrate_v2_to_v3, migrate_v3_to_v4, migrate_v4_to_v5]
+
+MIGRATION_SCOPES = [
+    None,
+    [
+        MigrationScope("users", {"permissions": "ORDERS"}, _v2_user, False),
+        MigrationScope(
+            "collections",
+            {"cross_references": {"$exists": True}},
+            _v2_without_cross_references,
+            False,
+        ),
+        MigrationScope(
+            "datasets", {"cross_references": {"$exists": True}}, _v2_without_cross_references, False
+        ),
+    ],
+    [
+        MigrationScope(
+            "users", {"permissions": {"$in": ["STATISTICS", "DATA_LIST"]}}, _v3_user, False
+        )
+    ],
+    [
+        MigrationScope("orders", {}, _v4_order, True),
+        MigrationScope("datasets", {}, _v4_dataset, True),
+        MigrationScope("collections", {}, _v4_collection, True),
+        MigrationScope("users", {}, _v4_user, True),
+        MigrationScope("logs", {}, _v4_log, True),
+    ],
+    [MigrationScope("logs", {"revision": {"$exists": False}}, _v5_log, False)],
+]
@@ -8,7 +8,9 @@ Special permissions are required to access orders:
 """
 import flask
 
+import cascade
 import structure
+import unit_of_work
 import utils
 
 blueprint = flask.Blueprint("order", __name__)  # pylint: disable=invalid-name
@@ -31,20 +33,46 @@ def list_orders():
     """
     List all orders visible to the current user.
 
+    Supports pagination, sorting and field selection (see ``utils.parse_list_query``).
+
     Returns:
         flask.Response: JSON structure with a list of orders.
     """
+    etag = utils.req_etag("orders")
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
+
     projection = {"_id": 1, "title": 1, "tags": 1, "properties": 1}
     if utils.req_has_permission("DATA_MANAGEMENT"):
-        orders = list(flask.g.db["orders"].find(projection=projection))
+        query = {}
     else:
-        orders = list(
-            flask.g.db["orders"].find(
-                {"editors": flask.g.current_user["_id"]}, projection=projection
-            )
-        )
+        query = {"editors": flask.g.current_user["_id"]}
+    result = utils.req_list_entries(
+        "orders",
+        "orders",
+        query,
+        projection,
+        allowed_fields=("title", "description", "tags", "properties"),
+    )
+
+    response = utils.response_json_stream(result, "orders")
+    response.set_etag(etag)
+    return response
+
+
+@blueprint.route("/facets", methods=["GET"])
+def get_order_facets():
+    """
+    Get the number of orders with each tag and property.
 
-    return utils.response_json({"orders": orders})
+    Only the orders visible to the current user are counted.
+
+    Returns:
+        flask.Response: JSON structure with the counts.
+    """
+    if utils.req_has_permission("DATA_MANAGEMENT"):
+        return utils.req_facets_response("orders")
+    return utils.req_facets_response("orders", {"editors": flask.g.current_user["_id"]})
 
 
 @blueprint.route("/<identifier>", methods=["GET"])
@@ -68,10 +96,15 @@ def get_order(identifier):
         or flask.g.current_user["_id"] in entry["editors"]
     ):
         flask.abort(status=403)
+    etag = utils.req_etag("orders", entry["_id"], ("datasets", "users"))
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
 
     prepare_order_response(entry, flask.g.db)
 
-    return utils.response_json({"order": entry})
+    response = utils.response_json({"order": entry})
+    response.set_etag(etag)
+    return response
 
 
 @blueprint.route("/<identifier>/log", methods=["GET"])
@@ -81,7 +114,9 @@ def get_order_logs(identifier):
 
     Logs will be sorted chronologically.
 
-    The ``data`` in each log will be trimmed to only show the changed fields.
+    The ``data`` in each log only contains the changed fields.
+
+    Supports time ranges and pagination (see ``utils.req_list_logs``).
 
     Args:
         identifier (str): Uuid for the wanted order.
@@ -98,16 +133,38 @@ def get_order_logs(identifier):
     ):
         flask.abort(status=403)
 
-    order_logs = list(flask.g.db["logs"].find({"data_type": "order", "data._id": entry["_id"]}))
-    if not order_logs:
+    query = {"data_type": "order", "data._id": entry["_id"]}
+    if not flask.g.db["logs"].find_one(query, {"_id": 1}):
         flask.abort(status=404)
+    order_logs = utils.req_list_logs(query)
+
+    return utils.response_json_stream(
+        {"entry_id": entry["_id"], "data_type": "order", **order_logs}, "logs"
+    )
+
+
+@blueprint.route("/<identifier>/at", methods=["GET"])
+def get_order_at(identifier: str):
+    """
+    Get the order as it was at the time in ``timestamp``.
 
-    for log in order_logs:
-        del log["data_type"]
+    The order is rebuilt from the logs (see ``utils.req_log_state_response``).
+    Deleted orders can only be accessed with DATA_MANAGEMENT.
 
-    utils.incremental_logs(order_logs)
+    Args:
+        identifier (str): Uuid for the wanted order.
 
-    return utils.response_json({"entry_id": entry["_id"], "data_type": "order", "logs": order_logs})
+    Returns:
+        flask.Response: Json structure for the order.
+    """
+    if not utils.req_has_permission("DATA_MANAGEMENT"):
+        entry = utils.req_get_entry("orders", identifier)
+        if not entry:
+            flask.abort(status=404)
+        if flask.g.current_user["_id"] not in entry["editors"]:
+            flask.abort(status=403)
+
+    return utils.req_log_state_response("order", identifier)
 
 
 @blueprint.route("", methods=["POST"])
@@ -157,6 +214,8 @@ def delete_order(identifier: str):
     """
     Delete the order with the given identifier.
 
+    The datasets of the order are also deleted (see ``cascade``).
+
     Returns:
         flask.Response: Status code
     """
@@ -171,26 +230,7 @@ def delete_order(identifier: str):
     ):
         flask.abort(status=403)
 
-    for dataset_uuid in entry["datasets"]:
-        result = utils.req_commit_to_db("datasets", "delete", {"_id": dataset_uuid})
-        if not result.log or not result.data:
-            flask.abort(status=500)
-    # delete dataset references in all collections
-    collections = list(flask.g.db["collections"].find({"datasets": {"$in": entry["datasets"]}}))
-    flask.g.db["collections"].update_many({}, {"$pull": {"datasets": {"$in": entry["datasets"]}}})
-    for collection in collections:
-        collection["datasets"] = [
-            ds for ds in collection["datasets"] if ds not in entry["datasets"]
-        ]
-        utils.req_make_log_new(
-            data_type="collection",
-            action="edit",
-            comment="Order deleted",
-            data=collection,
-        )
-
-    result = utils.req_commit_to_db("orders", "delete", {"_id": entry["_id"]})
-    if not result.log or not result.data:
+    if not cascade.delete_order(flask.g.db, entry["_id"], flask.g.current_user["_id"]):
         flask.abort(status=500)
     return flask.Response(status=200)
 
@@ -286,27 +326,89 @@ def add_dataset(identifier: str):  # pylint: disable=too-many-branches
 
     new_dataset.update(indata)
 
-    ds_result = utils.req_commit_to_db("datasets", "add", new_dataset)
-    if not ds_result.log or not ds_result.data:
-        flask.abort(status=500)
-
-    order_result = flask.g.db["orders"].update_one(
-        {"_id": order["_id"]}, {"$push": {"datasets": new_dataset["_id"]}}
+    updated_order = {**order, "datasets": order["datasets"] + [new_dataset["_id"]]}
+    work = unit_of_work.UnitOfWork(
+        flask.g.db, flask.g.current_user["_id"], logger=flask.current_app.logger
     )
-    if not order_result.acknowledged:
-        flask.current_app.logger.error(
-            "Failed to add dataset %s to order %s", new_dataset["_id"], order["_id"]
-        )
-        flask.abort(status=500)
-    order["datasets"].append(new_dataset["_id"])
-    utils.req_make_log_new(
-        data_type="order",
-        action="edit",
+    work.add("datasets", new_dataset)
+    work.update(
+        "orders",
+        order["_id"],
+        {"$push": {"datasets": new_dataset["_id"]}},
+        updated_order,
+        previous=order,
         comment="Dataset added",
-        data=order,
     )
+    if not work.commit():
+        flask.abort(status=500)
 
-    return utils.response_json({"_id": ds_result.ins_id})
+    return utils.response_json({"_id": new_dataset["_id"]})
+
+
+@blueprint.route("/<identifier>/datasets", methods=["POST"])
+def add_datasets(identifier: str):
+    """
+    Add multiple datasets to the given order.
+
+    The datasets (``{"datasets": [...]}``, at most ``utils.MAX_BULK_SIZE``) are validated
+    together, then committed with the update of the order in one unit of work
+    (see ``unit_of_work``). Datasets that fail validation are not added.
+
+    Args:
+        identifier (str): The order to add the datasets to.
+
+    Returns:
+        flask.Response: Json structure with ``status`` and, if added, ``_id`` for each
+            dataset, in the same order as in the request.
+    """
+    order = utils.req_get_entry("orders", identifier)
+    if not order:
+        flask.abort(status=404)
+
+    if (
+        not utils.req_has_permission("DATA_MANAGEMENT")
+        and flask.g.current_user["_id"] not in order["editors"]
+    ):
+        flask.abort(status=403)
+
+    indata = utils.req_bulk_indata("datasets")
+    statuses = utils.check_indata_many(indata, structure.dataset(), ["_id"])
+    new_datasets = {}
+    for i, status in enumerate(statuses):
+        if status == 200:
+            new_datasets[i] = structure.dataset()
+            new_datasets[i].update(utils.prepare_for_db(indata[i]))
+
+    if new_datasets:
+        added_ids = [dataset["_id"] for dataset in new_datasets.values()]
+        work = unit_of_work.UnitOfWork(
+            flask.g.db, flask.g.current_user["_id"], logger=flask.current_app.logger
+        )
+        for dataset in new_datasets.values():
+            work.add("datasets", dataset)
+        work.update(
+            "orders",
+            order["_id"],
+            {"$push": {"datasets": {"$each": added_ids}}},
+            {**order, "datasets": order["datasets"] + added_ids},
+            previous=order,
+            comment="Datasets added",
+        )
+        if not work.commit():
+            for i in new_datasets:
+                statuses[i] = 500
+            new_datasets = {}
+
+    return utils.response_json(
+        {
+            "datasets": [
+                {"status": status, "_id": new_datasets[i]["_id"]}
+                if i in new_datasets
+                else {"status": status}
+                for i, status in enumerate(statuses)
+            ]
+        }
+    )
 
 
 def prepare_order_response(order_data: dict, mongodb):
@@ -319,20 +421,37 @@ def prepare_order_response(order_data: dict, mongodb):
         order_data (dict): The order entry from the db.
         mongodb: The mongo database to use.
     """
-    order_data["authors"] = utils.user_uuid_data(order_data["authors"], mongodb)
-    order_data["generators"] = utils.user_uuid_data(order_data["generators"], mongodb)
-    order_data["editors"] = utils.user_uuid_data(order_data["editors"], mongodb)
-    if order_data["organisation"]:
-        if org_entry := utils.user_uuid_data(order_data["organisation"], mongodb):
-            order_data["organisation"] = org_entry[0]
-        else:
+    prepare_orders_response([order_data], mongodb)
+
+
+def prepare_orders_response(orders: list, mongodb):
+    """
+    Prepare multiple orders by e.g. converting user uuids to names etc.
+
+    The users of all orders are looked up with one query,
+    and the datasets of all orders with another.
+
+    Changes are done in-place.
+
+    Args:
+        orders (list): The order entries from the db.
+        mongodb: The mongo database to use.
+    """
+    utils.resolve_users(orders, ("authors", "generators", "editors", "organisation"), mongodb)
+    for order_data in orders:
+        if not order_data["organisation"]:
+            order_data["organisation"] = {}
+        elif not isinstance(order_data["organisation"], dict):
             flask.current_app.logger.error(
                 "Reference to non-existing organisation: %s", order_data["organisation"]
             )
-    else:
-        order_data["organisation"] = {}
 
-    # convert dataset list into {title, _id}
-    order_data["datasets"] = list(
-        mongodb["datasets"].find({"_id": {"$in": order_data["datasets"]}}, {"_id": 1, "title": 1})
-    )
+    # convert dataset lists into [{title, _id}, ...]
+    dataset_ids = list({ds for order_data in orders for ds in order_data["datasets"]})
+    datasets = {
+        entry["_id"]: entry for entry in utils.get_titles(mongodb, "datasets", dataset_ids)[0]
+    }
+    for order_data in orders:
+        order_data["datasets"] = [
+            dict(datasets[ds]) for ds in order_data["datasets"] if ds in datasets
+        ]
@@ -7,10 +7,28 @@ import utils
 blueprint = flask.Blueprint("schema", __name__)  # pylint: disable=invalid-name
 
 
+def schema_response(data: dict) -> flask.Response:
+    """
+    Prepare a response with an ETag based on the content.
+
+    The schemas only change with the code, so ``304 Not Modified`` is returned
+    if the client has the current version.
+
+    Args:
+        data (dict): The data for the response.
+
+    Returns:
+        flask.Response: The response.
+    """
+    response = utils.response_json(data)
+    response.add_etag()
+    return response.make_conditional(flask.request)
+
+
 @blueprint.route("", methods=["GET"])
 def list_available_schemas():
     """Provide a list of available schemas."""
-    return utils.response_json({"schemas": ["collection", "dataset", "order", "user"]})
+    return schema_response({"schemas": ["collection", "dataset", "order", "user"]})
 
 
 @blueprint.route("/collection", methods=["GET"])
@@ -23,7 +41,7 @@ def get_collection_data_structure():
     """
     empty_collection = structure.collection()
     empty_collection["_id"] = ""
-    return utils.response_json({"collection": empty_collection})
+    return schema_response({"collection": empty_collection})
 
 
 @blueprint.route("/dataset", methods=["GET"])
@@ -36,7 +54,7 @@ def get_dataset_data_structure():
     """
     empty_dataset = structure.dataset()
     empty_dataset["_id"] = ""
-    return utils.response_json({"dataset": empty_dataset})
+    return schema_response({"dataset": empty_dataset})
 
 
 @blueprint.route("/order", methods=["GET"])
@@ -49,7 +67,7 @@ def get_order_data_structure():
     """
     empty_order = structure.order()
     empty_order["_id"] = ""
-    return utils.response_json({"order": empty_order})
+    return schema_response({"order": empty_order})
 
 
 @blueprint.route("/user", methods=["GET"])
@@ -62,4 +80,4 @@ def get_user_data_structure():
     """
     empty_user = structure.user()
     empty_user["_id"] = ""
-    return utils.response_json({"user": empty_user})
+    return schema_response({"user": empty_user})
@@ -0,0 +1,230 @@
+"""
+Search requests.
+
+Datasets, orders and collections are searched using the text indexes on
+``title`` and ``description``, and can be filtered by tags and properties
+(see ``indexes.py``). A page of results is fetched with its own aggregation, so
+it can use the indexes. Facet counts for tags and properties are computed for all
+matching entries in a separate aggregation. Searches without any filter use the
+stored counts instead (see ``facets.py``).
+"""
+from collections import namedtuple
+
+import flask
+
+import facets
+import utils
+
+blueprint = flask.Blueprint("search", __name__)  # pylint: disable=invalid-name
+
+SearchQuery = namedtuple("SearchQuery", ["text", "tags", "properties", "limit", "offset"])
+
+SEARCH_TYPES = {"dataset": "datasets", "order": "orders", "collection": "collections"}
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+FACET_LIMIT = 50
+
+
+def parse_search_query(args) -> SearchQuery:
+    """
+    Parse the query parameters for a search.
+
+    * ``q``: Text to search for in title and description.
+    * ``tags``: Comma-separated tags that must all be set.
+    * ``property``: ``key:value`` that must be set, may be repeated.
+    * ``limit``: Max number of results (1 - ``MAX_LIMIT``).
+    * ``offset``: Number of results to skip.
+
+    Args:
+        args (werkzeug.datastructures.MultiDict): The query parameters.
+
+    Returns:
+        SearchQuery: The parsed parameters.
+
+    Raises:
+        ValueError: Bad parameter value.
+    """
+    tags = [tag for tag in args.get("tags", "").split(",") if tag]
+    properties = {}
+    for prop in args.getlist("property"):
+        key, sep, value = prop.partition(":")
+        if not sep or not key or not value or key.startswith("$") or "." in key:
+            raise ValueError(f"Bad property filter ({prop})")
+        properties[key] = value
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+        offset = int(args.get("offset", 0))
+    except ValueError as err:
+        raise ValueError("Bad limit or offset") from err
+    if not 0 < limit <= MAX_LIMIT or offset < 0:
+        raise ValueError(f"Limit must be 1-{MAX_LIMIT} and offset positive")
+    return SearchQuery(
+        text=args.get("q", "").strip(),
+        tags=tags,
+        properties=properties,
+        limit=limit,
+        offset=offset,
+    )
+
+
+def search_match(search_query: SearchQuery, visibility: dict = None) -> dict:
+    """
+    Make the filter for a search.
+
+    Args:
+        search_query (SearchQuery): The search parameters.
+        visibility (dict): Filter limiting the entries the user may see.
+
+    Returns:
+        dict: The filter, combining visibility, text, tags and properties.
+    """
+    match = dict(visibility or {})
+    if search_query.text:
+        match["$text"] = {"$search": search_query.text}
+    if search_query.tags:
+        match["tags"] = {"$all": search_query.tags}
+    for key, value in search_query.properties.items():
+        match[f"properties.{key}"] = value
+    return match
+
+
+def search_pipeline(search_query: SearchQuery, visibility: dict = None) -> list:
+    """
+    Make the aggregation pipeline for a page of search results.
+
+    The stages before ``$project`` can use the indexes, so a page does not require
+    all matching entries to be loaded (see ``facet_pipeline`` for the counts).
+
+    Args:
+        search_query (SearchQuery): The search parameters.
+        visibility (dict): Filter limiting the entries the user may see.
+
+    Returns:
+        list: The pipeline, giving one document per result.
+    """
+    projection = {"_id": 1, "title": 1, "tags": 1, "properties": 1}
+    if search_query.text:
+        sort = {"score": {"$meta": "textScore"}, "_id": 1}
+        projection["score"] = {"$meta": "textScore"}
+    else:
+        sort = {"_id": 1}
+    return [
+        {"$match": search_match(search_query, visibility)},
+        {"$sort": sort},
+        {"$skip": search_query.offset},
+        {"$limit": search_query.limit},
+        {"$project": projection},
+    ]
+
+
+def facet_pipeline(search_query: SearchQuery, visibility: dict = None) -> list:
+    """
+    Make the aggregation pipeline counting the matches and facets of a search.
+
+    Args:
+        search_query (SearchQuery): The search parameters.
+        visibility (dict): Filter limiting the entries the user may see.
+
+    Returns:
+        list: The pipeline, giving one document with ``total``, ``tags`` and ``properties``.
+    """
+    return [
+        {"$match": search_match(search_query, visibility)},
+        {
+            "$facet": {
+                "total": [{"$count": "count"}],
+                "tags": [
+                    {"$unwind": "$tags"},
+                    {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                    {"$sort": {"count": -1, "_id": 1}},
+                    {"$limit": FACET_LIMIT},
+                    {"$project": {"_id": 0, "value": "$_id", "count": 1}},
+                ],
+                "properties": [
+                    {"$project": {"property": {"$objectToArray": "$properties"}}},
+                    {"$unwind": "$property"},
+                    {
+                        "$group": {
+                            "_id": {"key": "$property.k", "value": "$property.v"},
+                            "count": {"$sum": 1},
+                        }
+                    },
+                    {"$sort": {"count": -1, "_id": 1}},
+                    {"$limit": FACET_LIMIT},
+                    {"$project": {"_id": 0, "key": "$_id.key", "value": "$_id.value", "count": 1}},
+                ],
+            }
+        },
+    ]
+
+
+def visibility_filter(search_type: str) -> dict:
+    """
+    Get the filter for the entries the current user may see.
+
+    Datasets and collections are public. Orders require ``DATA_EDIT`` and are
+    limited to the orders where the user is editor, unless the user has
+    ``DATA_MANAGEMENT`` (same as ``order.list_orders``).
+
+    Args:
+        search_type (str): The type of entries (``dataset``, ``order``, ``collection``).
+
+    Returns:
+        dict: The filter.
+    """
+    if search_type != "order":
+        return {}
+    perm_status = utils.req_check_permissions(["DATA_EDIT"])
+    if perm_status != 200:
+        flask.abort(status=perm_status)
+    if utils.req_has_permission("DATA_MANAGEMENT"):
+        return {}
+    return {"editors": flask.g.current_user["_id"]}
+
+
+@blueprint.route("", methods=["GET"])
+def search():
+    """
+    Search for datasets, orders or collections.
+
+    The type is set with the parameter ``type`` (default ``dataset``), see
+    ``parse_search_query`` for the other parameters.
+
+    Returns:
+        flask.Response: JSON structure with the results, the total number of
+            matches and the facet counts for tags and properties.
+    """
+    search_type = flask.request.args.get("type", "dataset")
+    if search_type not in SEARCH_TYPES:
+        flask.abort(status=400)
+    try:
+        search_query = parse_search_query(flask.request.args)
+    except ValueError as err:
+        flask.current_app.logger.debug("Bad search parameters: %s", err)
+        flask.abort(status=400)
+
+    dbcollection = SEARCH_TYPES[search_type]
+    visibility = visibility_filter(search_type)
+    # without filters all entries match, so the stored counts can be used
+    unfiltered = not (
+        visibility or search_query.text or search_query.tags or search_query.properties
+    )
+    results = list(flask.g.db[dbcollection].aggregate(search_pipeline(search_query, visibility)))
+    if unfiltered:
+        total = flask.g.db[dbcollection].estimated_document_count()
+        counts = facets.get_facets(flask.g.db, dbcollection)
+        counts = {key: counts[key][:FACET_LIMIT] for key in ("tags", "properties")}
+    else:
+        counts = next(flask.g.db[dbcollection].aggregate(facet_pipeline(search_query, visibility)))
+        total = counts["total"][0]["count"] if counts["total"] else 0
+
+    return utils.response_json(
+        {
+            "type": search_type,
+            "results": results,
+            "total": total,
+            "limit": search_query.limit,
+            "offset": search_query.offset,
+            "facets": {"tags": counts["tags"], "properties": counts["properties"]},
+        }
+    )
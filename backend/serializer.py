@@ -0,0 +1,123 @@
+"""
+JSON encoding of responses.
+
+``orjson`` is used if it is installed, otherwise the standard library encoder.
+The output is the same for both backends:
+
+* ``_id`` keys are renamed to ``id`` (at any level)
+* ``datetime`` is written as an HTTP date (like ``flask.jsonify``)
+* ``uuid.UUID`` is written as a string
+
+The data is not modified.
+"""
+import datetime
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# In compact json an (unescaped) key always directly follows ``{`` or ``,``,
+# so these only match keys named ``_id``, never string content.
+ID_KEYS = ((b'{"_id":', b'{"id":'), (b',"_id":', b',"id":'))
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+BACKENDS = ("orjson", "json")
+
+
+def http_date(timestamp: datetime.datetime) -> str:
+    """
+    Format a datetime as an HTTP date, like ``werkzeug.http.http_date``.
+
+    Naive datetimes are assumed to be UTC.
+
+    Args:
+        timestamp (datetime.datetime): The datetime to format.
+
+    Returns:
+        str: The date, e.g. ``Mon, 01 Mar 2021 12:30:05 GMT``.
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return (
+        f"{WEEKDAYS[timestamp.weekday()]}, {timestamp.day:02d} {MONTHS[timestamp.month - 1]} "
+        f"{timestamp.year:04d} {timestamp.hour:02d}:{timestamp.minute:02d}:"
+        f"{timestamp.second:02d} GMT"
+    )
+
+
+def _default(obj):
+    """
+    Encode types not supported by the json encoder.
+
+    Args:
+        obj: The object to encode.
+
+    Returns:
+        Any: A json-compatible value.
+
+    Raises:
+        TypeError: The type is not supported.
+    """
+    if isinstance(obj, datetime.datetime):
+        return http_date(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps_orjson(data) -> bytes:
+    """Encode ``data`` using orjson."""
+    return orjson.dumps(
+        data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def _dumps_json(data) -> bytes:
+    """Encode ``data`` using the standard library."""
+    return json.dumps(data, default=_default, separators=(",", ":")).encode()
+
+
+_DUMPS = {"orjson": _dumps_orjson, "json": _dumps_json}
+
+backend = "orjson" if orjson else "json"
+
+
+def use_backend(name: str):
+    """
+    Select the encoder to use.
+
+    Args:
+        name (str): One of ``BACKENDS``.
+
+    Raises:
+        ValueError: Unknown backend, or ``orjson`` is not installed.
+    """
+    global backend  # pylint: disable=global-statement,invalid-name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown json backend ({name})")
+    if name == "orjson" and not orjson:
+        raise ValueError("orjson is not installed")
+    backend = name
+
+
+def dumps(data) -> bytes:
+    """
+    Encode ``data`` as json, renaming ``_id`` to ``id``.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        bytes: The json document.
+    """
+    encoded = _DUMPS[backend](data)
+    for old, new in ID_KEYS:
+        encoded = encoded.replace(old, new)
+    return encoded
@@ -4,6 +4,7 @@ Required fields for the different data types.
 See documentation (Data Structure) for more information.
 """
 
+import changelog
 import utils
 
 
@@ -108,14 +109,6 @@ def log():
     Provide a basic data structure for a log document.
 
     Returns:
-        dict: The data structure for a log.
+        dict: The data structure for a log (see ``changelog.empty_log``).
     """
-    return {
-        "_id": "l-" + utils.new_uuid(),
-        "action": "",
-        "comment": "",
-        "data_type": "",
-        "data": "",
-        "timestamp": utils.make_timestamp(),
-        "user": "",
-    }
+    return changelog.empty_log()
@@ -52,6 +52,44 @@ def mdb():
     yield db_connection()
 
 
+class FakeCollection:
+    """
+    Minimal collection supporting ``find`` with ``{"_id": {"$in": [...]}}``.
+
+    Counts the queries, for tests of functions that should batch their lookups.
+    """
+
+    def __init__(self, entries):
+        """
+        Add the entries.
+
+        Args:
+            entries: The entries (``dict`` with ``_id``) or only their identifiers.
+        """
+        self.entries = [entry if isinstance(entry, dict) else {"_id": entry} for entry in entries]
+        self.queries = 0
+
+    def find(self, query: dict, projection=None) -> list:
+        """
+        Find the entries with ``_id`` in ``query``.
+
+        Args:
+            query (dict): The query, ``{"_id": {"$in": [...]}}``.
+            projection: Fields to include (``dict`` or list), ``_id`` is always included.
+
+        Returns:
+            list: The found entries.
+        """
+        self.queries += 1
+        found = [entry for entry in self.entries if entry["_id"] in query["_id"]["$in"]]
+        if projection is None:
+            return [dict(entry) for entry in found]
+        if isinstance(projection, dict):
+            projection = [field for field, include in projection.items() if include]
+        fields = ["_id"] + [field for field in projection if field != "_id"]
+        return [{field: entry[field] for field in fields if field in entry} for entry in found]
+
+
 def as_user(session: requests.Session, auth_id: str, set_csrf: bool = True) -> int:
     """
     Set the current user to the one with the provided ``auth_id``.
@@ -164,7 +202,7 @@ def make_request(session, url: str, data: dict = None, method="GET", ret_json: b
     elif method == "PUT":
         response = session.put(f"{BASE_URL}{url}", json=data)
     elif method == "DELETE":
-        response = session.delete(f"{BASE_URL}{url}")
+        response = session.delete(f"{BASE_URL}{url}", json=data)
     else:
         raise ValueError(f"Unsupported http method ({method})")
 
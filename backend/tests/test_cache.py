@@ -0,0 +1,86 @@
+"""Tests for the in-process caches."""
+
+import cache
+
+
+class FakeTimer:
+    """Timer that only moves when told to."""
+
+    def __init__(self):
+        """Start at time 0."""
+        self.now = 0.0
+
+    def __call__(self):
+        """Get the current time."""
+        return self.now
+
+
+def test_ttl_cache_expiry():
+    """
+    Confirm that entries expire after ``ttl`` seconds.
+
+    Checks:
+    * Entry available before expiry
+    * Entry gone after expiry
+    * Hits and misses are counted
+    """
+    timer = FakeTimer()
+    ttl_cache = cache.TTLCache(max_size=10, ttl=5, timer=timer)
+    ttl_cache.set("key", "value")
+    assert ttl_cache.get("key") == "value"
+    timer.now = 4.9
+    assert ttl_cache.get("key") == "value"
+    timer.now = 5
+    assert ttl_cache.get("key") is None
+    assert ttl_cache.get("key", "default") == "default"
+    stats = ttl_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["hit_rate"] == 0.5
+    assert stats["size"] == 0
+
+
+def test_ttl_cache_size():
+    """
+    Confirm that the least recently used entry is evicted when the cache is full.
+
+    Checks:
+    * Size never exceeds ``max_size``
+    * Recently read entries are kept
+    * ``max_size`` 0 disables the cache
+    """
+    ttl_cache = cache.TTLCache(max_size=3, ttl=60)
+    for i in range(3):
+        ttl_cache.set(i, i)
+    assert ttl_cache.get(0) == 0
+    ttl_cache.set(3, 3)
+    assert len(ttl_cache) == 3
+    assert ttl_cache.get(1) is None
+    assert ttl_cache.get(0) == 0
+    assert ttl_cache.get(3) == 3
+
+    ttl_cache.configure(max_size=0)
+    ttl_cache.set("key", "value")
+    assert ttl_cache.get("key") is None
+    assert len(ttl_cache) == 0
+
+
+def test_ttl_cache_invalidation():
+    """
+    Confirm that entries can be removed.
+
+    Checks:
+    * ``pop`` removes a single entry
+    * ``pop_matching`` removes the matching entries
+    * ``clear`` removes all entries and resets the counters
+    """
+    ttl_cache = cache.TTLCache(max_size=10, ttl=60)
+    for i in range(6):
+        ttl_cache.set(("user", i), {"user_id": i % 2})
+    ttl_cache.pop(("user", 0))
+    assert ttl_cache.get(("user", 0)) is None
+    assert ttl_cache.pop_matching(lambda _, value: value["user_id"] == 1) == 3
+    assert len(ttl_cache) == 2
+    ttl_cache.clear()
+    assert len(ttl_cache) == 0
+    assert ttl_cache.stats()["hits"] == 0
@@ -0,0 +1,49 @@
+"""Tests for deletions with removal of references."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import cascade
+import helpers
+import utils
+from helpers import mdb
+
+
+def test_delete_datasets(mdb):
+    """
+    Confirm that datasets are deleted and removed from orders and collections.
+
+    Checks:
+    * The datasets are deleted, unknown identifiers are skipped
+    * Only the orders and collections listing the datasets are changed and logged
+    * The revisions of the logs follow the earlier logs
+    """
+    order_id = helpers.add_order()
+    ds_ids = [helpers.add_dataset(order_id) for _ in range(3)]
+    coll_id = helpers.add_collection(ds_ids[:2])
+    other_coll_id = helpers.add_collection(ds_ids[2:])
+    user_id = mdb["users"].find_one({"auth_ids": helpers.USERS["edit"]})["_id"]
+    utils.make_log_new(mdb, "dataset", "edit", "Test", user_id, {"_id": ds_ids[0], "title": "T"})
+
+    deleted = cascade.delete_datasets(mdb, ds_ids[:2] + ["d-unknown"], user_id, "Test delete")
+    assert sorted(deleted) == sorted(ds_ids[:2])
+    assert mdb["datasets"].count_documents({"_id": {"$in": ds_ids}}) == 1
+    assert mdb["orders"].find_one({"_id": order_id})["datasets"] == ds_ids[2:]
+    assert mdb["collections"].find_one({"_id": coll_id})["datasets"] == []
+    assert mdb["collections"].find_one({"_id": other_coll_id})["datasets"] == ds_ids[2:]
+
+    logs = {
+        log["data"]["_id"]: log
+        for log in mdb["logs"].find({"comment": {"$in": ["Delete in datasets", "Test delete"]}})
+        if log["data"]["_id"] in ds_ids + [order_id, coll_id, other_coll_id]
+    }
+    assert set(logs) == set(ds_ids[:2] + [order_id, coll_id])
+    assert logs[ds_ids[0]]["revision"] == 2
+    assert logs[ds_ids[1]]["revision"] == 1
+    assert logs[coll_id]["data"] == {"_id": coll_id, "datasets": []}
+
+    assert cascade.delete_order(mdb, order_id, user_id)
+    assert not mdb["orders"].find_one({"_id": order_id})
+    assert not mdb["datasets"].find_one({"_id": ds_ids[2]})
+    assert mdb["collections"].find_one({"_id": other_coll_id})["datasets"] == []
+    assert not cascade.delete_order(mdb, order_id, user_id)
+    mdb["collections"].delete_many({"_id": {"$in": [coll_id, other_coll_id]}})
@@ -0,0 +1,120 @@
+"""Test functions in the changelog module."""
+
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import datetime
+import uuid
+
+import changelog
+import utils
+from helpers import mdb
+
+
+def test_log_changes():
+    """
+    Confirm that logs contain the changes and that entries can be rebuilt from them.
+
+    Checks:
+    * ``data`` contains ``_id`` and the changed fields, ``removed`` the removed fields
+    * Add, delete and every ``LOG_CHECKPOINT_INTERVAL``:th log are checkpoints
+    * Replaying the logs from any checkpoint gives the latest version
+    """
+    versions = [{"_id": "a", "title": "A", "tags": []}, {"_id": "a", "title": "B", "tags": []}]
+    versions.append({"_id": "a", "title": "B", "tags": ["t"], "new": 1})
+    versions.append({"_id": "a", "title": "C", "tags": ["t"]})
+    for i in range(changelog.LOG_CHECKPOINT_INTERVAL):
+        versions.append({"_id": "a", "title": f"T{i}", "tags": ["t"]})
+
+    logs = []
+    previous = None
+    for i, current in enumerate(versions, start=1):
+        log = {"action": "edit" if previous else "add"}
+        logs.append(changelog.log_changes(log, "a", previous, current, i))
+        previous = current
+    logs.append(changelog.log_changes({"action": "delete"}, "a", previous, None, len(versions) + 1))
+
+    assert [log["data"] for log in logs[:4]] == [
+        {"_id": "a", "title": "A", "tags": []},
+        {"_id": "a", "title": "B"},
+        {"_id": "a", "tags": ["t"], "new": 1},
+        {"_id": "a", "title": "C"},
+    ]
+    assert [log.get("removed") for log in logs[:4]] == [None, None, None, ["new"]]
+    assert logs[-1]["data"] == {"_id": "a"}
+    checkpoints = [log["revision"] for log in logs if log["checkpoint"]]
+    assert checkpoints == [1, changelog.LOG_CHECKPOINT_INTERVAL + 1, len(logs)]
+    assert "snapshot" not in logs[0]
+    assert logs[changelog.LOG_CHECKPOINT_INTERVAL]["snapshot"] == versions[-4]
+
+    for start in (0, changelog.LOG_CHECKPOINT_INTERVAL):
+        state = None
+        for log in logs[start:-1]:
+            state = changelog.apply_log(state, log)
+        assert state == versions[-1]
+    assert changelog.apply_log(versions[-1], logs[-1]) is None
+
+
+def test_log_state(mdb):
+    """
+    Confirm that the latest version of an entry is rebuilt from the logs.
+
+    Checks:
+    * Entries without logs give revision 0
+    * ``make_log_new`` increases the revision and stores only the changes
+    * The entry is rebuilt correctly after a checkpoint and after deletion
+    * The entry is rebuilt as it was at a given time
+    """
+    identifier = "c-" + str(uuid.uuid4())
+    assert changelog.log_state(mdb, "collection", identifier) == (0, None)
+    entry = {"_id": identifier, "title": "Title", "tags": []}
+    utils.make_log_new(mdb, "collection", "add", "Test", "system", entry)
+    for i in range(changelog.LOG_CHECKPOINT_INTERVAL + 2):
+        entry = {**entry, "title": f"Title {i}"}
+        utils.make_log_new(mdb, "collection", "edit", "Test", "system", entry)
+    revision, state = changelog.log_state(mdb, "collection", identifier)
+    assert revision == changelog.LOG_CHECKPOINT_INTERVAL + 3
+    assert state == entry
+    last = mdb["logs"].find_one({"data._id": identifier, "revision": revision})
+    assert last["data"] == {"_id": identifier, "title": entry["title"]}
+
+    utils.make_log_new(mdb, "collection", "delete", "Test", "system", {"_id": identifier})
+    assert changelog.log_state(mdb, "collection", identifier) == (revision + 1, None)
+
+    # one log per minute
+    start = datetime.datetime(2021, 5, 1)
+    for log in mdb["logs"].find({"data._id": identifier}):
+        timestamp = start + datetime.timedelta(minutes=log["revision"])
+        mdb["logs"].update_one({"_id": log["_id"]}, {"$set": {"timestamp": timestamp}})
+    assert changelog.log_state(mdb, "collection", identifier, start) == (0, None)
+    for minutes in (1, 2, changelog.LOG_CHECKPOINT_INTERVAL + 2):
+        timestamp = start + datetime.timedelta(minutes=minutes, seconds=30)
+        revision, state = changelog.log_state(mdb, "collection", identifier, timestamp)
+        assert revision == minutes
+        assert state["title"] == "Title" if minutes == 1 else f"Title {minutes - 2}"
+    mdb["logs"].delete_many({"data._id": identifier})
+
+
+def test_rebase_logs(mdb):
+    """
+    Confirm that logs made from an outdated version are made again when inserted.
+
+    Checks:
+    * The conflicting log gets the next revision
+    * The changes are compared to the latest version
+    """
+    identifier = "c-" + str(uuid.uuid4())
+    entry = {"_id": identifier, "title": "Title", "tags": []}
+    utils.make_log_new(mdb, "collection", "add", "Test", "system", entry)
+    changed = [{**entry, "title": "New title"}, {**entry, "tags": ["new"]}]
+    logs = [
+        changelog.new_log(mdb, "collection", "edit", "Test", "system", data) for data in changed
+    ]
+    assert [log["revision"] for log in logs] == [2, 2]
+    assert changelog.insert_logs(mdb, logs[:1])
+    assert changelog.insert_logs(mdb, logs[1:])
+    log = mdb["logs"].find_one({"_id": logs[1]["_id"]})
+    assert log["revision"] == 3
+    assert log["data"] == {"_id": identifier, "title": "Title", "tags": ["new"]}
+    assert changelog.log_state(mdb, "collection", identifier) == (3, changed[1])
+    mdb["logs"].delete_many({"data._id": identifier})
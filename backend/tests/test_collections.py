@@ -325,6 +325,29 @@ def test_get_collection(mdb):
                 assert collection[field] == response.data["collection"][field]
 
 
+def test_get_collection_datasets(mdb):
+    """
+    Confirm that the datasets of a collection are resolved in the stored order.
+
+    Checks:
+    * Titles are included and the order is kept
+    * Datasets that do not exist are listed in ``missing_datasets``
+    """
+    datasets = [entry["_id"] for entry in mdb["datasets"].aggregate([{"$sample": {"size": 5}}])]
+    missing = f"d-{uuid.uuid4()}"
+    coll_uuid = helpers.add_collection(datasets=datasets[:2] + [missing] + datasets[2:])
+    try:
+        session = requests.Session()
+        response = make_request(session, f"/api/v1/collection/{coll_uuid}")
+        assert response.code == 200
+        assert [entry["id"] for entry in response.data["collection"]["datasets"]] == datasets
+        for entry in response.data["collection"]["datasets"]:
+            assert entry["title"] == mdb["datasets"].find_one({"_id": entry["id"]})["title"]
+        assert response.data["collection"]["missing_datasets"] == [missing]
+    finally:
+        mdb["collections"].delete_one({"_id": coll_uuid})
+
+
 def test_get_collection_bad():
     """
     Request collections using bad identifiers.
@@ -0,0 +1,66 @@
+"""Tests for the compression of responses."""
+import gzip
+
+import flask
+
+import compression
+
+
+def make_response(app, body, headers: dict = None, mimetype: str = "application/json"):
+    """Make a response and compress it for a request with ``headers``."""
+    compressor = compression.ResponseCompression(min_size=100)
+    with app.test_request_context("/api/v1/dataset", headers=headers or {}):
+        response = flask.Response(body, mimetype=mimetype)
+        response.set_etag("abc")
+        return compressor.apply(flask.request, response)
+
+
+def test_compress():
+    """
+    Confirm that large responses are compressed if the client accepts it.
+
+    Checks:
+    * Compressed with gzip, ETag made weak
+    * Not compressed if gzip is not accepted
+    * Not compressed if small or not compressible
+    """
+    app = flask.Flask("test")
+    body = b'{"title": "' + b"a" * 1000 + b'"}'
+
+    response = make_response(app, body, {"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert response.get_etag() == ("abc", True)
+    assert gzip.decompress(response.get_data()) == body
+    assert int(response.headers["Content-Length"]) == len(response.get_data())
+
+    for headers in ({}, {"Accept-Encoding": "gzip;q=0"}, {"Accept-Encoding": "identity"}):
+        response = make_response(app, body, headers)
+        assert "Content-Encoding" not in response.headers
+        assert response.get_data() == body
+
+    response = make_response(app, b"{}", {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    response = make_response(app, body, {"Accept-Encoding": "gzip"}, mimetype="image/png")
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress_stream():
+    """
+    Confirm that streamed responses are compressed.
+
+    Checks:
+    * Large streamed body is compressed
+    * Small streamed body is not compressed
+    """
+    app = flask.Flask("test")
+    parts = [b'{"list": [', b",".join([b'"entry"'] * 500), b"]}"]
+
+    response = make_response(app, iter(parts), {"Accept-Encoding": "gzip"})
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == b"".join(parts)
+
+    response = make_response(app, iter([b"{", b"}"]), {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == b"{}"
@@ -1,5 +1,6 @@
 """Tests for dataset requests."""
 import itertools
+import json
 import uuid
 import requests
 
@@ -33,6 +34,66 @@ def test_list_datasets(mdb):
         assert set(response.data["datasets"][0].keys()) == expected_fields
 
 
+def test_list_datasets_paginated(mdb):
+    """
+    Confirm that datasets can be listed page by page.
+
+    Tests:
+
+      * All datasets are listed once when following ``next_cursor``
+      * Sorting by title and field selection
+      * Bad parameters give 400
+    """
+    session = requests.Session()
+    for sort in ("id", "title", "-title"):
+        seen = []
+        cursor = None
+        while True:
+            params = f"limit=7&sort={sort}&fields=title"
+            if cursor:
+                params += f"&after={cursor}"
+            response = helpers.make_request(session, f"/api/v1/dataset?{params}")
+            assert response.code == 200
+            for entry in response.data["datasets"]:
+                assert set(entry) == {"id", "title"}
+            seen += response.data["datasets"]
+            cursor = response.data["next_cursor"]
+            if not cursor:
+                break
+        assert len(seen) == mdb["datasets"].count_documents({})
+        assert len({entry["id"] for entry in seen}) == len(seen)
+        if sort != "id":
+            titles = [entry["title"] for entry in seen]
+            assert titles == sorted(titles, reverse=sort.startswith("-"))
+
+    for params in ("limit=0", "limit=a", "sort=description", "fields=api_key", "after=bad"):
+        response = helpers.make_request(session, f"/api/v1/dataset?{params}", ret_json=False)
+        assert response.code == 400
+
+
+def test_list_datasets_ndjson(mdb):
+    """
+    Confirm that datasets can be listed as NDJSON.
+
+    Tests:
+
+      * One dataset per line
+      * ``next_cursor`` in the ``X-Next-Cursor`` header
+    """
+    session = requests.Session()
+    session.headers["Accept"] = "application/x-ndjson"
+    response = session.get(f"{helpers.BASE_URL}/api/v1/dataset")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == mdb["datasets"].count_documents({})
+    assert set(lines[0]) == {"title", "id", "tags", "properties"}
+
+    response = session.get(f"{helpers.BASE_URL}/api/v1/dataset?limit=2")
+    assert len(response.text.splitlines()) == 2
+    assert response.headers["X-Next-Cursor"]
+
+
 def test_list_user_datasets_permissions():
     """
     Confirm that users get the correct status code response.
@@ -398,6 +459,74 @@ def test_dataset_update_data(mdb):
     assert mdb["logs"].find_one({"data._id": ds_id, "action": "edit", "data_type": "dataset"})
 
 
+def test_get_dataset_etag():
+    """
+    Confirm that conditional requests for a dataset work as intended.
+
+    Tests:
+      * The response has an ETag
+      * ``If-None-Match`` with the ETag gives 304
+      * The ETag changes when the dataset is updated
+      * The ETag differs between users
+    """
+    session = requests.Session()
+    ds_id = helpers.add_dataset(helpers.add_order())
+    helpers.as_user(session, helpers.USERS["data"])
+    url = f"{helpers.BASE_URL}/api/v1/dataset/{ds_id}"
+
+    response = session.get(url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+    indata = {"dataset": {"title": "Test title - dataset etag"}}
+    response = helpers.make_request(
+        session, f"/api/v1/dataset/{ds_id}", method="PATCH", data=indata
+    )
+    assert response.code == 200
+    response = session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["dataset"]["title"] == indata["dataset"]["title"]
+
+    other_session = requests.Session()
+    helpers.as_user(other_session, helpers.USERS["base"])
+    response = other_session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_list_datasets_etag():
+    """
+    Confirm that the dataset list has an ETag that changes when a dataset is added.
+
+    Tests:
+      * ``If-None-Match`` with the ETag gives 304
+      * The ETag depends on the query string
+      * Adding a dataset changes the ETag
+    """
+    session = requests.Session()
+    url = f"{helpers.BASE_URL}/api/v1/dataset"
+    etag = session.get(url).headers["ETag"]
+    assert session.get(url, headers={"If-None-Match": etag}).status_code == 304
+    response = session.get(f"{url}?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    helpers.as_user(session, helpers.USERS["data"])
+    etag = session.get(url).headers["ETag"]
+    order_id = helpers.add_order()
+    indata = {"dataset": {"title": "Test title - dataset list etag"}}
+    indata["dataset"].update(TEST_LABEL)
+    response = helpers.make_request(
+        session, f"/api/v1/order/{order_id}/dataset", method="POST", data=indata
+    )
+    assert response.code == 200
+    assert session.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+
 def test_dataset_update_bad(dataset_for_tests):
     """Confirm that bad requests will be rejected."""
     indata = {"dataset": {"title": "Updated title"}}
@@ -452,6 +581,61 @@ def test_dataset_update_bad(dataset_for_tests):
     assert not response.data
 
 
+def test_update_delete_datasets_bulk(mdb):
+    """
+    Confirm that multiple datasets can be updated and deleted in one request.
+
+    Checks:
+      * Valid changes are written, other entries are reported with their status
+      * Datasets of other orders cannot be changed without DATA_MANAGEMENT
+      * Deleted datasets are removed from the order and logged
+      * Other users cannot delete the datasets
+    """
+    order_id = helpers.add_order()
+    ds_ids = [helpers.add_dataset(order_id) for _ in range(3)]
+    other_order = helpers.add_order()
+    other = helpers.add_dataset(other_order)
+    mdb["orders"].update_one({"_id": other_order}, {"$set": {"editors": []}})
+    session = requests.Session()
+    helpers.as_user(session, helpers.USERS["edit"])
+
+    indata = {
+        "datasets": [
+            {"_id": ds_ids[0], "title": "Bulk title 0"},
+            {"_id": ds_ids[1], "title": "Bulk title 1", "tags": ["testing", "bulk"]},
+            {"_id": ds_ids[2], "title": ""},
+            {"_id": "d-" + str(uuid.uuid4()), "title": "Missing"},
+            {"_id": ds_ids[0], "title": "Repeated"},
+            {"title": "No id"},
+            {"_id": other, "title": "Other order"},
+        ]
+    }
+    response = helpers.make_request(session, "/api/v1/dataset", data=indata, method="PATCH")
+    assert response.code == 200
+    statuses = [entry["status"] for entry in response.data["datasets"]]
+    assert statuses == [200, 200, 400, 404, 400, 400, 403]
+    assert mdb["datasets"].find_one({"_id": ds_ids[0]})["title"] == "Bulk title 0"
+    assert mdb["datasets"].find_one({"_id": ds_ids[1]})["tags"] == ["testing", "bulk"]
+    assert mdb["datasets"].find_one({"_id": ds_ids[2]})["title"] == "Test title from fixture"
+    query = {"data_type": "dataset", "action": "edit", "data._id": {"$in": ds_ids}}
+    assert mdb["logs"].count_documents(query) == 2
+
+    indata = {"datasets": ds_ids[:2] + ["d-" + str(uuid.uuid4()), 1]}
+    response = helpers.make_request(session, "/api/v1/dataset", data=indata, method="DELETE")
+    assert response.code == 200
+    assert [entry["status"] for entry in response.data["datasets"]] == [200, 200, 404, 400]
+    assert mdb["datasets"].count_documents({"_id": {"$in": ds_ids}}) == 1
+    assert mdb["orders"].find_one({"_id": order_id})["datasets"] == ds_ids[2:]
+    query = {"data_type": "dataset", "action": "delete", "data._id": {"$in": ds_ids}}
+    assert mdb["logs"].count_documents(query) == 2
+
+    helpers.as_user(session, helpers.USERS["base"])
+    response = helpers.make_request(
+        session, "/api/v1/dataset", data={"datasets": ds_ids[2:]}, method="DELETE"
+    )
+    assert response.code == 403
+
+
 def test_get_dataset_logs_permissions(mdb):
     """
     Get dataset logs.
@@ -506,6 +690,54 @@ def test_get_dataset_logs(mdb):
         assert response.code == 200
 
 
+def test_get_dataset_logs_paginated(mdb):
+    """
+    Confirm that dataset logs can be filtered by time and listed page by page.
+
+    Tests:
+
+      * All logs are listed once, in chronological order, when following ``next_cursor``
+      * ``since`` and ``until`` limit the logs
+      * Bad parameters give 400
+    """
+    session = requests.session()
+    helpers.as_user(session, helpers.USERS["data"])
+    dataset = next(mdb["datasets"].aggregate([{"$sample": {"size": 1}}]))
+    logs = list(
+        mdb["logs"].find(
+            {"data_type": "dataset", "data._id": dataset["_id"]},
+            sort=[("timestamp", 1), ("_id", 1)],
+        )
+    )
+    url = f'/api/v1/dataset/{dataset["_id"]}/log'
+    seen = []
+    cursor = None
+    while True:
+        params = "limit=1" + (f"&after={cursor}" if cursor else "")
+        response = helpers.make_request(session, f"{url}?{params}")
+        assert response.code == 200
+        seen += response.data["logs"]
+        cursor = response.data["next_cursor"]
+        if not cursor:
+            break
+    assert [entry["id"] for entry in seen] == [log["_id"] for log in logs]
+
+    last = logs[-1]["timestamp"]
+    response = helpers.make_request(session, f"{url}?since={last.isoformat()}")
+    assert [entry["id"] for entry in response.data["logs"]] == [
+        log["_id"] for log in logs if log["timestamp"] >= last
+    ]
+    first = logs[0]["timestamp"]
+    response = helpers.make_request(session, f"{url}?until={first.isoformat()}")
+    assert [entry["id"] for entry in response.data["logs"]] == [
+        log["_id"] for log in logs if log["timestamp"] <= first
+    ]
+
+    for params in ("limit=0", "since=yesterday", "after=bad"):
+        response = helpers.make_request(session, f"{url}?{params}")
+        assert response.code == 400
+
+
 def test_info_add_dataset():
     """Confirm that the redirect information works as intended."""
     session = requests.session()
@@ -0,0 +1,109 @@
+"""Tests for the tag and property counts."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import requests
+
+import facets
+import helpers
+import utils
+from helpers import mdb
+
+
+def test_facet_changes():
+    """
+    Confirm that the changes of the counts are computed correctly.
+
+    Checks:
+    * Added entry
+    * Edited entry, unchanged facets are skipped
+    * Deleted entry
+    """
+    entry = {"tags": ["a", "b"], "properties": {"key": "value"}}
+    assert facets.facet_changes(None, entry) == {
+        ("tag", None, "a"): 1,
+        ("tag", None, "b"): 1,
+        ("property", "key", "value"): 1,
+    }
+    edited = {"tags": ["b", "c"], "properties": {"key": "other"}}
+    assert facets.facet_changes(entry, edited) == {
+        ("tag", None, "a"): -1,
+        ("tag", None, "c"): 1,
+        ("property", "key", "value"): -1,
+        ("property", "key", "other"): 1,
+    }
+    assert facets.facet_changes(entry, None) == {
+        ("tag", None, "a"): -1,
+        ("tag", None, "b"): -1,
+        ("property", "key", "value"): -1,
+    }
+    assert facets.facet_changes({}, {"title": "No facets"}) == {}
+
+
+def test_format_facets():
+    """Confirm that the counts are split by type and sorted by count."""
+    counts = [
+        (("tag", None, "a"), 1),
+        (("property", "key", "value"), 2),
+        (("tag", None, "b"), 3),
+    ]
+    assert facets.format_facets(counts) == {
+        "tags": [{"value": "b", "count": 3}, {"value": "a", "count": 1}],
+        "properties": [{"key": "key", "value": "value", "count": 2}],
+    }
+
+
+def test_update_facets(mdb):
+    """
+    Confirm that the stored counts follow the changes made with ``commit_to_db``.
+
+    Checks:
+    * Counts after add, edit and delete match a full recount
+    """
+    tag = "facet-" + helpers.random_string(min_length=10, max_length=10)
+    data = {"title": "Facet test", "tags": [tag, "testing"], "properties": {"facetkey": tag}}
+    result = utils.commit_to_db(mdb, "collections", "add", data)
+
+    def stored():
+        return {
+            (entry["_id"]["type"], entry["_id"]["key"], entry["_id"]["value"]): entry["count"]
+            for entry in mdb["facets"].find({"collection": "collections"})
+        }
+
+    assert stored()[("tag", None, tag)] == 1
+    assert stored() == dict(facets.count_facets(mdb, "collections"))
+
+    utils.commit_to_db(
+        mdb, "collections", "edit", {"_id": result.inserted_id, "tags": ["testing"]}
+    )
+    assert ("tag", None, tag) not in stored()
+    assert stored()[("property", "facetkey", tag)] == 1
+    assert stored() == dict(facets.count_facets(mdb, "collections"))
+
+    utils.commit_to_db(mdb, "collections", "delete", {"_id": result.inserted_id})
+    assert ("property", "facetkey", tag) not in stored()
+    assert stored() == dict(facets.count_facets(mdb, "collections"))
+
+
+def test_rebuild_facets(mdb):
+    """Confirm that a rebuild repairs counts that have drifted."""
+    mdb["facets"].insert_one(
+        {"_id": facets.facet_id("datasets", ("tag", None, "drifted")), "collection": "datasets"}
+    )
+    facets.rebuild_facets(mdb, ("datasets",))
+    assert not mdb["facets"].find_one({"_id.value": "drifted"})
+    stored = {
+        (entry["_id"]["type"], entry["_id"]["key"], entry["_id"]["value"]): entry["count"]
+        for entry in mdb["facets"].find({"collection": "datasets"})
+    }
+    assert stored == dict(facets.count_facets(mdb, "datasets"))
+
+
+def test_get_dataset_facets(mdb):
+    """Confirm that the facets endpoint returns the stored counts."""
+    facets.rebuild_facets(mdb, ("datasets",))
+    session = requests.Session()
+    response = helpers.make_request(session, "/api/v1/dataset/facets")
+    assert response.code == 200
+    expected = facets.format_facets(facets.count_facets(mdb, "datasets").items())
+    assert response.data["facets"] == expected
@@ -0,0 +1,45 @@
+"""Tests for the index registry."""
+
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import indexes
+from helpers import mdb
+
+
+def test_index_name():
+    """Confirm that the default MongoDB index names are generated."""
+    assert indexes.index_name([("editors", 1)]) == "editors_1"
+    assert indexes.index_name([("data_type", 1), ("data._id", 1)]) == "data_type_1_data._id_1"
+    assert indexes.index_name([("title", "text")]) == "title_text"
+
+
+def test_register():
+    """
+    Confirm that indexes can be added to the registry.
+
+    Checks:
+    * A new index is added
+    * Registering the same index again has no effect
+    """
+    specs = list(indexes.INDEXES)
+    try:
+        indexes.register("datasets", [("title", 1)])
+        assert len(indexes.INDEXES) == len(specs) + 1
+        indexes.register("datasets", [("title", 1)])
+        assert len(indexes.INDEXES) == len(specs) + 1
+    finally:
+        indexes.INDEXES[:] = specs
+
+
+def test_ensure_indexes(mdb):
+    """
+    Confirm that the registered indexes exist in the database.
+
+    Checks:
+    * No indexes are created when all exist
+    * No registered index is missing according to the report
+    """
+    indexes.ensure_indexes(mdb)
+    assert indexes.ensure_indexes(mdb) == []
+    assert indexes.index_report(mdb)["missing"] == []
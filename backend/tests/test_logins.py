@@ -56,3 +56,72 @@ def test_list_oidc_types():
     for response in responses:
         assert response.code == 200
         assert response.data == {"entry": "/api/v1/login/oidc/entry"}
+
+
+def test_api_key_cache():
+    """
+    Confirm that repeated API key requests use the verification cache.
+
+    Checks:
+    * The first request is a miss, the following ones hits
+    * A bad key is rejected even after a cached success
+    """
+    session = requests.Session()
+    stats = helpers.make_request(session, "/api/v1/developer/cache").data["api_key"]
+    session.headers["X-API-User"] = helpers.USERS["base"]
+    session.headers["X-API-Key"] = "0"
+    for _ in range(3):
+        response = helpers.make_request(session, "/api/v1/developer/loginhello")
+        assert response.code == 200
+    new_stats = helpers.make_request(session, "/api/v1/developer/cache").data["api_key"]
+    assert new_stats["hits"] >= stats["hits"] + 2
+
+    session.headers["X-API-Key"] = "1"
+    response = helpers.make_request(session, "/api/v1/developer/loginhello", ret_json=False)
+    assert response.code == 401
+
+
+def test_api_token():
+    """
+    Confirm that API tokens can be used instead of a session.
+
+    Checks:
+    * Bad API key gives 401
+    * The token can be requested without a CSRF cookie or header
+    * The token logs in the user without a session or CSRF token
+    * The current user can be read with the token
+    * Bad token gives 401
+    """
+    session = requests.Session()
+    response = helpers.make_request(
+        session,
+        "/api/v1/login/apikey/token",
+        data={"api-user": helpers.USERS["base"], "api-key": "1"},
+        method="POST",
+        ret_json=False,
+    )
+    assert response.code == 401
+
+    # new session, without any CSRF cookie
+    session = requests.Session()
+    response = helpers.make_request(
+        session,
+        "/api/v1/login/apikey/token",
+        data={"api-user": helpers.USERS["base"], "api-key": "0"},
+        method="POST",
+    )
+    assert response.code == 200
+    assert response.data["token_type"] == "Bearer"
+    assert response.data["expires_in"] > 0
+
+    session = requests.Session()
+    session.headers["Authorization"] = f'Bearer {response.data["token"]}'
+    response = helpers.make_request(session, "/api/v1/developer/loginhello")
+    assert response.code == 200
+    response = helpers.make_request(session, "/api/v1/user/me")
+    assert response.code == 200
+    assert helpers.USERS["base"] in response.data["user"]["auth_ids"]
+
+    session.headers["Authorization"] = "Bearer bad-token"
+    response = helpers.make_request(session, "/api/v1/developer/loginhello", ret_json=False)
+    assert response.code == 401
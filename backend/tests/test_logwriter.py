@@ -0,0 +1,120 @@
+"""Tests for writing logs in the background."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import pymongo
+import pytest
+
+import logwriter
+import structure
+from helpers import mdb
+
+
+def make_logs(count: int) -> list:
+    """
+    Make logs for new test entries.
+
+    Args:
+        count (int): The number of logs.
+
+    Returns:
+        list: The logs.
+    """
+    logs = []
+    for i in range(count):
+        log = structure.log()
+        log.update(
+            {
+                "action": "add",
+                "comment": "Log writer test",
+                "data_type": "collection",
+                "data": {"_id": f"c-logwriter-{i}", "title": "Test"},
+                "revision": 1,
+                "checkpoint": True,
+            }
+        )
+        logs.append(log)
+    return logs
+
+
+def test_log_writer_spool(tmp_path):
+    """
+    Confirm that logs are spooled if the database cannot be reached.
+
+    Checks:
+    * The logs are written to the spool file when the queue is flushed
+    * A failed replay keeps the logs
+    * ``wait_for`` raises ``TimeoutError`` instead of returning before they are inserted
+    * Failed flushes and spooled logs are counted
+    """
+    spool_path = tmp_path / "spool.jsonl"
+    writer = logwriter.LogWriter(enabled=True, flush_interval=0.2, spool_path=str(spool_path))
+    db = pymongo.MongoClient("localhost", port=1, serverSelectionTimeoutMS=50)["tracker"]
+    logs = make_logs(3)
+    assert writer.write(db, logs)
+    with pytest.raises(TimeoutError):
+        writer.wait_for([logwriter.log_key(logs[0])])
+    writer.stop()
+    spooled = []
+    # the worker renames the spool when it tries to insert it
+    for path in (tmp_path / "spool.jsonl.replay", spool_path):
+        if path.exists():
+            with open(path, encoding="utf-8") as spool:
+                spooled += [
+                    logwriter.json_util.loads(line, json_options=logwriter.SPOOL_JSON_OPTIONS)
+                    for line in spool
+                ]
+    assert [log["_id"] for log in spooled] == [log["_id"] for log in logs]
+    assert spooled[0]["data"] == logs[0]["data"]
+    stats = writer.stats()
+    assert stats["spooled"] == 3
+    assert stats["failed_flushes"] >= 1
+    assert stats["written"] == 0
+
+
+def test_log_writer_single_process(tmp_path):
+    """
+    Confirm that only one writer at a time can use a spool file.
+
+    Checks:
+    * A second writer with the same spool file fails to start
+    * The lock is released when the writer is stopped
+    """
+    spool_path = str(tmp_path / "spool.jsonl")
+    writer = logwriter.LogWriter()
+    writer.configure(enabled=True, spool_path=spool_path)
+    other = logwriter.LogWriter()
+    with pytest.raises(RuntimeError):
+        other.configure(enabled=True, spool_path=spool_path)
+    writer.stop()
+    other.configure(enabled=True, spool_path=spool_path)
+    other.stop()
+
+
+def test_log_writer(mdb, tmp_path):
+    """
+    Confirm that queued and spooled logs are inserted.
+
+    Checks:
+    * Disabled writer inserts directly
+    * ``wait_for`` inserts the queued logs of an entry
+    * The spool is inserted when the writer starts, skipping already inserted logs
+    """
+    logs = make_logs(4)
+    spool_path = tmp_path / "spool.jsonl"
+    assert logwriter.LogWriter().write(mdb, logs[:1])
+    assert mdb["logs"].find_one({"_id": logs[0]["_id"]})
+
+    with open(spool_path, "w", encoding="utf-8") as spool:
+        for log in logs[:2]:
+            spool.write(
+                logwriter.json_util.dumps(log, json_options=logwriter.SPOOL_JSON_OPTIONS) + "\n"
+            )
+    writer = logwriter.LogWriter(enabled=True, flush_interval=60, spool_path=str(spool_path))
+    assert writer.write(mdb, logs[2:])
+    writer.wait_for([("collection", logs[3]["data"]["_id"])])
+    assert mdb["logs"].count_documents({"_id": {"$in": [log["_id"] for log in logs]}}) == 4
+    assert writer.stats()["queue_depth"] == 0
+    writer.stop()
+    assert not spool_path.exists()
+    mdb["logs"].delete_many({"comment": "Log writer test"})
@@ -0,0 +1,150 @@
+"""Tests for the database migrations."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import datetime
+import uuid
+
+import pytest
+
+import changelog
+import migrations
+from helpers import mdb
+
+
+def test_migrate_collection(mdb):
+    """
+    Confirm that an interrupted migration resumes and replaces the collection.
+
+    Checks:
+    * The original documents are kept if the migration is interrupted
+    * The progress is saved after each batch
+    * The resumed migration does not transform the saved batches again
+    * The shadow collection and the progress are removed when finished
+    """
+    mdb["migration_test"].insert_many([{"_id": i, "value": i} for i in range(7)])
+    transformed = []
+    interrupt = {"at": 5}
+
+    def transform(document):
+        if document["_id"] == interrupt["at"]:
+            raise RuntimeError("Interrupted")
+        transformed.append(document["_id"])
+        return {"_id": f"t-{document['_id']}", "value": document["value"] * 2}
+
+    with pytest.raises(RuntimeError):
+        migrations.migrate_collection(mdb, "test", "migration_test", transform, batch_size=2)
+    assert mdb["migration_test"].count_documents({}) == 7
+    status = mdb["db_status"].find_one({"_id": "migration_migration_test"})
+    assert status["migrated"] == 4
+    assert status["last_id"] == 3
+
+    transformed.clear()
+    interrupt["at"] = None
+    assert migrations.migrate_collection(mdb, "test", "migration_test", transform, 2) == 7
+    assert transformed == [4, 5, 6]
+    assert list(mdb["migration_test"].find({}, sort=[("_id", 1)])) == [
+        {"_id": f"t-{i}", "value": i * 2} for i in range(7)
+    ]
+    assert "migration_test_migration" not in mdb.list_collection_names()
+    assert not mdb["db_status"].find_one({"_id": "migration_migration_test"})
+    mdb["migration_test"].drop()
+
+
+def test_migrate_v4_to_v5(mdb, monkeypatch):
+    """
+    Confirm that an interrupted log migration resumes in the middle of an entry.
+
+    Checks:
+    * The last entry with all logs written is saved
+    * The logs changed before the interruption are used for the remaining logs
+    * The logs contain the changes and the revisions
+    """
+    db = mdb.client.get_database(f"{mdb.name}_migration_test", codec_options=mdb.codec_options)
+    identifiers = sorted("d-" + str(uuid.uuid4()) for _ in range(2))
+    start = datetime.datetime(2021, 5, 1)
+    db["logs"].insert_many(
+        [
+            {
+                "_id": f"l-{identifier}-{i}",
+                "action": "edit" if i else "add",
+                "comment": "",
+                "data_type": "dataset",
+                "data": {"_id": identifier, "title": f"Title {i}", "tags": []},
+                "timestamp": start + datetime.timedelta(minutes=i),
+                "user": "system",
+            }
+            for identifier in identifiers
+            for i in range(3)
+        ]
+    )
+    monkeypatch.setattr(migrations, "LOG_BATCH_SIZE", 2)
+    log_changes = changelog.log_changes
+
+    def interrupt(log, *args):
+        if log["_id"] == f"l-{identifiers[1]}-1":
+            raise RuntimeError("Interrupted")
+        return log_changes(log, *args)
+
+    monkeypatch.setattr(changelog, "log_changes", interrupt)
+    with pytest.raises(RuntimeError):
+        migrations.migrate_v4_to_v5(db)
+    status = db["db_status"].find_one({"_id": "migration_v5_logs"})
+    assert status["last_entry"] == ["dataset", identifiers[0]]
+
+    monkeypatch.setattr(changelog, "log_changes", log_changes)
+    migrations.migrate_v4_to_v5(db)
+    logs = list(db["logs"].find({}, sort=[("data._id", 1), ("timestamp", 1)]))
+    assert [log["revision"] for log in logs] == [1, 2, 3, 1, 2, 3]
+    assert [log["data"] for log in logs[3:]] == [
+        {"_id": identifiers[1], "title": "Title 0", "tags": []},
+        {"_id": identifiers[1], "title": "Title 1"},
+        {"_id": identifiers[1], "title": "Title 2"},
+    ]
+    assert not db["db_status"].find_one({"_id": "migration_v5_logs"})
+    mdb.client.drop_database(db.name)
+
+
+def test_estimate_migration(mdb):
+    """
+    Confirm that a dry run estimates the cost of a migration without changing anything.
+
+    Checks:
+    * Rewritten collections count all documents
+    * Migrations only changing some documents count the changed documents
+    * The temporary collections are removed
+    """
+    estimate = migrations.estimate_migration(mdb, 3, sample_size=10)
+    assert [entry["collection"] for entry in estimate["collections"]] == [
+        "orders",
+        "datasets",
+        "collections",
+        "users",
+        "logs",
+    ]
+    for entry in estimate["collections"]:
+        assert entry["documents"] == mdb[entry["collection"]].count_documents({})
+        assert entry["sampled"] == min(10, entry["documents"])
+    assert estimate["bytes"] > 0
+    assert estimate["documents"] == sum(entry["documents"] for entry in estimate["collections"])
+
+    estimate = migrations.estimate_migration(mdb, 2)
+    assert estimate["documents"] == mdb["users"].count_documents(
+        {"permissions": {"$in": ["STATISTICS", "DATA_LIST"]}}
+    )
+    assert not [name for name in mdb.list_collection_names() if name.endswith("_dry_run")]
+
+
+def test_estimate_migration_uuid(mdb):
+    """
+    Confirm that documents with ``uuid.UUID`` values can be estimated.
+
+    Checks:
+    * The size is counted with the uuid representation of the database
+    """
+    db = mdb.client.get_database(f"{mdb.name}_dry_run_test", codec_options=mdb.codec_options)
+    db["users"].insert_one({"_id": uuid.uuid4(), "permissions": ["STATISTICS"]})
+    estimate = migrations.estimate_migration(db, 2)
+    assert estimate["documents"] == 1
+    assert estimate["bytes"] > 0
+    mdb.client.drop_database(db.name)
@@ -253,6 +253,37 @@ def test_get_order_logs_bad():
         assert response.code == 404
 
 
+def test_get_order_at(mdb):
+    """
+    Request orders as they were at different times.
+
+    Checks:
+    * The order at the time of the latest log matches the current order
+    * Times before the first log give 404
+    * Bad or missing timestamps give 400
+    """
+    session = requests.session()
+    as_user(session, USERS["data"])
+    for entry in mdb["orders"].aggregate([{"$sample": {"size": 2}}]):
+        logs = list(
+            mdb["logs"].find(
+                {"data_type": "order", "data._id": entry["_id"]}, sort=[("revision", 1)]
+            )
+        )
+        url = f'/api/v1/order/{entry["_id"]}/at'
+        response = make_request(session, f'{url}?timestamp={logs[-1]["timestamp"].isoformat()}')
+        assert response.code == 200
+        assert response.data["revision"] == logs[-1]["revision"]
+        assert response.data["order"]["id"] == entry["_id"]
+        assert response.data["order"]["title"] == entry["title"]
+        assert response.data["order"]["datasets"] == entry["datasets"]
+        response = make_request(session, f"{url}?timestamp=2000-01-01")
+        assert response.code == 404
+        for params in ("", "?timestamp=yesterday"):
+            response = make_request(session, url + params)
+            assert response.code == 400
+
+
 def test_add_order_permissions():
     """
     Confirm that only the intended users can create orders.
@@ -838,6 +869,49 @@ def test_add_dataset_permissions(mdb):
             assert not response.data
 
 
+def test_add_datasets_bulk(mdb):
+    """
+    Confirm that multiple datasets can be added in one request.
+
+    Checks:
+      * Valid datasets are added to the order, invalid ones are reported and skipped
+      * One log per dataset and one for the order are created
+      * Bad requests give 400 and other users 403
+    """
+    order_id = helpers.add_order()
+    datasets = [{"title": f"Bulk dataset {i}", "tags": ["testing"]} for i in range(5)]
+    datasets.insert(2, {"title": ""})
+    datasets.insert(4, {"title": "Bad field", "bad": 1})
+    session = requests.Session()
+    as_user(session, USERS["edit"])
+    response = make_request(
+        session, f"/api/v1/order/{order_id}/datasets", data={"datasets": datasets}, method="POST"
+    )
+    assert response.code == 200
+    results = response.data["datasets"]
+    assert [result["status"] for result in results] == [200, 200, 400, 200, 400, 200, 200]
+    added = [result["id"] for result in results if result["status"] == 200]
+    assert "id" not in results[2]
+
+    order_data = mdb["orders"].find_one({"_id": order_id})
+    assert order_data["datasets"] == added
+    titles = [entry["title"] for entry in mdb["datasets"].find({"_id": {"$in": added}})]
+    assert sorted(titles) == [f"Bulk dataset {i}" for i in range(5)]
+    assert mdb["logs"].count_documents({"data_type": "dataset", "data._id": {"$in": added}}) == 5
+    assert mdb["logs"].count_documents({"data_type": "order", "data._id": order_id}) == 1
+
+    for data in (None, {"datasets": []}, {"datasets": {}}, {"datasets": [{}] * 1000}):
+        response = make_request(
+            session, f"/api/v1/order/{order_id}/datasets", data=data, method="POST"
+        )
+        assert response.code == 400
+    as_user(session, USERS["base"])
+    response = make_request(
+        session, f"/api/v1/order/{order_id}/datasets", data={"datasets": datasets}, method="POST"
+    )
+    assert response.code == 403
+
+
 def test_add_dataset_data(mdb):
     """
     Confirm that values are set correctly and logs are created.
@@ -1036,3 +1110,24 @@ def test_prepare_order_response(mdb):
         assert order_data[field] == [edit_user]
     assert order_data["datasets"] == [{"title": "Test title from fixture", "_id": dataset_id}]
     assert order_data["organisation"] == edit_user
+
+
+def test_prepare_orders_response(mdb):
+    """
+    Confirm that multiple orders are prepared at once.
+
+    Checks:
+    * Users and datasets are resolved for all orders
+    """
+    order_ids = [helpers.add_order() for _ in range(3)]
+    dataset_ids = [helpers.add_dataset(order_id) for order_id in order_ids]
+    orders = list(mdb["orders"].find({"_id": {"$in": order_ids}}))
+    edit_user = mdb["users"].find_one({"auth_ids": helpers.USERS["edit"]})
+    order.prepare_orders_response(orders, mdb)
+    for order_data in orders:
+        for field in ("editors", "authors", "generators"):
+            assert [entry["_id"] for entry in order_data[field]] == [edit_user["_id"]]
+            assert "api_key" not in order_data[field][0]
+        assert order_data["organisation"]["_id"] == edit_user["_id"]
+        assert len(order_data["datasets"]) == 1
+        assert order_data["datasets"][0]["_id"] in dataset_ids
@@ -0,0 +1,153 @@
+"""Tests for search requests."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import pytest
+import requests
+from werkzeug.datastructures import MultiDict
+
+import helpers
+import search
+from helpers import mdb, TEST_LABEL
+
+
+def test_parse_search_query():
+    """
+    Confirm that the search parameters are parsed and checked.
+
+    Checks:
+    * Default values
+    * All parameters, including repeated properties
+    * Bad parameters raise ``ValueError``
+    """
+    assert search.parse_search_query(MultiDict()) == search.SearchQuery(
+        text="", tags=[], properties={}, limit=search.DEFAULT_LIMIT, offset=0
+    )
+    args = MultiDict(
+        [
+            ("q", " genome "),
+            ("tags", "tag1,tag2"),
+            ("property", "key1:value1"),
+            ("property", "key2:a:b"),
+            ("limit", "5"),
+            ("offset", "10"),
+        ]
+    )
+    assert search.parse_search_query(args) == search.SearchQuery(
+        text="genome",
+        tags=["tag1", "tag2"],
+        properties={"key1": "value1", "key2": "a:b"},
+        limit=5,
+        offset=10,
+    )
+    for bad_args in (
+        {"limit": "0"},
+        {"limit": str(search.MAX_LIMIT + 1)},
+        {"offset": "-1"},
+        {"offset": "a"},
+        {"property": "key"},
+        {"property": "$where:1"},
+        {"property": "a.b:c"},
+    ):
+        with pytest.raises(ValueError):
+            search.parse_search_query(MultiDict(bad_args))
+
+
+def test_search_pipeline():
+    """
+    Confirm that the filters are combined in the first stage.
+
+    Checks:
+    * Visibility, text, tags and properties in ``$match``
+    * The result page is sorted and limited before any ``$facet``
+    * Sorted by text score when searching for text
+    * The counts are made in a separate pipeline
+    """
+    query = search.SearchQuery(
+        text="genome", tags=["tag1"], properties={"key1": "value1"}, limit=5, offset=10
+    )
+    match = {
+        "$match": {
+            "editors": "u-1",
+            "$text": {"$search": "genome"},
+            "tags": {"$all": ["tag1"]},
+            "properties.key1": "value1",
+        }
+    }
+    pipeline = search.search_pipeline(query, {"editors": "u-1"})
+    assert pipeline[0] == match
+    assert pipeline[1] == {"$sort": {"score": {"$meta": "textScore"}, "_id": 1}}
+    assert pipeline[2:4] == [{"$skip": 10}, {"$limit": 5}]
+    assert not any("$facet" in stage for stage in pipeline)
+
+    pipeline = search.search_pipeline(query._replace(text=""))
+    assert "$text" not in pipeline[0]["$match"]
+    assert pipeline[1] == {"$sort": {"_id": 1}}
+
+    pipeline = search.facet_pipeline(query, {"editors": "u-1"})
+    assert pipeline[0] == match
+    assert list(pipeline[1]["$facet"]) == ["total", "tags", "properties"]
+
+
+def test_search_datasets(mdb):
+    """
+    Confirm that datasets can be found by text, tags and properties.
+
+    Checks:
+    * Text search finds the added dataset
+    * Tag and property filters and facets
+    * Unfiltered searches give the stored facet counts
+    * Bad type gives 400
+    """
+    session = requests.Session()
+    ds_id = helpers.add_dataset(helpers.add_order())
+    word = "xyzzy" + helpers.random_string(min_length=10, max_length=10).lower()
+    mdb["datasets"].update_one(
+        {"_id": ds_id},
+        {"$set": {"title": f"Search {word}", "properties": {"searchkey": "searchvalue"}}},
+    )
+
+    response = helpers.make_request(session, f"/api/v1/search?q={word}")
+    assert response.code == 200
+    assert [entry["id"] for entry in response.data["results"]] == [str(ds_id)]
+    assert response.data["total"] == 1
+    assert {"key": "searchkey", "value": "searchvalue", "count": 1} in response.data["facets"][
+        "properties"
+    ]
+
+    response = helpers.make_request(
+        session, "/api/v1/search?tags=fromFixture&property=searchkey:searchvalue"
+    )
+    assert response.code == 200
+    assert str(ds_id) in [entry["id"] for entry in response.data["results"]]
+    assert {"value": "fromFixture", "count": response.data["total"]} in response.data["facets"][
+        "tags"
+    ]
+
+    response = helpers.make_request(session, "/api/v1/search")
+    assert response.code == 200
+    assert response.data["total"] == mdb["datasets"].count_documents({})
+    stored = helpers.make_request(session, "/api/v1/dataset/facets").data["facets"]
+    assert response.data["facets"]["tags"] == stored["tags"][: search.FACET_LIMIT]
+
+    response = helpers.make_request(session, "/api/v1/search?type=user", ret_json=False)
+    assert response.code == 400
+
+
+def test_search_orders_permissions():
+    """
+    Confirm that orders can only be searched by users with ``DATA_EDIT``.
+
+    Checks:
+    * Not logged in gives 401
+    * Without ``DATA_EDIT`` gives 403
+    * Users with ``DATA_EDIT`` only find orders where they are editors
+    """
+    responses = helpers.make_request_all_roles("/api/v1/search?type=order", ret_json=True)
+    for response in responses:
+        if response.role in ("edit", "data", "root"):
+            assert response.code == 200
+        elif response.role == "no-login":
+            assert response.code == 401
+        else:
+            assert response.code == 403
@@ -0,0 +1,79 @@
+"""Tests for the json encoding of responses."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-argument
+
+import datetime
+import json
+import uuid
+
+import pytest
+from werkzeug import http
+
+import serializer
+import utils
+
+TIMEZONE = datetime.timezone(datetime.timedelta(hours=2))
+
+BACKENDS = [name for name in serializer.BACKENDS if name != "orjson" or serializer.orjson]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    """Use each available backend, restoring the default afterwards."""
+    default = serializer.backend
+    serializer.use_backend(request.param)
+    yield request.param
+    serializer.use_backend(default)
+
+
+def test_dumps(backend):
+    """
+    Confirm that the output matches ``prepare_response`` + ``flask.jsonify``.
+
+    Checks:
+    * ``_id`` renamed at all levels, also in lists
+    * Strings and keys containing ``"_id":`` are kept
+    * ``uuid.UUID`` and ``datetime`` are encoded
+    * The data is not modified
+    """
+    identifier = uuid.uuid4()
+    timestamp = datetime.datetime(2021, 3, 1, 12, 30, 5)
+    data = {
+        "_id": identifier,
+        "title": 'Title with "_id": in it',
+        'key,"_id': {"_id": "inner"},
+        "list": [{"_id": 1}, {"_id": 2, "sub": [{"_id": 3}]}],
+        "timestamp": timestamp,
+        "empty": {},
+    }
+    original = json.dumps(data, default=str)
+    result = json.loads(serializer.dumps(data))
+    assert json.dumps(data, default=str) == original
+
+    expected = json.loads(json.dumps(data, default=str))
+    utils.prepare_response(expected)
+    expected["id"] = str(identifier)
+    expected["timestamp"] = "Mon, 01 Mar 2021 12:30:05 GMT"
+    assert result == expected
+
+
+def test_dumps_unsupported(backend):
+    """Confirm that unsupported types raise ``TypeError``."""
+    with pytest.raises(TypeError):
+        serializer.dumps({"value": object()})
+
+
+def test_use_backend():
+    """Confirm that unknown backends are rejected."""
+    with pytest.raises(ValueError):
+        serializer.use_backend("pickle")
+
+
+def test_http_date():
+    """Confirm that dates are formatted like ``werkzeug.http.http_date``."""
+    for timestamp in (
+        datetime.datetime(2021, 3, 1, 12, 30, 5),
+        datetime.datetime(1999, 12, 31, 23, 59, 59, 999999),
+        datetime.datetime(2022, 7, 3, 1, 2, 3, tzinfo=TIMEZONE),
+    ):
+        assert serializer.http_date(timestamp) == http.http_date(timestamp)
@@ -0,0 +1,63 @@
+"""Tests for changes committed together in a unit of work."""
+# avoid pylint errors because of fixtures
+# pylint: disable = redefined-outer-name, unused-import
+
+import helpers
+import structure
+import unit_of_work
+import changelog
+from helpers import mdb
+
+
+def test_unit_of_work(mdb):
+    """
+    Confirm that staged changes are written together with their logs.
+
+    Checks:
+    * Nothing is written before ``commit``
+    * Added, updated and deleted entries are written
+    * One log per change, with the revisions following the earlier logs
+    * The revisions of the entries are increased
+    """
+    user_id = mdb["users"].find_one({"auth_ids": helpers.USERS["edit"]})["_id"]
+    order_id = helpers.add_order()
+    order = mdb["orders"].find_one({"_id": order_id})
+    dataset = structure.dataset()
+    dataset.update({"title": "Unit of work", **helpers.TEST_LABEL})
+    revisions = changelog.get_revisions(mdb, [changelog.revision_key("orders", order_id)])
+
+    work = unit_of_work.UnitOfWork(mdb, user_id)
+    work.add("datasets", dataset)
+    work.update(
+        "orders",
+        order_id,
+        {"$push": {"datasets": dataset["_id"]}},
+        {**order, "datasets": order["datasets"] + [dataset["_id"]]},
+        comment="Dataset added",
+    )
+    assert not mdb["datasets"].find_one({"_id": dataset["_id"]})
+    assert work.commit()
+
+    assert mdb["datasets"].find_one({"_id": dataset["_id"]})
+    assert mdb["orders"].find_one({"_id": order_id})["datasets"][-1] == dataset["_id"]
+    order_log = mdb["logs"].find_one({"data._id": order_id, "comment": "Dataset added"})
+    assert order_log["revision"] == 1
+    assert order_log["data"] == {"_id": order_id, "datasets": order["datasets"] + [dataset["_id"]]}
+    ds_log = mdb["logs"].find_one({"data._id": dataset["_id"]})
+    assert ds_log["action"] == "add"
+    assert ds_log["revision"] == 1
+    assert ds_log["user"] == user_id
+    assert changelog.get_revisions(mdb, [changelog.revision_key("orders", order_id)]) == [
+        revisions[0] + 1
+    ]
+
+    work = unit_of_work.UnitOfWork(mdb, user_id)
+    work.edit("datasets", {**dataset, "title": "Edited"})
+    work.delete("orders", order_id)
+    assert work.commit()
+    assert mdb["datasets"].find_one({"_id": dataset["_id"]})["title"] == "Edited"
+    assert not mdb["orders"].find_one({"_id": order_id})
+    ds_log = mdb["logs"].find_one({"data._id": dataset["_id"], "action": "edit"})
+    assert ds_log["data"] == {"_id": dataset["_id"], "title": "Edited"}
+    assert mdb["logs"].count_documents({"data._id": order_id, "action": "delete"}) == 1
+    mdb["datasets"].delete_one({"_id": dataset["_id"]})
@@ -3,6 +3,8 @@ import re
 import requests
 import uuid
 
+from user import make_user_context
+
 # avoid pylint errors because of fixtures
 # pylint: disable = redefined-outer-name, unused-import
 from helpers import (
@@ -444,3 +446,46 @@ def test_get_user_actions_access(mdb):
         else:
             assert response.code == 403
             assert not response.data
+
+
+def test_make_user_context():
+    """
+    Confirm that the user context contains the expanded permissions.
+
+    Checks:
+    * Not logged in
+    * Permissions expanded from the user entry
+    * Provided permissions are used as-is
+    """
+    context = make_user_context(None)
+    assert context.user is None
+    assert context.permissions == frozenset()
+
+    entry = {"_id": "u-test", "permissions": ["USER_MANAGEMENT"]}
+    context = make_user_context(entry)
+    assert context.user is entry
+    assert context.permissions == {"USER_MANAGEMENT", "USER_ADD", "USER_SEARCH"}
+
+    context = make_user_context({"_id": "u-test"}, frozenset(["DATA_EDIT"]))
+    assert context.permissions == {"DATA_EDIT"}
+
+
+def test_update_current_user_cache():
+    """
+    Confirm that changes to the current user are visible directly.
+
+    Checks:
+    * The name is updated in the following request despite the user cache
+    """
+    session = requests.Session()
+    as_user(session, USERS["base"])
+    old_name = make_request(session, "/api/v1/user/me").data["user"]["name"]
+    new_name = f"{old_name} (changed)"
+    response = make_request(
+        session, "/api/v1/user/me", {"user": {"name": new_name}}, method="PATCH", ret_json=False
+    )
+    assert response.code == 200
+    assert make_request(session, "/api/v1/user/me").data["user"]["name"] == new_name
+    make_request(
+        session, "/api/v1/user/me", {"user": {"name": old_name}}, method="PATCH", ret_json=False
+    )
@@ -3,10 +3,14 @@
 # avoid pylint errors because of fixtures
 # pylint: disable = redefined-outer-name, unused-import
 
+import datetime
+import json
 import uuid
 
+import flask
 import pytest
 
+import changelog
 import helpers
 import utils
 from helpers import mdb
@@ -99,6 +103,26 @@ def test_check_permissions():
     assert utils.check_permissions(permissions, user_permissions, True) == 200
 
 
+def test_expand_permissions():
+    """
+    Confirm that permissions are expanded to all the permissions they grant.
+
+    Checks:
+    * No permissions
+    * Permission including other permissions
+    * Expanded permissions are accepted by ``check_permissions``
+    """
+    assert utils.expand_permissions(None) == frozenset()
+    assert utils.expand_permissions([]) == frozenset()
+    assert utils.expand_permissions(["DATA_EDIT"]) == {"DATA_EDIT", "USER_ADD", "USER_SEARCH"}
+    expanded = utils.expand_permissions(["DATA_MANAGEMENT", "USER_ADD"])
+    assert expanded == {"DATA_EDIT", "OWNERS_READ", "DATA_MANAGEMENT", "USER_ADD"}
+    assert utils.check_permissions(["DATA_EDIT"], expanded, True, expanded=True) == 200
+    assert utils.check_permissions(["USER_SEARCH"], expanded, True, expanded=True) == 403
+    assert utils.has_permission("OWNERS_READ", expanded, expanded=True)
+    assert not utils.has_permission("OWNERS_READ", ["DATA_EDIT"])
+
+
 def test_commit_to_db(mdb):
     """
     Confirm that db commits work as intended.
@@ -182,3 +206,250 @@ def test_prepare_for_db():
     }
     indata = {"description": "<br />", "tags": ["testing"]}
     assert utils.prepare_for_db(indata) == expected
+
+
+def test_dbclient_options():
+    """
+    Confirm that the pool options are converted to ``MongoClient`` arguments.
+
+    Checks:
+    * No pool config
+    * Options are renamed, unset options are skipped
+    * Unknown option
+    """
+    conf = {"mongo": {"host": "localhost", "port": 27017, "user": "", "password": ""}}
+    assert utils.dbclient_options(conf) == {}
+
+    conf["mongo"]["pool"] = {"max_pool_size": 10, "connect_timeout_ms": None}
+    assert utils.dbclient_options(conf) == {"maxPoolSize": 10}
+
+    conf["mongo"]["pool"] = {"bad_option": 5}
+    with pytest.raises(ValueError):
+        utils.dbclient_options(conf)
+
+
+def test_shared_dbclient():
+    """
+    Confirm that the same client is reused until it is closed.
+
+    Checks:
+    * Repeated calls return the same client
+    * A new client is created after closing the shared client
+    """
+    conf = {
+        "mongo": {
+            "host": "localhost",
+            "port": 27017,
+            "user": "",
+            "password": "",
+            "pool": {"max_pool_size": 5},
+        }
+    }
+    client = utils.get_shared_dbclient(conf)
+    assert utils.get_shared_dbclient(conf) is client
+    utils.close_shared_dbclient()
+    new_client = utils.get_shared_dbclient(conf)
+    assert new_client is not client
+    utils.close_shared_dbclient()
+
+
+def test_get_titles():
+    """
+    Confirm that titles are returned in the requested order with one query.
+
+    Checks:
+    * Empty list gives no query
+    * Order is kept, including repeats
+    * Missing identifiers are reported
+    """
+    datasets = helpers.FakeCollection([{"_id": f"d-{i}", "title": f"Title {i}"} for i in range(5)])
+    fake_db = {"datasets": datasets}
+    assert utils.get_titles(fake_db, "datasets", []) == ([], [])
+    assert datasets.queries == 0
+
+    entries, missing = utils.get_titles(fake_db, "datasets", ["d-3", "d-9", "d-0", "d-3"])
+    assert entries == [
+        {"_id": "d-3", "title": "Title 3"},
+        {"_id": "d-0", "title": "Title 0"},
+        {"_id": "d-3", "title": "Title 3"},
+    ]
+    assert missing == ["d-9"]
+    assert datasets.queries == 1
+
+
+def test_resolve_users():
+    """
+    Confirm that user identifiers are replaced using a single query.
+
+    Checks:
+    * Lists keep their order, unknown identifiers are dropped
+    * Single identifiers are replaced if found, otherwise kept
+    * Multiple entries are resolved with one query
+    """
+    users = helpers.FakeCollection(
+        [
+            {
+                "_id": f"u-{i}",
+                "affiliation": "",
+                "api_key": "hash",
+                "contact": "",
+                "name": f"User {i}",
+                "orcid": "",
+                "url": "",
+            }
+            for i in range(4)
+        ]
+    )
+    fake_db = {"users": users}
+    orders = [
+        {"authors": ["u-2", "u-0", "u-9"], "organisation": "u-1"},
+        {"authors": [], "organisation": "u-8"},
+    ]
+    found = utils.resolve_users(orders, ("authors", "organisation"), fake_db)
+    assert users.queries == 1
+    assert set(found) == {"u-0", "u-1", "u-2"}
+    assert [entry["name"] for entry in orders[0]["authors"]] == ["User 2", "User 0"]
+    assert orders[0]["organisation"]["_id"] == "u-1"
+    assert "api_key" not in orders[0]["organisation"]
+    assert orders[1] == {"authors": [], "organisation": "u-8"}
+
+    assert utils.resolve_users([{"authors": []}], ("authors",), fake_db) == {}
+    assert users.queries == 1
+
+
+def test_cursor():
+    """
+    Confirm that cursor tokens can be decoded.
+
+    Checks:
+    * Encoded values are decoded, with datetimes as ``datetime.datetime``
+    * Bad tokens raise ``ValueError``, also if the sort value is not a scalar or datetime
+    """
+    identifier = "d-" + str(uuid.uuid4())
+    token = utils.encode_cursor(["Title", identifier])
+    assert utils.decode_cursor(token) == ["Title", identifier]
+    timestamp = datetime.datetime(2021, 5, 1, 12, 30, 15, 123000)
+    token = utils.encode_cursor([timestamp, identifier])
+    assert utils.decode_cursor(token) == [timestamp, identifier]
+    for token in (
+        "bad",
+        utils.encode_cursor([1]),
+        utils.encode_cursor([1, 2]),
+        utils.encode_cursor([{"$ne": None}, identifier]),
+        utils.encode_cursor([["Title"], identifier]),
+        utils.encode_cursor([{"$date": 1}, identifier]),
+    ):
+        with pytest.raises(ValueError):
+            utils.decode_cursor(token)
+
+
+def test_parse_timestamp():
+    """
+    Confirm that timestamps are parsed and converted to local time.
+
+    Checks:
+    * Dates and timestamps without timezone are kept
+    * Timestamps with timezone are converted to local time
+    * Bad timestamps raise ``ValueError``
+    """
+    assert utils.parse_timestamp("2021-05-01") == datetime.datetime(2021, 5, 1)
+    assert utils.parse_timestamp("2021-05-01T12:30:15") == datetime.datetime(2021, 5, 1, 12, 30, 15)
+    utc = datetime.datetime(2021, 5, 1, 12, tzinfo=datetime.timezone.utc)
+    expected = utc.astimezone().replace(tzinfo=None)
+    assert utils.parse_timestamp("2021-05-01T12:00:00Z") == expected
+    assert utils.parse_timestamp("2021-05-01T14:00:00+02:00") == expected
+    for value in ("yesterday", "2021-13-01", ""):
+        with pytest.raises(ValueError):
+            utils.parse_timestamp(value)
+
+
+def test_parse_list_query():
+    """
+    Confirm that the list parameters are parsed and checked.
+
+    Checks:
+    * No parameters
+    * All parameters
+    * Bad parameters raise ``ValueError``
+    """
+    allowed = ("title", "tags")
+    sort_fields = ("_id", "title")
+    assert utils.parse_list_query({}, allowed, sort_fields) == utils.ListQuery(
+        limit=None, after=None, sort=("_id", 1), fields=None
+    )
+    identifier = "d-" + str(uuid.uuid4())
+    args = {
+        "limit": "20",
+        "after": utils.encode_cursor(["A", identifier]),
+        "sort": "-title",
+        "fields": "id,title,tags",
+    }
+    assert utils.parse_list_query(args, allowed, sort_fields) == utils.ListQuery(
+        limit=20, after=["A", identifier], sort=("title", -1), fields=("title", "tags")
+    )
+    for bad_args in (
+        {"limit": "0"},
+        {"limit": str(utils.MAX_LIST_LIMIT + 1)},
+        {"limit": "many"},
+        {"sort": "tags"},
+        {"fields": "title,api_key"},
+    ):
+        with pytest.raises(ValueError):
+            utils.parse_list_query(bad_args, allowed, sort_fields)
+
+
+def test_response_json_stream():
+    """
+    Confirm that streamed responses contain the same data as ``response_json``.
+
+    Checks:
+    * Entries from an iterator are encoded with ``_id`` renamed to ``id``
+    * Other fields and ``url`` are included
+    * NDJSON is returned if requested, with ``next_cursor`` as header
+    """
+    app = flask.Flask("test")
+    entries = [{"_id": uuid.uuid4(), "title": f"Title {i}"} for i in range(3)]
+    expected = [{"id": str(entry["_id"]), "title": entry["title"]} for entry in entries]
+
+    with app.test_request_context("/api/v1/dataset"):
+        data = {"next_cursor": "abc", "datasets": (dict(entry) for entry in entries)}
+        response = utils.response_json_stream(data, "datasets")
+        assert response.is_streamed
+        body = json.loads(response.get_data())
+    assert body == {"next_cursor": "abc", "url": "/api/v1/dataset", "datasets": expected}
+
+    with app.test_request_context("/api/v1/dataset"):
+        response = utils.response_json_stream({"datasets": iter([])}, "datasets")
+        body = json.loads(response.get_data())
+    assert body == {"url": "/api/v1/dataset", "datasets": []}
+
+    with app.test_request_context("/api/v1/dataset", headers={"Accept": utils.NDJSON_MIMETYPE}):
+        data = {"next_cursor": "abc", "datasets": (dict(entry) for entry in entries)}
+        response = utils.response_json_stream(data, "datasets")
+        assert response.mimetype == utils.NDJSON_MIMETYPE
+        assert response.headers["X-Next-Cursor"] == "abc"
+        lines = response.get_data().decode().splitlines()
+    assert [json.loads(line) for line in lines] == expected
+
+
+def test_revisions(mdb):
+    """
+    Confirm that revisions are increased by changes.
+
+    Checks:
+    * Unchanged entries have revision 0
+    * ``commit_to_db`` increases the revision of the entry and the collection
+    """
+    add_data = {"title": "Test title"}
+    add_data.update(helpers.TEST_LABEL)
+    keys = ["collections", "collections:" + str(uuid.uuid4())]
+    assert changelog.get_revisions(mdb, keys[1:]) == [0]
+    before = changelog.get_revisions(mdb, keys[:1])[0]
+
+    result = utils.commit_to_db(mdb, "collections", "add", add_data)
+    keys[1] = changelog.revision_key("collections", result.inserted_id)
+    assert changelog.get_revisions(mdb, keys) == [before + 1, 1]
+    utils.commit_to_db(mdb, "collections", "edit", {"_id": result.inserted_id, "title": "New"})
+    assert changelog.get_revisions(mdb, keys) == [before + 2, 2]
+    utils.commit_to_db(mdb, "collections", "delete", {"_id": result.inserted_id})
+    assert changelog.get_revisions(mdb, keys[1:]) == [3]
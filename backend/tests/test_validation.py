@@ -1,10 +1,12 @@
 """Tests for validation functions."""
 import uuid
 
+import flask
 import pytest
 
 # avoid pylint errors because of fixtures
 # pylint: disable = redefined-outer-name, unused-import
+import helpers
 from helpers import mdb
 import validate
 
@@ -429,3 +431,43 @@ def test_validate_url():
         validator(("asd",))
     with pytest.raises(ValueError):
         validator(4.5)
+
+
+def test_reference_validation_batched():
+    """
+    Confirm that referenced entries are checked with one query per collection and request.
+
+    Checks:
+    * A list of users is checked with one query
+    * Prefetched identifiers are not looked up again during the request
+    * Unknown identifiers are rejected
+    """
+    fake_db = {
+        "users": helpers.FakeCollection(f"u-{i}" for i in range(200)),
+        "datasets": helpers.FakeCollection(f"d-{i}" for i in range(500)),
+    }
+    assert validate.validate_user_list([f"u-{i}" for i in range(200)], db=fake_db)
+    assert fake_db["users"].queries == 1
+
+    app = flask.Flask(__name__)
+    with app.app_context():
+        flask.g.db = fake_db
+        indata = {
+            "authors": [f"u-{i}" for i in range(200)],
+            "editors": ["u-1", "u-2"],
+            "organisation": "u-3",
+            "datasets": [f"d-{i}" for i in range(500)],
+            "title": "Title",
+        }
+        validate.prefetch_references(indata)
+        assert fake_db["users"].queries == 2
+        assert fake_db["datasets"].queries == 1
+        for field in ("authors", "editors", "organisation", "datasets"):
+            assert validate.VALIDATION_MAPPER[field](indata[field])
+        assert fake_db["users"].queries == 2
+        assert fake_db["datasets"].queries == 1
+
+        with pytest.raises(ValueError):
+            validate.validate_user_list(["u-1", "u-1000"])
+        with pytest.raises(ValueError):
+            validate.validate_datasets(["d-1000"])
@@ -0,0 +1,209 @@
+"""
+Changes of multiple entries committed together.
+
+A request handler stages the changes (``add``, ``edit``, ``update``, ``delete``)
+of a ``UnitOfWork`` and then commits them with ``commit``. The writes are done
+with one ``bulk_write`` per collection and all logs with one ``insert_many``,
+in a transaction if the deployment supports it (see ``changelog.run_transaction``).
+The revisions (``changelog.bump_revisions``) and facet counts are updated after
+the transaction.
+
+Each entry should only be staged once per unit of work.
+"""
+from collections import namedtuple
+
+import pymongo
+
+import changelog
+import facets
+
+Change = namedtuple(
+    "Change", ["dbcollection", "action", "identifier", "operation", "data", "previous", "comment"]
+)
+
+
+class UnitOfWork:
+    """Stage changes of entries and commit them, with their logs, together."""
+
+    def __init__(self, db, user_id, logger=None):
+        """
+        Start a new unit of work.
+
+        Args:
+            db: Connection to the database.
+            user_id: The ``_id`` of the user performing the changes (used in the logs).
+            logger: The logging object to use for errors.
+        """
+        self.db = db
+        self.user_id = user_id
+        self.logger = logger
+        self.changes = []
+
+    def add(self, dbcollection: str, data: dict, comment: str = ""):
+        """
+        Stage the addition of an entry.
+
+        Args:
+            dbcollection (str): The collection of the entry.
+            data (dict): The complete entry, including ``_id``.
+            comment (str): The comment for the log.
+        """
+        self.changes.append(
+            Change(
+                dbcollection,
+                "add",
+                data["_id"],
+                pymongo.InsertOne(data),
+                data,
+                None,
+                comment or f"Add in {dbcollection}",
+            )
+        )
+
+    def edit(self, dbcollection: str, data: dict, previous: dict = None, comment: str = ""):
+        """
+        Stage setting the fields in ``data`` of an entry.
+
+        Args:
+            dbcollection (str): The collection of the entry.
+            data (dict): The updated entry, including ``_id``.
+            previous (dict): The entry before the change; fetched at commit if not set.
+            comment (str): The comment for the log.
+        """
+        self.update(dbcollection, data["_id"], {"$set": data}, data, previous, comment)
+
+    # pylint: disable=too-many-arguments
+    def update(
+        self,
+        dbcollection: str,
+        identifier,
+        update: dict,
+        data: dict,
+        previous: dict = None,
+        comment: str = "",
+    ):
+        """
+        Stage an update of an entry with any update operators (e.g. ``$push``).
+
+        Args:
+            dbcollection (str): The collection of the entry.
+            identifier: The ``_id`` of the entry.
+            update (dict): The update, e.g. ``{"$push": {"datasets": dataset_id}}``.
+            data (dict): The entry after the update, used for the log.
+            previous (dict): The entry before the change; fetched at commit if not set.
+            comment (str): The comment for the log.
+        """
+        self.changes.append(
+            Change(
+                dbcollection,
+                "edit",
+                identifier,
+                pymongo.UpdateOne({"_id": identifier}, update),
+                data,
+                previous,
+                comment or f"Edit in {dbcollection}",
+            )
+        )
+
+    def delete(self, dbcollection: str, identifier, comment: str = ""):
+        """
+        Stage the deletion of an entry.
+
+        References to the entry are not removed (see ``cascade``).
+
+        Args:
+            dbcollection (str): The collection of the entry.
+            identifier: The ``_id`` of the entry.
+            comment (str): The comment for the log.
+        """
+        self.changes.append(
+            Change(
+                dbcollection,
+                "delete",
+                identifier,
+                pymongo.DeleteOne({"_id": identifier}),
+                {"_id": identifier},
+                None,
+                comment or f"Delete in {dbcollection}",
+            )
+        )
+
+    def commit(self) -> bool:
+        """
+        Write all staged changes and their logs.
+
+        Returns:
+            bool: Whether the changes were written.
+        """
+        if not self.changes:
+            return True
+        try:
+            changes = changelog.run_transaction(self.db, self._write)
+        except pymongo.errors.PyMongoError as err:
+            if self.logger:
+                self.logger.error("Commit of %d changes failed: %s", len(self.changes), err)
+            return False
+        self.changes = []
+
+        identifiers = {}
+        facet_changes = {}
+        for change in changes:
+            identifiers.setdefault(change.dbcollection, []).append(change.identifier)
+            after = None if change.action == "delete" else change.data
+            facet_changes.setdefault(change.dbcollection, []).append((change.previous, after))
+        for dbcollection, entries in identifiers.items():
+            changelog.bump_revisions(self.db, dbcollection, entries)
+            facets.update_facets_many(self.db, dbcollection, facet_changes[dbcollection])
+        return True
+
+    def _write(self, dbsession) -> list:
+        """
+        Do the writes; run by ``changelog.run_transaction``.
+
+        Returns:
+            list: The changes, with ``previous`` set for edits and deletions.
+        """
+        changes = self._with_previous(dbsession)
+        operations = {}
+        logs = {}
+        for change in changes:
+            operations.setdefault(change.dbcollection, []).append(change.operation)
+            logs.setdefault((change.dbcollection, change.action, change.comment), []).append(
+                change
+            )
+        for dbcollection, entries in operations.items():
+            self.db[dbcollection].bulk_write(entries, ordered=True, session=dbsession)
+
+        new_logs = []
+        for (dbcollection, action, comment), entries in logs.items():
+            new_logs += changelog.new_logs(
+                self.db,
+                dbcollection[:-1],  # to make singular (e.g. collection|s)
+                action,
+                comment,
+                self.user_id,
+                [change.data for change in entries],
+                previous=[change.previous for change in entries],
+                dbsession=dbsession,
+            )
+        changelog.insert_logs(self.db, new_logs, dbsession)
+        return changes
+
+    def _with_previous(self, dbsession) -> list:
+        """Fetch the entries before the change for edits and deletions, one query per collection."""
+        missing = {}
+        for change in self.changes:
+            if change.action != "add" and change.previous is None:
+                missing.setdefault(change.dbcollection, []).append(change.identifier)
+        previous = {}
+        for dbcollection, identifiers in missing.items():
+            for entry in self.db[dbcollection].find(
+                {"_id": {"$in": identifiers}}, session=dbsession
+            ):
+                previous[(dbcollection, entry["_id"])] = entry
+        return [
+            change._replace(previous=previous.get((change.dbcollection, change.identifier)))
+            if change.identifier is not None and change.previous is None
+            else change
+            for change in self.changes
+        ]
@@ -10,15 +10,25 @@ Helper functions
 Requests
     User-related API endpoints, including login/logout and user manament.
 """
+import copy
 import functools
+from collections import namedtuple
 
 import flask
 
+import cache
+import changelog
 import structure
 import utils
 
 blueprint = flask.Blueprint("user", __name__)  # pylint: disable=invalid-name
 
+# The user of a request and the expanded set of permissions for the user
+UserContext = namedtuple("UserContext", ["user", "permissions"])
+
+# User entries by _id, shared between requests in the process
+USER_CACHE = cache.TTLCache(max_size=1024, ttl=30)
+
 PERMISSIONS = {
     "DATA_EDIT": ("DATA_EDIT", "USER_ADD", "USER_SEARCH"),
     "OWNERS_READ": ("OWNERS_READ",),
@@ -55,10 +65,17 @@ def get_permission_info():
 
 @blueprint.route("")
 def list_users():
-    """List all users."""
+    """
+    List all users.
+
+    Supports pagination, sorting and field selection (see ``utils.parse_list_query``).
+    """
     perm_status = utils.req_check_permissions(["USER_SEARCH"])
     if perm_status != 200:
         flask.abort(status=perm_status)
+    etag = utils.req_etag("users")
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
 
     fields = {"api_key": 0, "api_salt": 0}
 
@@ -66,9 +83,18 @@ def list_users():
         fields["auth_ids"] = 0
         fields["permissions"] = 0
 
-    result = tuple(flask.g.db["users"].find(projection=fields))
+    result = utils.req_list_entries(
+        "users",
+        "users",
+        {},
+        fields,
+        allowed_fields=tuple(field for field in structure.user() if field not in fields),
+        sort_fields=("_id", "name", "email"),
+    )
 
-    return utils.response_json({"users": result})
+    response = utils.response_json_stream(result, "users")
+    response.set_etag(etag)
+    return response
 
 
 # requests
@@ -80,7 +106,7 @@ def get_current_user_info():
     Returns:
         flask.Response: json structure for the user
     """
-    data = flask.g.current_user
+    data = get_current_user_entry()
     outstructure = {
         "_id": "",
         "affiliation": "",
@@ -126,6 +152,9 @@ def gen_new_api_key(identifier: str = None):
     new_values = {"api_key": new_hash, "api_salt": apikey.salt}
     user_data.update(new_values)
     result = flask.g.db["users"].update_one({"_id": identifier}, {"$set": new_values})
+    changelog.bump_revisions(flask.g.db, "users", [identifier])
+    utils.invalidate_api_key_cache(identifier)
+    USER_CACHE.pop(identifier)
     if not result.acknowledged:
         flask.current_app.logger.error("Updating API key for user %s failed", identifier)
         flask.Response(status=500)
@@ -150,6 +179,9 @@ def get_user_data(identifier: str):
     if perm_status != 200:
         flask.abort(status=perm_status)
 
+    etag = utils.req_etag("users", identifier)
+    if utils.req_not_modified(etag):
+        return utils.response_not_modified(etag)
     user_info = utils.req_get_entry("users", identifier)
     if not user_info:
         flask.abort(status=404)
@@ -160,7 +192,9 @@ def get_user_data(identifier: str):
 
     user_info["permissions"] = utils.prepare_permissions(user_info["permissions"])
 
-    return utils.response_json({"user": user_info})
+    response = utils.response_json({"user": user_info})
+    response.set_etag(etag)
+    return response
 
 
 @blueprint.route("", methods=["POST"])
@@ -235,6 +269,8 @@ def delete_user(identifier: str):
         flask.abort(status=404)
 
     result = utils.req_commit_to_db("users", "delete", {"_id": identifier})
+    utils.invalidate_api_key_cache(identifier)
+    USER_CACHE.pop(identifier)
     if not result.log or not result.data:
         flask.abort(status=500)
 
@@ -250,7 +286,9 @@ def update_current_user_info():
     Returns:
         flask.Response: Response code.
     """
-    user_data = flask.g.current_user
+    user_data = get_current_user_entry()
+    if not user_data:
+        flask.abort(status=401)
 
     jsondata = flask.request.json
     if not jsondata.get("user") or not isinstance(jsondata["user"], dict):
@@ -273,6 +311,7 @@ def update_current_user_info():
 
     if is_different:
         result = utils.req_commit_to_db("users", "edit", user_data)
+        USER_CACHE.pop(user_data["_id"])
         if not result.log or not result.data:
             flask.abort(status=500)
 
@@ -327,6 +366,7 @@ def update_user_info(identifier: str):
 
     if is_different:
         result = utils.req_commit_to_db("users", "edit", user_data)
+        USER_CACHE.pop(user_data["_id"])
         if not result.log or not result.data:
             flask.abort(status=500)
 
@@ -341,6 +381,8 @@ def get_user_log(identifier: str):
 
     Can be accessed by actual user and admin (USER_MANAGEMENT).
 
+    Supports time ranges and pagination (see ``utils.req_list_logs``).
+
     Args:
         identifier (str): The user identifier.
 
@@ -352,18 +394,44 @@ def get_user_log(identifier: str):
         if perm_status != 200:
             flask.abort(status=perm_status)
 
-    user_logs = list(flask.g.db["logs"].find({"data_type": "user", "data._id": identifier}))
+    user_logs = utils.req_list_logs({"data_type": "user", "data._id": identifier})
+
+    def hide_keys(logs):
+        """Hide the API key fields in the logs."""
+        for log in logs:
+            for key in ("api_key", "api_salt"):
+                if key in log["data"]:
+                    log["data"][key] = "<hidden>"
+            yield log
+
+    user_logs["logs"] = hide_keys(user_logs["logs"])
+    return utils.response_json_stream(
+        {"entry_id": identifier, "data_type": "user", **user_logs}, "logs"
+    )
 
-    for log in user_logs:
-        del log["data_type"]
 
-    utils.incremental_logs(user_logs)
-    for i in range(len(user_logs)):
-        for key in ("api_key", "api_salt"):
-            if key in user_logs[i]["data"]:
-                user_logs[i]["data"][key] = "<hidden>"
+@blueprint.route("/<identifier>/at", methods=["GET"])
+@login_required
+def get_user_at(identifier: str):
+    """
+    Get the user entry with uuid ``identifier`` as it was at the time in ``timestamp``.
+
+    The entry is rebuilt from the logs (see ``utils.req_log_state_response``).
+
+    Can be accessed by actual user and admin (USER_MANAGEMENT).
+
+    Args:
+        identifier (str): The user identifier.
+
+    Returns:
+        flask.Response: Information about the user as json.
+    """
+    if identifier != (flask.g.current_user["_id"] or None):
+        perm_status = utils.req_check_permissions(["USER_MANAGEMENT"])
+        if perm_status != 200:
+            flask.abort(status=perm_status)
 
-    return utils.response_json({"entry_id": identifier, "data_type": "user", "logs": user_logs})
+    return utils.req_log_state_response("user", identifier, hidden=("api_key", "api_salt"))
 
 
 @blueprint.route("/<identifier>/actions", methods=["GET"])
@@ -374,6 +442,8 @@ def get_user_actions(identifier: str):
 
     Can be accessed by actual user and USER_MANAGEMENT.
 
+    Supports time ranges and pagination (see ``utils.req_list_logs``).
+
     Args:
         identifier (str): The user identifier.
 
@@ -386,13 +456,19 @@ def get_user_actions(identifier: str):
             flask.abort(status=perm_status)
 
     # only report a list of actions, not the actual data
-    user_logs = list(flask.g.db["logs"].find({"user": identifier}, {"user": 0}))
+    user_logs = utils.req_list_logs(
+        {"user": identifier},
+        {"action": 1, "comment": 1, "data_type": 1, "data._id": 1, "timestamp": 1},
+    )
 
-    for entry in user_logs:
-        entry["entry_id"] = entry["data"]["_id"]
-        del entry["data"]
+    def add_entry_id(logs):
+        """Replace ``data`` with the identifier of the changed entry."""
+        for entry in logs:
+            entry["entry_id"] = entry.pop("data")["_id"]
+            yield entry
 
-    return utils.response_json({"logs": user_logs})
+    user_logs["logs"] = add_entry_id(user_logs["logs"])
+    return utils.response_json_stream(user_logs, "logs")
 
 
 # helper functions
@@ -412,6 +488,8 @@ def add_new_user(user_info: dict):
         result = flask.g.db["users"].update_one(
             {"email": user_info["email"]}, {"$set": {"auth_ids": db_user["auth_ids"]}}
         )
+        changelog.bump_revisions(flask.g.db, "users", [db_user["_id"]])
+        USER_CACHE.pop(db_user["_id"])
         if not result.acknowledged:
             flask.current_app.logger.error(
                 "Failed to add new auth_id to user with email %s", user_info["email"]
@@ -427,6 +505,7 @@ def add_new_user(user_info: dict):
         new_user["auth_ids"] = [user_info["auth_id"]]
 
         result = flask.g.db["users"].insert_one(new_user)
+        changelog.bump_revisions(flask.g.db, "users", [new_user["_id"]])
         if not result.acknowledged:
             flask.current_app.logger.error(
                 "Failed to add user with email %s via oidc", user_info["email"]
@@ -465,10 +544,45 @@ def get_current_user():
     return get_user(user_uuid=flask.session.get("user_id"))
 
 
+def make_user_context(user_entry: dict = None, permissions: frozenset = None) -> UserContext:
+    """
+    Make the user context for a request.
+
+    Args:
+        user_entry (dict): The user, ``None`` if not logged in.
+        permissions (frozenset): The expanded permissions of the user.
+            Defaults to the expansion of ``user_entry["permissions"]``.
+
+    Returns:
+        UserContext: The user context.
+    """
+    if permissions is None:
+        permissions = utils.expand_permissions(user_entry["permissions"] if user_entry else None)
+    return UserContext(user=user_entry, permissions=permissions)
+
+
+def get_current_user_entry():
+    """
+    Get the complete database entry for the current user.
+
+    Requests authenticated with an API token only have ``_id`` in
+    ``flask.g.current_user``, so the entry is loaded from the database.
+
+    Returns:
+        dict: The current user.
+    """
+    if flask.g.get("token_auth"):
+        return get_user(user_uuid=flask.g.current_user["_id"])
+    return flask.g.current_user
+
+
 def get_user(user_uuid=None):
     """
     Get information about the user.
 
+    Entries are kept in ``USER_CACHE`` for a short time.
+    A copy is returned, so it can be modified freely.
+
     Args:
         user_uuid (str): The identifier (uuid) of the user.
 
@@ -476,7 +590,11 @@ def get_user(user_uuid=None):
         dict: The current user.
     """
     if user_uuid:
-        user = flask.g.db["users"].find_one({"_id": user_uuid})
+        user = USER_CACHE.get(user_uuid)
+        if not user:
+            user = flask.g.db["users"].find_one({"_id": user_uuid})
+            if user:
+                USER_CACHE.set(user_uuid, user)
         if user:
-            return user
+            return copy.deepcopy(user)
     return None
@@ -1,26 +1,50 @@
 """General helper functions."""
 
+import atexit
+import base64
 import copy
 import datetime
+import hashlib
+import hmac
 import html
+import json
+import os
 import re
 import secrets
+import threading
 import uuid
 from collections import namedtuple
 from itertools import chain
-from typing import Any, Union, Optional
+from typing import Any, Iterable, Iterator, Union, Optional
 
 import argon2
 import bson
 import flask
+import itsdangerous
 import pymongo
 
-import structure
+import cache
+import changelog
+import facets
+import serializer
+import unit_of_work
 import user
 import validate
 
 ValidationResult = namedtuple("ValidationResult", ["result", "status"])
 CommitResult = namedtuple("CommitResult", ["log", "data", "ins_id"])
+ListQuery = namedtuple("ListQuery", ["limit", "after", "sort", "fields"])
+DbResult = namedtuple("DbResult", ["acknowledged", "inserted_id", "previous"])
+
+# Maximum number of entries per page for list requests
+MAX_LIST_LIMIT = 1000
+# Max number of entries in a bulk request
+MAX_BULK_SIZE = 500
+
+# Successful API key verifications: (auth_id, keyed digest of the key) -> stored hash
+API_KEY_CACHE = cache.TTLCache(max_size=1024, ttl=300)
+# Key for the digests in API_KEY_CACHE; never leaves the process
+_API_KEY_DIGEST_KEY = secrets.token_bytes(32)
 
 
 def basic_check_indata(indata: dict, reference_data: dict, prohibited: Union[tuple, list]) -> tuple:
@@ -32,6 +56,9 @@ def basic_check_indata(indata: dict, reference_data: dict, prohibited: Union[tup
     * All fields are of the correct type
     * All prohibited fields are unchanged (if update)
 
+    Referenced entries (e.g. users in ``authors``) are checked with one query
+    per referenced collection.
+
     Args:
         indata (dict): The incoming data.
         reference_data (dict): Either the old data or a reference dict.
@@ -49,6 +76,8 @@ def basic_check_indata(indata: dict, reference_data: dict, prohibited: Union[tup
         flask.current_app.logger.debug("Title empty")
         return ValidationResult(result=False, status=400)
 
+    validate.prefetch_references(indata)
+
     for key in indata:
         if key in prohibited and indata[key] != reference_data[key]:
             flask.current_app.logger.debug("Prohibited key (%s) with new value", key)
@@ -61,6 +90,51 @@ def basic_check_indata(indata: dict, reference_data: dict, prohibited: Union[tup
     return ValidationResult(result=True, status=200)
 
 
+def check_indata_many(entries: list, reference_data: dict, prohibited: Union[tuple, list]):
+    """
+    Perform ``basic_check_indata`` for multiple entries, e.g. for bulk requests.
+
+    The referenced entries of all entries are checked together, with one query
+    per referenced collection.
+
+    Args:
+        entries (list): The incoming data for each entry.
+        reference_data (dict): Either the old data or a reference dict.
+        prohibited (Union[tuple, list]): Fields that may not be modified.
+
+    Returns:
+        list: The suggested http code for each entry (200 if the check passed).
+    """
+    validate.prefetch_references(*[entry for entry in entries if isinstance(entry, dict)])
+    return [
+        basic_check_indata(entry, reference_data, prohibited).status
+        if isinstance(entry, dict)
+        else 400
+        for entry in entries
+    ]
+
+
+def req_bulk_indata(key: str) -> list:
+    """
+    Get the list of entries from the body of a bulk request.
+
+    Aborts with status 400 if ``key`` is missing, is not a list, or has
+    no or more than ``MAX_BULK_SIZE`` entries.
+
+    Args:
+        key (str): The key for the entries in the body, e.g. ``datasets``.
+
+    Returns:
+        list: The entries.
+    """
+    jsondata = flask.request.json
+    if not jsondata or not isinstance(jsondata, dict) or not isinstance(jsondata.get(key), list):
+        flask.abort(status=400)
+    if not 0 < len(jsondata[key]) <= MAX_BULK_SIZE:
+        flask.abort(status=400)
+    return jsondata[key]
+
+
 def secure_description(data: str):
     """
     Process the description to make sure it does not contain dangerous data.
@@ -131,31 +205,190 @@ def gen_api_key_hash(api_key: str, salt: str):
     return ph.hash(api_key + salt)
 
 
-def verify_api_key(username: str, api_key: str):
+def api_key_digest(api_key: str) -> str:
+    """
+    Generate a keyed digest of an API key for use as a cache key.
+
+    The digest key is random for each process, so the digests are useless outside it.
+
+    Args:
+        api_key (str): The cleartext API key.
+
+    Returns:
+        str: HMAC-SHA256 of the API key as hex.
+    """
+    return hmac.new(_API_KEY_DIGEST_KEY, api_key.encode(), hashlib.sha256).hexdigest()
+
+
+def verify_api_key(username: str, api_key: str) -> dict:
     """
     Verify an API key against the value in the database.
 
+    Successful verifications are kept in ``API_KEY_CACHE``. A cached verification
+    is only used if the stored hash is unchanged, so a new key invalidates it
+    in all processes.
+
     Aborts with status 401 if the verification fails.
 
     Args:
         username (str): The username to check.
         api_key (str): The received API key (hex).
+
+    Returns:
+        dict: The user entry matching ``username``.
     """
-    ph = argon2.PasswordHasher()
     user_info = flask.g.db["users"].find_one({"auth_ids": username})
     if not user_info:
         flask.current_app.logger.info("API key verification failed (bad username)")
         flask.abort(status=401)
+
+    cache_key = (username, api_key_digest(api_key))
+    cached = API_KEY_CACHE.get(cache_key)
+    if cached and cached["api_key"] == user_info["api_key"]:
+        return user_info
+
+    ph = argon2.PasswordHasher()
     try:
         ph.verify(user_info["api_key"], api_key + user_info["api_salt"])
     except argon2.exceptions.VerifyMismatchError:
         flask.current_app.logger.info("API key verification failed (bad hash)")
         flask.abort(status=401)
+    API_KEY_CACHE.set(cache_key, {"user_id": user_info["_id"], "api_key": user_info["api_key"]})
+    return user_info
+
+
+def invalidate_api_key_cache(user_id: str) -> int:
+    """
+    Remove all cached API key verifications for a user.
+
+    Should be called when the API key is changed or the user is deleted.
+
+    Args:
+        user_id (str): The ``_id`` of the user.
+
+    Returns:
+        int: The number of removed cache entries.
+    """
+    return API_KEY_CACHE.pop_matching(lambda _, value: value["user_id"] == user_id)
+
+
+# API tokens
+def _api_token_serializer() -> itsdangerous.URLSafeTimedSerializer:
+    """
+    Get the serializer used to sign and verify API tokens.
+
+    Returns:
+        itsdangerous.URLSafeTimedSerializer: Serializer using the app secret.
+    """
+    return itsdangerous.URLSafeTimedSerializer(
+        flask.current_app.config["SECRET_KEY"], salt="api-token"
+    )
+
+
+def api_token_ttl() -> int:
+    """
+    Get the number of seconds an API token is valid.
+
+    Returns:
+        int: The lifetime of a token (``api_token.ttl``, default 900).
+    """
+    return (flask.current_app.config.get("api_token") or {}).get("ttl", 900)
+
+
+def gen_api_token(user_info: dict) -> str:
+    """
+    Generate a signed token for a user whose API key has been verified.
+
+    The token contains the ``_id`` and the expanded permissions of the user,
+    so requests using it do not need to look up the user.
+
+    Args:
+        user_info (dict): The user entry.
+
+    Returns:
+        str: The signed token.
+    """
+    return _api_token_serializer().dumps(
+        {
+            "user": user_info["_id"],
+            "permissions": sorted(expand_permissions(user_info["permissions"])),
+        }
+    )
+
+
+def verify_api_token(token: str) -> dict:
+    """
+    Verify the signature and age of an API token.
+
+    Aborts with status 401 if the verification fails.
+
+    Note:
+        Tokens are not revoked if the API key is changed or the user is deleted;
+        they stay valid until they expire.
+
+    Args:
+        token (str): The received token.
+
+    Returns:
+        dict: The token payload (``user``, ``permissions``).
+    """
+    try:
+        return _api_token_serializer().loads(token, max_age=api_token_ttl())
+    except itsdangerous.SignatureExpired:
+        flask.current_app.logger.info("API token verification failed (expired)")
+    except itsdangerous.BadData:
+        flask.current_app.logger.info("API token verification failed (bad signature)")
+    flask.abort(status=401)
+
+
+# Options in ``mongo.pool`` (config.yaml) and the matching ``MongoClient`` keyword
+DBCLIENT_OPTIONS = {
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "wait_queue_timeout_ms": "waitQueueTimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+    "heartbeat_frequency_ms": "heartbeatFrequencyMS",
+}
+
+# The client shared by all requests in the current process
+_DBCLIENT = {"client": None, "pid": None}
+_DBCLIENT_LOCK = threading.Lock()
+
+
+def dbclient_options(conf) -> dict:
+    """
+    Get the keyword arguments for ``MongoClient`` from the ``mongo.pool`` config.
+
+    Options that are not set in the config are left to the pymongo defaults.
+
+    Args:
+        conf: A mapping with the relevant mongo keys available.
+
+    Returns:
+        dict: Keyword arguments for ``pymongo.MongoClient``.
+
+    Raises:
+        ValueError: Unknown option in ``mongo.pool``.
+    """
+    pool_conf = conf["mongo"].get("pool") or {}
+    options = {}
+    for key, value in pool_conf.items():
+        if key not in DBCLIENT_OPTIONS:
+            raise ValueError(f"Unknown option in mongo.pool ({key})")
+        if value is not None:
+            options[DBCLIENT_OPTIONS[key]] = value
+    return options
 
 
 def get_dbclient(conf) -> pymongo.mongo_client.MongoClient:
     """
-    Get the connection to the MongoDB database server.
+    Get a new connection to the MongoDB database server.
+
+    Every call creates a new client (with its own connection pool).
+    Use ``get_shared_dbclient`` from inside requests.
 
     Args:
         conf: A mapping with the relevant mongo keys available.
@@ -168,9 +401,52 @@ def get_dbclient(conf) -> pymongo.mongo_client.MongoClient:
         port=conf["mongo"]["port"],
         username=conf["mongo"]["user"],
         password=conf["mongo"]["password"],
+        **dbclient_options(conf),
     )
 
 
+def get_shared_dbclient(conf) -> pymongo.mongo_client.MongoClient:
+    """
+    Get the MongoDB client shared by all requests in the current process.
+
+    The client is created on first use. A client inherited from a parent process
+    (e.g. the gunicorn master) is not fork-safe, so a new client is created if the
+    process id has changed since the client was created.
+
+    The client is closed when the process exits.
+
+    Args:
+        conf: A mapping with the relevant mongo keys available.
+
+    Returns:
+        pymongo.mongo_client.MongoClient: The shared client connection.
+    """
+    pid = os.getpid()
+    if _DBCLIENT["client"] is not None and _DBCLIENT["pid"] == pid:
+        return _DBCLIENT["client"]
+    with _DBCLIENT_LOCK:
+        if _DBCLIENT["client"] is None or _DBCLIENT["pid"] != pid:
+            if _DBCLIENT["pid"] != pid:
+                atexit.register(close_shared_dbclient)
+            _DBCLIENT["client"] = get_dbclient(conf)
+            _DBCLIENT["pid"] = pid
+    return _DBCLIENT["client"]
+
+
+def close_shared_dbclient():
+    """
+    Close the MongoDB client shared by the requests in the current process.
+
+    A client created by another process (before a fork) is dropped without closing it.
+    """
+    with _DBCLIENT_LOCK:
+        client = _DBCLIENT["client"]
+        if client is not None and _DBCLIENT["pid"] == os.getpid():
+            client.close()
+        _DBCLIENT["client"] = None
+        _DBCLIENT["pid"] = None
+
+
 def get_db(dbserver: pymongo.mongo_client.MongoClient, conf) -> pymongo.database.Database:
     """
     Get the connection to the MongoDB database.
@@ -280,20 +556,100 @@ def response_json(data: dict):
     """
     Prepare a json response from the provided data.
 
+    ``_id`` is renamed to ``id`` and the request path is added as ``url``
+    (see ``serializer.dumps``). ``data`` is not modified.
+
+    Args:
+        data (dict): Structure to make into a response.
+
+    Returns:
+        flask.Response: Prepared response containing the json structure.
+    """
+    if isinstance(data, dict):
+        data = dict(data, url=flask.request.path)
+    return flask.Response(serializer.dumps(data), mimetype="application/json")
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def response_json_stream(data: dict, key: str):
+    """
+    Prepare a streamed json response where ``data[key]`` is an iterable of entries.
+
+    The entries are encoded one at a time, so e.g. a database cursor can be returned
+    without keeping all the entries in memory. ``_id`` is renamed to ``id`` in each entry.
+
+    If the client accepts ``application/x-ndjson`` (and prefers it over
+    ``application/json``), one entry per line is returned instead. The other fields
+    in ``data`` are then not included, except ``next_cursor`` which is sent in the
+    header ``X-Next-Cursor``.
+
     Args:
-        date (dict): Structure to make into a respone.
+        data (dict): Structure to make into a response.
+        key (str): The key for the entries in ``data``.
 
     Returns:
-        flask.Response: Prepared response containing json structure with camelBack keys.
+        flask.Response: Streamed response.
     """
-    url = flask.request.path
-    prepare_response(data, url)
-    return flask.jsonify(data)
+    entries = data.pop(key)
+    accept = flask.request.accept_mimetypes
+    if accept[NDJSON_MIMETYPE] and accept[NDJSON_MIMETYPE] >= accept["application/json"]:
+        response = flask.Response(
+            flask.stream_with_context(_stream_ndjson(entries)), mimetype=NDJSON_MIMETYPE
+        )
+        if data.get("next_cursor"):
+            response.headers["X-Next-Cursor"] = data["next_cursor"]
+        return response
+    data["url"] = flask.request.path
+    return flask.Response(
+        flask.stream_with_context(_stream_json(data, key, entries)), mimetype="application/json"
+    )
+
+
+def _chunked(parts: Iterable[bytes]) -> Iterator[bytes]:
+    """Join the parts into chunks of about ``STREAM_CHUNK_SIZE`` bytes."""
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _encode_entries(entries: Iterable[dict], separator: bytes) -> Iterator[bytes]:
+    """Encode the entries as json, with ``separator`` between them."""
+    for i, entry in enumerate(entries):
+        if i:
+            yield separator
+        yield serializer.dumps(entry)
+
+
+def _stream_json(data: dict, key: str, entries: Iterable[dict]) -> Iterator[bytes]:
+    """Generate the json document ``data`` with ``entries`` as ``data[key]``."""
+    head = serializer.dumps(data)[:-1]
+    if data:
+        head += b","
+    parts = chain(
+        (head, serializer.dumps(key), b":["), _encode_entries(entries, b","), (b"]}\n",)
+    )
+    yield from _chunked(parts)
+
+
+def _stream_ndjson(entries: Iterable[dict]) -> Iterator[bytes]:
+    """Generate one json line per entry."""
+    yield from _chunked(chain(_encode_entries(entries, b"\n"), (b"\n",)))
 
 
 def prepare_response(data: dict, url: str = ""):
     """
-    Prepare the fields before running jsonify.
+    Prepare the fields in the same way as ``response_json``.
 
     ``data`` is modified in-place.
 
@@ -327,6 +683,316 @@ def prepare_response(data: dict, url: str = ""):
         data = fix_id(data)
 
 
+# list requests
+# Types allowed as the sort value in a cursor token
+CURSOR_VALUE_TYPES = (str, int, float, bool, type(None), datetime.datetime)
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encode the position in a sorted list as a cursor token.
+
+    Datetimes are kept as datetimes when decoded.
+
+    Args:
+        values (list): The sort value and ``_id`` of the last returned entry.
+
+    Returns:
+        str: The cursor token.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values, default=_cursor_value).encode()).decode()
+
+
+def _cursor_value(value: Any) -> Any:
+    """Encode values that are not supported by json in a cursor token."""
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _cursor_hook(value: dict) -> Any:
+    """Decode the values encoded by ``_cursor_value``."""
+    if set(value) == {"$date"}:
+        return datetime.datetime.fromisoformat(value["$date"])
+    return value
+
+
+def decode_cursor(token: str) -> list:
+    """
+    Decode a cursor token from ``encode_cursor``.
+
+    The sort value must be a scalar or a datetime, since it is used as a value in the
+    query (a dict could e.g. be a query operator).
+
+    Args:
+        token (str): The cursor token.
+
+    Returns:
+        list: The sort value and ``_id`` of the last returned entry.
+
+    Raises:
+        ValueError: Bad cursor token.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()), object_hook=_cursor_hook)
+    except (ValueError, TypeError) as err:
+        raise ValueError(f"Bad cursor ({token})") from err
+    if (
+        not isinstance(values, list)
+        or len(values) != 2
+        or not isinstance(values[0], CURSOR_VALUE_TYPES)
+        or not isinstance(values[1], str)
+    ):
+        raise ValueError(f"Bad cursor ({token})")
+    return values
+
+
+def parse_list_query(args: dict, allowed_fields: tuple, sort_fields: tuple) -> ListQuery:
+    """
+    Parse the query parameters for a list request.
+
+    * ``limit``: Max number of entries to return; enables pagination (1 - ``MAX_LIST_LIMIT``).
+    * ``after``: Cursor token (``next_cursor`` of the previous page).
+    * ``sort``: Field to sort by, prefixed with ``-`` for descending order (``id`` for ``_id``).
+    * ``fields``: Comma-separated list of fields to include (``_id`` is always included).
+
+    Args:
+        args (dict): The query parameters.
+        allowed_fields (tuple): Fields that may be requested with ``fields``.
+        sort_fields (tuple): Fields that may be used with ``sort``.
+
+    Returns:
+        ListQuery: The parsed parameters; ``sort`` is ``(field, direction)``.
+
+    Raises:
+        ValueError: Bad parameter value.
+    """
+    limit = None
+    if args.get("limit") is not None:
+        try:
+            limit = int(args["limit"])
+        except ValueError as err:
+            raise ValueError(f"Bad limit ({args['limit']})") from err
+        if not 0 < limit <= MAX_LIST_LIMIT:
+            raise ValueError(f"Limit must be 1-{MAX_LIST_LIMIT} ({limit})")
+
+    after = decode_cursor(args["after"]) if args.get("after") else None
+
+    sort = ("_id", pymongo.ASCENDING)
+    if args.get("sort"):
+        sort_field = args["sort"].lstrip("-")
+        if sort_field == "id":
+            sort_field = "_id"
+        if sort_field not in sort_fields:
+            raise ValueError(f"Bad sort field ({sort_field})")
+        direction = pymongo.DESCENDING if args["sort"].startswith("-") else pymongo.ASCENDING
+        sort = (sort_field, direction)
+
+    fields = None
+    if args.get("fields"):
+        fields = tuple(
+            field for field in args["fields"].split(",") if field not in ("_id", "id")
+        )
+        for field in fields:
+            if field not in allowed_fields:
+                raise ValueError(f"Bad field ({field})")
+    return ListQuery(limit=limit, after=after, sort=sort, fields=fields)
+
+
+def list_entries(  # pylint: disable=too-many-locals
+    db, dbcollection: str, query: dict, projection: dict, list_query: ListQuery
+):
+    """
+    Get entries from a collection using keyset pagination.
+
+    The entries are sorted by ``list_query.sort``, with ``_id`` as tie-breaker,
+    and start after the position in ``list_query.after``.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): Name of the collection.
+        query (dict): Filter for the entries.
+        projection (dict): Projection used if ``list_query.fields`` is not set.
+        list_query (ListQuery): The parsed list parameters.
+
+    Returns:
+        tuple: (the entries, ``str``: cursor for the next page or ``None``). Without
+            ``limit``, the entries are an iterator over the database cursor.
+    """
+    sort_field, direction = list_query.sort
+    if list_query.fields is not None:
+        projection = {field: 1 for field in list_query.fields}
+    hide_sort_field = False
+    if sort_field != "_id" and projection.get(sort_field) == 0:
+        raise ValueError(f"Sorting by hidden field ({sort_field})")
+    if sort_field != "_id" and 1 in projection.values() and sort_field not in projection:
+        projection = dict(projection, **{sort_field: 1})
+        hide_sort_field = True
+
+    if list_query.after:
+        operator = "$gt" if direction == pymongo.ASCENDING else "$lt"
+        last_value, last_id = list_query.after
+        if sort_field == "_id":
+            position = {"_id": {operator: last_id}}
+        else:
+            position = {
+                "$or": [
+                    {sort_field: {operator: last_value}},
+                    {sort_field: last_value, "_id": {operator: last_id}},
+                ]
+            }
+        query = {"$and": [query, position]} if query else position
+
+    sort = [(sort_field, direction)]
+    if sort_field != "_id":
+        sort.append(("_id", direction))
+    cursor = db[dbcollection].find(query, projection=projection).sort(sort)
+    if not list_query.limit:
+        if hide_sort_field:
+            return _drop_field(cursor, sort_field), None
+        return cursor, None
+
+    entries = list(cursor.limit(list_query.limit + 1))
+    next_cursor = None
+    if len(entries) > list_query.limit:
+        entries = entries[: list_query.limit]
+        last = entries[-1]
+        next_cursor = encode_cursor([last.get(sort_field), last["_id"]])
+    if hide_sort_field:
+        for entry in entries:
+            entry.pop(sort_field, None)
+    return entries, next_cursor
+
+
+def _drop_field(entries: Iterable[dict], field: str) -> Iterator[dict]:
+    """Remove ``field`` from each entry."""
+    for entry in entries:
+        entry.pop(field, None)
+        yield entry
+
+
+# pylint: disable=too-many-arguments
+def req_list_entries(
+    dbcollection: str,
+    key: str,
+    query: dict,
+    projection: dict,
+    allowed_fields: tuple,
+    sort_fields: tuple = ("_id", "title"),
+) -> dict:
+    """
+    List entries for a Flask request, using the list parameters of the request.
+
+    See ``parse_list_query`` for the parameters. Without any of them, all entries
+    are returned as before. If ``limit`` is set, ``next_cursor`` is included;
+    it is ``None`` for the last page.
+
+    The entries may be a database cursor, so the result should be returned
+    with ``response_json_stream``.
+
+    Aborts with status 400 if a parameter is bad.
+
+    Args:
+        dbcollection (str): Name of the collection.
+        key (str): Key for the entries in the response (e.g. ``datasets``).
+        query (dict): Filter for the entries.
+        projection (dict): Default projection.
+        allowed_fields (tuple): Fields that may be requested with ``fields``.
+        sort_fields (tuple): Fields that may be used with ``sort``.
+
+    Returns:
+        dict: The data for the response.
+    """
+    try:
+        list_query = parse_list_query(flask.request.args, allowed_fields, sort_fields)
+        entries, next_cursor = list_entries(
+            flask.g.db, dbcollection, query, projection, list_query
+        )
+    except ValueError as err:
+        flask.current_app.logger.debug("Bad list parameters: %s", err)
+        flask.abort(status=400)
+    result = {key: entries}
+    if list_query.limit:
+        result["next_cursor"] = next_cursor
+    return result
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    """
+    Parse an ISO 8601 timestamp from a request.
+
+    Timestamps with a timezone are converted to local time, like the stored
+    timestamps (see ``make_timestamp``).
+
+    Args:
+        value (str): The timestamp, e.g. ``2021-05-01`` or ``2021-05-01T12:00:00+02:00``.
+
+    Returns:
+        datetime.datetime: The timestamp.
+
+    Raises:
+        ValueError: Bad timestamp.
+    """
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except ValueError as err:
+        raise ValueError(f"Bad timestamp ({value})") from err
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def req_list_logs(query: dict, projection: dict = None) -> dict:
+    """
+    List logs for a Flask request, sorted by ``timestamp``.
+
+    Query parameters:
+
+    * ``since``: Only include logs from this time or later (see ``parse_timestamp``).
+    * ``until``: Only include logs up to and including this time.
+    * ``limit``: Max number of logs to return (1 - ``MAX_LIST_LIMIT``); ``next_cursor``
+      is then included, ``None`` for the last page.
+    * ``after``: Cursor token (``next_cursor`` of the previous page).
+
+    The logs are a database cursor if ``limit`` is not set, so the result should be
+    returned with ``response_json_stream``. The queries use the indexes on
+    ``(data_type, data._id, timestamp, _id)`` and ``(user, timestamp, _id)``.
+
+    Aborts with status 400 if a parameter is bad.
+
+    Args:
+        query (dict): Filter for the logs, e.g. ``{"user": identifier}``.
+        projection (dict): The projection, ``LOG_PROJECTION`` by default.
+
+    Returns:
+        dict: ``{"logs": ...}`` and, if paginated, ``next_cursor``.
+    """
+    args = flask.request.args
+    try:
+        time_range = {}
+        if args.get("since"):
+            time_range["$gte"] = parse_timestamp(args["since"])
+        if args.get("until"):
+            time_range["$lte"] = parse_timestamp(args["until"])
+        if time_range:
+            query = dict(query, timestamp=time_range)
+        list_query = parse_list_query(
+            {key: args.get(key) for key in ("limit", "after")}, (), ()
+        )._replace(sort=("timestamp", pymongo.ASCENDING))
+        logs, next_cursor = list_entries(
+            flask.g.db, "logs", query, projection or changelog.LOG_PROJECTION, list_query
+        )
+    except ValueError as err:
+        flask.current_app.logger.debug("Bad log parameters: %s", err)
+        flask.abort(status=400)
+    result = {"logs": logs}
+    if list_query.limit:
+        result["next_cursor"] = next_cursor
+    return result
+
+
 def make_timestamp():
     """
     Generate a timestamp of the current time.
@@ -349,7 +1015,7 @@ def make_log(
     """
     Log a change in the system.
 
-    Saves a complete copy of the new object.
+    Saves the changes compared to the previous log of the entry (see ``log_changes``).
 
     Warning:
         It is assumed that all values are exactly like in the db,
@@ -367,47 +1033,50 @@ def make_log(
     Returns:
         bool: Whether the log insertion successed.
     """
-    log = structure.log()
     if no_user:
         active_user = "system"
     else:
         active_user = flask.g.current_user["_id"]
 
-    log.update(
-        {
-            "action": action,
-            "comment": comment,
-            "data_type": data_type,
-            "data": data,
-            "user": active_user,
-        }
-    )
-    result = flask.g.db["logs"].insert_one(log, session=dbsession)
-    if not result.acknowledged:
+    log = changelog.new_log(flask.g.db, data_type, action, comment, active_user, data, dbsession)
+    success = changelog.insert_logs(flask.g.db, [log], dbsession)
+    if not success:
         flask.current_app.logger.error(
             f"Log failed: A:{action} C:{comment} D:{data} "
             + f'DT: {data_type} U: {flask.g.current_user["_id"]}'
         )
-    return bool(result.acknowledged)
+    return success
 
 
-def incremental_logs(logs: list):
+def req_log_state_response(data_type: str, identifier: Any, hidden: tuple = ()):
     """
-    Make an incremental log.
+    Prepare a response with an entry as it was at the time in the parameter ``timestamp``.
+
+    The entry is rebuilt from the logs (see ``log_state``).
 
-    The log starts from the first log and keeps only
-    the changed fields in ``data``.
+    Aborts with status 400 if ``timestamp`` is missing or bad, and with 404 if the entry
+    did not exist at that time.
+
+    Args:
+        data_type (str): The type of the entry (e.g. ``dataset``).
+        identifier: The ``_id`` of the entry.
+        hidden (tuple): Fields whose values should be hidden.
 
-    ``logs`` is changed in-place.
+    Returns:
+        flask.Response: JSON structure with the entry and its revision.
     """
-    logs.sort(key=lambda x: x["timestamp"])
-    for i in range(len(logs) - 1, 0, -1):
-        del_keys = []
-        for key in logs[i]["data"]:
-            if logs[i]["data"][key] == logs[i - 1]["data"][key]:
-                del_keys.append(key)
-        for key in del_keys:
-            del logs[i]["data"][key]
+    try:
+        timestamp = parse_timestamp(flask.request.args.get("timestamp", ""))
+    except ValueError as err:
+        flask.current_app.logger.debug("Bad timestamp: %s", err)
+        flask.abort(status=400)
+    revision, state = changelog.log_state(flask.g.db, data_type, identifier, timestamp)
+    if not state:
+        flask.abort(status=404)
+    for field in hidden:
+        if field in state:
+            state[field] = "<hidden>"
+    return response_json({data_type: state, "revision": revision})
 
 
 def check_email_uuid(user_identifier: str) -> str:
@@ -438,6 +1107,10 @@ def check_email_uuid(user_identifier: str) -> str:
     return ""
 
 
+# Fields that are shown when a user is referenced from e.g. an order
+USER_FIELDS = ("_id", "affiliation", "name", "contact", "url", "orcid")
+
+
 def user_uuid_data(user_ids: Union[str, list], mongodb: pymongo.database.Database) -> list:
     """
     Retrieve some extra information about a user using a uuid as input.
@@ -454,17 +1127,100 @@ def user_uuid_data(user_ids: Union[str, list], mongodb: pymongo.database.Databas
     if not isinstance(user_ids, list):
         user_ids = [user_ids]
     data = mongodb["users"].find({"_id": {"$in": user_ids}})
-    return [
-        {
-            "_id": entry["_id"],
-            "affiliation": entry["affiliation"],
-            "name": entry["name"],
-            "contact": entry["contact"],
-            "url": entry["url"],
-            "orcid": entry["orcid"],
-        }
-        for entry in data
-    ]
+    return [{field: entry[field] for field in USER_FIELDS} for entry in data]
+
+
+def resolve_users(entries: list, fields: tuple, mongodb: pymongo.database.Database) -> dict:
+    """
+    Replace user identifiers with information about the users, using a single query.
+
+    All identifiers in ``fields`` of all ``entries`` are collected and looked up
+    with one ``$in`` query. The entries are changed in-place:
+
+    * A list of identifiers is replaced by a list of users, in the same order.
+      Identifiers not found in the db are dropped.
+    * A single identifier is replaced by the user if it is found in the db.
+
+    Args:
+        entries (list): The entries (e.g. orders) to update.
+        fields (tuple): The fields containing user identifiers.
+        mongodb (pymongo.database.Database): The Mongo database to use for the query.
+
+    Returns:
+        dict: The found users by ``_id`` (fields in ``USER_FIELDS``).
+    """
+    user_ids = set()
+    for entry in entries:
+        for field in fields:
+            value = entry.get(field)
+            if isinstance(value, list):
+                user_ids.update(value)
+            elif isinstance(value, str) and value:
+                user_ids.add(value)
+    if not user_ids:
+        return {}
+
+    users = {
+        user_entry["_id"]: user_entry
+        for user_entry in mongodb["users"].find(
+            {"_id": {"$in": list(user_ids)}}, {field: 1 for field in USER_FIELDS}
+        )
+    }
+    for entry in entries:
+        for field in fields:
+            value = entry.get(field)
+            if isinstance(value, list):
+                entry[field] = [dict(users[uid]) for uid in value if uid in users]
+            elif isinstance(value, str) and value in users:
+                entry[field] = dict(users[value])
+    return users
+
+
+def get_titles(db, dbcollection: str, identifiers: list) -> tuple:
+    """
+    Get ``{_id, title}`` for a list of identifiers using a single query.
+
+    The entries are returned in the same order as ``identifiers``.
+
+    Args:
+        db: Connection to the database.
+        dbcollection (str): Name of the collection with the entries (e.g. ``datasets``).
+        identifiers (list): The ``_id`` of the entries.
+
+    Returns:
+        tuple: (``list``: the found entries, ``list``: identifiers not found in the db)
+    """
+    if not identifiers:
+        return [], []
+    found = {
+        entry["_id"]: entry
+        for entry in db[dbcollection].find({"_id": {"$in": list(identifiers)}}, {"title": 1})
+    }
+    entries = []
+    missing = []
+    for identifier in identifiers:
+        if identifier in found:
+            entries.append(dict(found[identifier]))
+        else:
+            missing.append(identifier)
+    return entries, missing
+
+
+def expand_permissions(permissions: list) -> frozenset:
+    """
+    Get the full set of permissions granted by the permissions of a user.
+
+    Args:
+        permissions (list): The raw list of permissions from the user entry.
+
+    Returns:
+        frozenset: All permissions the user has.
+    """
+    if not permissions:
+        return frozenset()
+    return frozenset(
+        chain.from_iterable(user.PERMISSIONS[permission] for permission in permissions)
+    )
 
 
 def req_check_permissions(permissions: list):
@@ -483,10 +1239,13 @@ def req_check_permissions(permissions: list):
         permissions=permissions,
         user_permissions=flask.g.permissions,
         logged_in=bool(flask.g.current_user),
+        expanded=True,
     )
 
 
-def check_permissions(permissions: list, user_permissions: list, logged_in: bool) -> int:
+def check_permissions(
+    permissions: list, user_permissions: list, logged_in: bool, expanded: bool = False
+) -> int:
     """
     Perform the standard permissions check for a request.
 
@@ -499,17 +1258,16 @@ def check_permissions(permissions: list, user_permissions: list, logged_in: bool
         permissions (list): The required permissions.
         user_permissions (list): List of permissions for the user.
         logged_in (bool): Whether the current user is logged in.
+        expanded (bool): Whether ``user_permissions`` is already expanded
+            (see ``expand_permissions``).
 
     Returns:
         int: The suggested status code.
     """
     if not logged_in:
         return 401
-    if not user_permissions and permissions:
-        return 403
-    user_permissions = set(
-        chain.from_iterable(user.PERMISSIONS[permission] for permission in user_permissions)
-    )
+    if not expanded:
+        user_permissions = expand_permissions(user_permissions)
     for perm in permissions:
         if perm not in user_permissions:
             return 403
@@ -520,37 +1278,35 @@ def req_has_permission(permission: str):
     """
     Check if the current user permissions fulfills the requirement.
 
+    Uses the expanded permissions in ``flask.g.permissions``.
+
     Args:
         permission (str): The required permission
-        user_permissions (list): List of permissions for the user.
-            Should be ``flask.g.permissions`` for most requests.
 
     Returns:
         bool: whether the user has the required permissions or not
     """
-    return has_permission(permission, flask.g.permissions)
+    return has_permission(permission, flask.g.permissions, expanded=True)
 
 
-def has_permission(permission: str, user_permissions: list):
+def has_permission(permission: str, user_permissions: list, expanded: bool = False):
     """
     Check if the current user permissions fulfills the requirement.
 
     Args:
         permission (str): The required permission
         user_permissions (list): List of permissions for the user.
-            Should be ``flask.g.permissions`` for most requests.
+        expanded (bool): Whether ``user_permissions`` is already expanded
+            (see ``expand_permissions``).
 
     Returns:
         bool: whether the user has the required permissions or not
     """
-    if not user_permissions and permission:
+    if not user_permissions:
         return False
-    full_user_permissions = set(
-        chain.from_iterable(user.PERMISSIONS[permission] for permission in user_permissions)
-    )
-    if permission not in full_user_permissions:
-        return False
-    return True
+    if not expanded:
+        user_permissions = expand_permissions(user_permissions)
+    return permission in user_permissions
 
 
 def req_make_log_new(
@@ -564,7 +1320,7 @@ def req_make_log_new(
 
     Wrapper for Flask requests.
 
-    Saves a complete copy of the new object.
+    Saves the changes compared to the previous log of the entry (see ``log_changes``).
 
     Warning:
         It is assumed that all values are exactly like in the db,
@@ -603,7 +1359,7 @@ def make_log_new(
     """
     Log a change in the system.
 
-    Saves a complete copy of the new object.
+    Saves the changes compared to the previous log of the entry (see ``log_changes``).
 
     Warning:
         It is assumed that all values are exactly like in the db,
@@ -627,17 +1383,8 @@ def make_log_new(
     """
     if not data:
         raise ValueError("Empty data is not allowed")
-    log = structure.log()
-    log.update(
-        {
-            "action": action,
-            "comment": comment,
-            "data_type": data_type,
-            "data": data,
-            "user": user_id,
-        }
-    )
-    success = db["logs"].insert_one(log).acknowledged
+    log = changelog.new_log(db, data_type, action, comment, user_id, data)
+    success = changelog.insert_logs(db, [log])
     if not success and logger:
         logger.error(
             "Log addition failed: A: %s C: %s D: %s DT: %s U: %s",
@@ -699,36 +1446,35 @@ def req_commit_to_db(
 
     Data should contain ``{_id: uuid}}`` if there is a deletion.
 
+    The change and its log are written together (see ``unit_of_work.UnitOfWork``).
+
     Args:
         dbcollection (str): Name of the target database collection.
         operation (str): Operation to perform (add, edit, delete).
         data (dict): Data to commit to db.
         comment (str): Custom comment for the log.
+
+    Raises:
+        ValueError: Missing ``_id`` in ``data``, or bad operation type.
     """
     if not comment:
         comment = f"{operation.capitalize()} in {dbcollection}"
-    data_res = {"ack": False, "ins_id": None}
-    result = commit_to_db(
-        flask.g.db,
-        dbcollection,
-        operation,
-        data,
-        logger=flask.current_app.logger,
+    if "_id" not in data:
+        raise ValueError(f"_id must be included in data for {operation} operations")
+    work = unit_of_work.UnitOfWork(
+        flask.g.db, flask.g.current_user["_id"], logger=flask.current_app.logger
     )
-    data_res["ack"] = result.acknowledged
-    log_res = False
-
-    if data_res["ack"]:
-        if operation == "add":
-            data_res["ins_id"] = result.inserted_id
-            data = flask.g.db[dbcollection].find_one({"_id": data_res["ins_id"]})
-        log_res = req_make_log_new(
-            data_type=dbcollection[:-1],  # to make singular (e.g. collection|s)
-            action=operation,
-            comment=comment,
-            data=data,
-        )
-    return CommitResult(data=data_res["ack"], log=log_res, ins_id=data_res["ins_id"])
+    if operation == "add":
+        work.add(dbcollection, data, comment)
+    elif operation == "edit":
+        work.edit(dbcollection, data, comment=comment)
+    elif operation == "delete":
+        work.delete(dbcollection, data["_id"], comment)
+    else:
+        raise ValueError(f"Bad operation type ({operation})")
+    success = work.commit()
+    ins_id = data["_id"] if success and operation == "add" else None
+    return CommitResult(data=success, log=success, ins_id=ins_id)
 
 
 def commit_to_db(
@@ -743,39 +1489,140 @@ def commit_to_db(
 
     ``_id`` should be included in ``data`` for delete and update operations.
 
-    Only uses <type>_one commands for the db.
+    Only uses <type>_one commands for the db. The revision counters (``bump_revisions``)
+    and the facet counts (``facets.update_facets``) are updated after the change.
 
     Args:
         db: Connection to the database (client).
         dbcollection (str): Name of the target collection.
         operation (str): Operation to perform (add, edit, delete).
         data (dict): Data to commit to db.
-        id (dict): The entry to perform the operation on (_id).
         logger: The logging object to use for errors.
 
     Raises:
         ValueError: Missing ``_id`` in ``data`` for delete or update, or bad operation type.
 
     Returns:
-        dict: The response from the db commit.
+        DbResult: Whether the change was acknowledged, the ``_id`` of an added entry and
+            the ``tags`` and ``properties`` of the entry before an edit or delete
+            (``None`` if not found).
     """
+    previous = None
     if operation == "add":
-        result = db[dbcollection].insert_one(data)
+        insert_result = db[dbcollection].insert_one(data)
+        result = DbResult(insert_result.acknowledged, insert_result.inserted_id, None)
     elif operation in ("delete", "edit"):
         if "_id" not in data:
             raise ValueError(f"_id must be included in data for {operation} operations")
+        projection = {"tags": 1, "properties": 1}
         if operation == "delete":
-            result = db[dbcollection].delete_one({"_id": data["_id"]})
+            previous = db[dbcollection].find_one_and_delete(
+                {"_id": data["_id"]}, projection=projection
+            )
         else:
-            result = db[dbcollection].update_one({"_id": data["_id"]}, {"$set": data})
+            previous = db[dbcollection].find_one_and_update(
+                {"_id": data["_id"]},
+                {"$set": data},
+                projection=projection,
+                return_document=pymongo.ReturnDocument.BEFORE,
+            )
+        result = DbResult(True, None, previous)
     else:
         raise ValueError(f"Bad operation type ({operation})")
 
-    if not result.acknowledged and logger:
-        logger.error("Database %s of %s failed", operation, dbcollection)
+    if not result.acknowledged:
+        if logger:
+            logger.error("Database %s of %s failed", operation, dbcollection)
+        return result
+
+    identifier = result.inserted_id if operation == "add" else data["_id"]
+    changelog.bump_revisions(db, dbcollection, [identifier])
+    if operation == "add":
+        facets.update_facets(db, dbcollection, None, data)
+    elif previous:
+        after = None if operation == "delete" else {**previous, **data}
+        facets.update_facets(db, dbcollection, previous, after)
     return result
 
 
+def req_facets_response(dbcollection: str, query: dict = None) -> flask.Response:
+    """
+    Prepare a response with the facet counts of a collection.
+
+    If ``query`` is set, only the matching entries are counted (by scanning them);
+    otherwise the stored counts are used.
+
+    Args:
+        dbcollection (str): The collection.
+        query (dict): Filter for the entries the user may see.
+
+    Returns:
+        flask.Response: The facets as json.
+    """
+    if query is None:
+        result = facets.get_facets(flask.g.db, dbcollection)
+    else:
+        result = facets.format_facets(facets.count_facets(flask.g.db, dbcollection, query).items())
+    return response_json({"facets": result})
+
+
+def req_etag(dbcollection: str, identifier: Any = None, depends: tuple = ()) -> str:
+    """
+    Compute the ETag for a response from the revision counters.
+
+    The ETag changes when the entry (or the collection if ``identifier`` is ``None``)
+    or any collection in ``depends`` is changed. It also differs between users, as
+    the responses depend on the permissions, and between query strings.
+
+    Args:
+        dbcollection (str): Name of the collection of the response.
+        identifier (Any): The ``_id`` of the entry, ``None`` for a list.
+        depends (tuple): Collections with entries included in the response.
+
+    Returns:
+        str: The ETag (without quotes).
+    """
+    keys = [changelog.REVISION_ALL, changelog.revision_key(dbcollection, identifier)]
+    keys += depends
+    user_id = flask.g.current_user["_id"] if flask.g.current_user else None
+    parts = [
+        keys,
+        changelog.get_revisions(flask.g.db, keys),
+        user_id,
+        sorted(flask.g.permissions),
+        flask.request.query_string.decode(),
+    ]
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+
+def req_not_modified(etag: str) -> bool:
+    """
+    Check whether ``etag`` matches ``If-None-Match`` of the request.
+
+    Args:
+        etag (str): The current ETag.
+
+    Returns:
+        bool: Whether the client already has the current version.
+    """
+    return flask.request.if_none_match.contains_weak(etag)
+
+
+def response_not_modified(etag: str) -> flask.Response:
+    """
+    Prepare a ``304 Not Modified`` response.
+
+    Args:
+        etag (str): The current ETag.
+
+    Returns:
+        flask.Response: The response.
+    """
+    response = flask.Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
 def prepare_for_db(data: dict) -> dict:
     """
     Prepare incoming data for the database.
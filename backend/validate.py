@@ -3,9 +3,14 @@ Validators for indata.
 
 Indata can be sent to ``validate_field``, which will use the corresponding
 functions to check each field.
+
+Fields referencing other entries (e.g. ``authors``) are checked against the db.
+Identifiers known to exist are remembered for the rest of the request,
+and ``prefetch_references`` can be used to check all fields with one query
+per referenced collection.
 """
 import re
-from typing import Any
+from typing import Any, Iterable
 
 import flask
 
@@ -46,6 +51,67 @@ def validate_field(field_key: str, field_value: Any, testing=False) -> bool:
     return True
 
 
+def known_identifiers(dbcollection: str, identifiers: Iterable, db=None) -> set:
+    """
+    Get the identifiers that exist in a collection.
+
+    If ``db`` is not set (i.e. ``flask.g.db`` is used), the identifiers found are kept
+    for the rest of the request and only unknown identifiers are looked up.
+    All unknown identifiers are checked using a single query.
+
+    Args:
+        dbcollection (str): The collection to check (e.g. ``users``).
+        identifiers (Iterable): The identifiers to check.
+        db: The database to use. Defaults to ``flask.g.db``.
+
+    Returns:
+        set: Known identifiers in the collection; may include more than ``identifiers``.
+    """
+    if db is None:
+        db = flask.g.db
+        if "known_ids" not in flask.g:
+            flask.g.known_ids = {}
+        known = flask.g.known_ids.setdefault(dbcollection, set())
+    else:
+        known = set()
+    unknown = [identifier for identifier in set(identifiers) if identifier not in known]
+    if unknown:
+        known.update(
+            entry["_id"] for entry in db[dbcollection].find({"_id": {"$in": unknown}}, {"_id": 1})
+        )
+    return known
+
+
+def prefetch_references(*indata: dict):
+    """
+    Check all referenced identifiers in ``indata`` with one query per collection.
+
+    Multiple entries can be given, e.g. for bulk requests.
+
+    The results are kept for the rest of the request (see ``known_identifiers``),
+    so the following field validations do not need to query the db.
+    Values of the wrong type are skipped; they are rejected by the validators.
+
+    Must be called from inside a Flask request (``flask.g.db`` is used).
+
+    Args:
+        *indata (dict): The incoming data.
+    """
+    references = {}
+    for entry_data in indata:
+        for field, value in entry_data.items():
+            if field not in REFERENCE_FIELDS:
+                continue
+            if isinstance(value, str) and value:
+                value = [value]
+            if isinstance(value, list):
+                references.setdefault(REFERENCE_FIELDS[field], set()).update(
+                    entry for entry in value if isinstance(entry, str)
+                )
+    for dbcollection, identifiers in references.items():
+        known_identifiers(dbcollection, identifiers)
+
+
 def validate_datasets(data: list, db=None) -> bool:
     """
     Validate input for the ``datasets`` field.
@@ -63,14 +129,14 @@ def validate_datasets(data: list, db=None) -> bool:
     Raises:
         ValueError: Validation failed.
     """
-    if db is None:
-        db = flask.g.db
     if not isinstance(data, list):
         raise ValueError(f"Must be list ({data})")
     for ds_entry in data:
         if not isinstance(ds_entry, str):
             raise ValueError(f"Must be str ({ds_entry})")
-        if not db["datasets"].find_one({"_id": ds_entry}):
+    known = known_identifiers("datasets", data, db)
+    for ds_entry in data:
+        if ds_entry not in known:
             raise ValueError(f"Identifier not in db ({ds_entry})")
     return True
 
@@ -308,13 +374,11 @@ def validate_user(data: str, db=None) -> bool:
     Raises:
         ValueError: Validation failed.
     """
-    if db is None:
-        db = flask.g.db
     if not isinstance(data, str):
         raise ValueError(f"Bad data type (must be str): {data}")
     if not data:
         return True
-    if not db["users"].find_one({"_id": data}):
+    if data not in known_identifiers("users", [data], db):
         raise ValueError(f"Identifier not in db ({data})")
     return True
 
@@ -338,19 +402,28 @@ def validate_user_list(data: list, db=None) -> bool:
     Raises:
         ValueError: Validation failed.
     """
-    if db is None:
-        db = flask.g.db
     if not isinstance(data, list):
         raise ValueError(f"Bad data type (must be list): {data}")
 
     for identifier in data:
         if not isinstance(identifier, str):
             raise ValueError("Bad identifier (should be str)")
-        if not db["users"].find_one({"_id": identifier}):
+    known = known_identifiers("users", data, db)
+    for identifier in data:
+        if identifier not in known:
             raise ValueError("Identifier not in db")
     return True
 
 
+# Fields containing identifiers of other entries, and the collection of the entries
+REFERENCE_FIELDS = {
+    "authors": "users",
+    "datasets": "datasets",
+    "editors": "users",
+    "generators": "users",
+    "organisation": "users",
+}
+
 VALIDATION_MAPPER = {
     "affiliation": validate_string,
     "auth_ids": validate_list_of_strings,
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the dataset lookup for a collection.
+
+Compares one ``find_one`` per dataset with the single query in ``utils.get_titles``
+for collections with 10, 1k and 10k datasets.
+
+Uses the database in ``config.yaml``. The added entries are removed afterwards.
+
+Run from the root of the repository::
+
+    PYTHONPATH=backend python test/benchmarks/collection_datasets.py
+"""
+import time
+
+import config
+import structure
+import utils
+
+SIZES = (10, 1000, 10000)
+REPEATS = 3
+LABEL = "Benchmark entry"
+
+
+def lookup_per_dataset(db, identifiers: list) -> list:
+    """Get the titles with one query per dataset (previous implementation)."""
+    return [db["datasets"].find_one({"_id": dataset}, {"title": 1}) for dataset in identifiers]
+
+
+def lookup_batched(db, identifiers: list) -> list:
+    """Get the titles with a single query."""
+    return utils.get_titles(db, "datasets", identifiers)[0]
+
+
+def add_datasets(db, nr_datasets: int) -> list:
+    """
+    Add datasets for the benchmark.
+
+    Returns:
+        list: The ``_id`` of the added datasets.
+    """
+    datasets = []
+    for i in range(nr_datasets):
+        dataset = structure.dataset()
+        dataset.update({"title": f"Benchmark dataset {i}", "description": LABEL})
+        datasets.append(dataset)
+    db["datasets"].insert_many(datasets)
+    return [dataset["_id"] for dataset in datasets]
+
+
+def best_time(func, *args) -> float:
+    """Get the fastest of ``REPEATS`` runs of ``func(*args)`` in seconds."""
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    """Run the benchmark and print the results."""
+    conf = config.read_config()
+    dbclient = utils.get_dbclient(conf)
+    db = utils.get_db(dbclient, conf)
+    identifiers = add_datasets(db, max(SIZES))
+    try:
+        print(f"{'datasets':>10} {'per dataset (s)':>16} {'batched (s)':>12} {'speedup':>8}")
+        for size in SIZES:
+            subset = identifiers[:size]
+            assert lookup_per_dataset(db, subset) == lookup_batched(db, subset)
+            old = best_time(lookup_per_dataset, db, subset)
+            new = best_time(lookup_batched, db, subset)
+            print(f"{size:>10} {old:>16.4f} {new:>12.4f} {old / new:>7.1f}x")
+    finally:
+        db["datasets"].delete_many({"description": LABEL})
+        dbclient.close()
+
+
+if __name__ == "__main__":
+    main()
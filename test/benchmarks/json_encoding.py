@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark the json encoding of responses.
+
+Compares ``prepare_response`` + ``flask.jsonify`` (previous implementation) with
+``serializer.dumps`` using the standard library and orjson (if installed).
+
+The payloads are generated orders and datasets with logs, no database is needed.
+
+Run from the root of the repository::
+
+    PYTHONPATH=backend python test/benchmarks/json_encoding.py
+"""
+import copy
+import time
+
+import flask
+
+import serializer
+import structure
+import utils
+
+SIZES = (10, 1000, 10000)
+REPEATS = 5
+
+
+def make_payload(nr_entries: int) -> dict:
+    """
+    Generate a list response with orders, each with a dataset and a log entry.
+
+    Returns:
+        dict: The payload.
+    """
+    orders = []
+    for i in range(nr_entries):
+        dataset = structure.dataset()
+        dataset.update({"title": f"Dataset {i}", "tags": ["benchmark", f"tag-{i % 10}"]})
+        order = structure.order()
+        order.update(
+            {
+                "title": f"Order {i}",
+                "description": "Text " * 50,
+                "authors": [{"_id": utils.new_uuid(), "name": "Author Name"}] * 3,
+                "editors": [utils.new_uuid()] * 2,
+                "datasets": [{"_id": dataset["_id"], "title": dataset["title"]}],
+                "properties": {"key": "value", "number": str(i)},
+            }
+        )
+        log = structure.log()
+        log.update({"action": "add", "data": dataset, "data_type": "dataset"})
+        orders.append({"order": order, "log": log})
+    return {"orders": orders}
+
+
+def encode_jsonify(app, payload: dict) -> bytes:
+    """Encode with ``prepare_response`` and ``flask.jsonify`` (modifies ``payload``)."""
+    with app.test_request_context("/api/v1/order"):
+        utils.prepare_response(payload, "/api/v1/order")
+        return flask.jsonify(payload).get_data()
+
+
+def encode_serializer(app, payload: dict) -> bytes:
+    """Encode with ``utils.response_json``."""
+    with app.test_request_context("/api/v1/order"):
+        return utils.response_json(payload).get_data()
+
+
+def best_time(func, app, payload: dict) -> float:
+    """
+    Get the fastest of ``REPEATS`` runs of ``func(app, payload)`` in seconds.
+
+    Each run gets a new copy of the payload, made before the timing starts.
+    """
+    times = []
+    for _ in range(REPEATS):
+        run_payload = copy.deepcopy(payload)
+        start = time.perf_counter()
+        func(app, run_payload)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    """Run the benchmark and print the results."""
+    app = flask.Flask("benchmark")
+    backends = [name for name in serializer.BACKENDS if name != "orjson" or serializer.orjson]
+    header = f"{'orders':>8} {'jsonify (s)':>12}"
+    for name in backends:
+        header += f" {name + ' (s)':>12} {'speedup':>8}"
+    print(header)
+    for size in SIZES:
+        payload = make_payload(size)
+        old = best_time(encode_jsonify, app, payload)
+        line = f"{size:>8} {old:>12.4f}"
+        for name in backends:
+            serializer.use_backend(name)
+            new = best_time(encode_serializer, app, payload)
+            line += f" {new:>12.4f} {old / new:>7.1f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ import lorem
 import pymongo
 
 import config
+import db_management
 import structure
 import utils
 from user import PERMISSIONS
@@ -31,17 +32,7 @@ def make_description():
 
 
 def make_log(db, action, comment, data_type, data, user):
-    log = structure.log()
-    log.update(
-        {
-            "action": action,
-            "comment": comment,
-            "data_type": data_type,
-            "data": data,
-            "user": user,
-        }
-    )
-    db["logs"].insert_one(log)
+    utils.make_log_new(db, data_type, action, comment, user, data)
 
 
 # generator functions
@@ -467,3 +458,5 @@ if __name__ == "__main__":
     gen_datasets(DB)
     gen_collections(DB)
     gen_frontend_test_entries(DB)
+    # the entries are inserted directly, so the facets must be recounted
+    db_management.rebuild_facets(DB)